@@ -0,0 +1,159 @@
+"""
+Benchmark how accurately members' tracks line up in time, placing frames
+by their RTP timestamps (VoiceTimeline) vs. appending them in the order
+they arrived, one tick at a time (what the stream loop used to do).
+
+Members talk in spurts, and their packets arrive with a fixed network
+latency plus random jitter (so some arrive out of order). Every frame
+starts with a marker sample (its frame number) at a known point in
+time, and each marker is looked for in the member's track in the ring
+buffer. Its error is how far off it is, after the latency common to
+every member is taken out.
+
+A member's fixed network latency can't be recovered from RTP alone, so
+it shows up as their offset. What RTP placement fixes is the spread
+within each member's track, i.e. how far their audio drifts and jitters
+around.
+
+Run from the repo root:
+    python -m benchmarks.bench_alignment
+"""
+# Clipped modules
+from modules.data_streamer import ClipSink, DataStreamer
+
+# Other modules
+import numpy as np
+from typing import Dict, List, Tuple
+
+MEMBERS = 4
+DURATION = 60  # seconds
+SAMPLING_RATE = 48000
+FRAME_SAMPLES = 960  # samples per 20 ms packet
+LATENCY_RANGE = (0.02, 0.06)  # each member's fixed network latency (in seconds)
+JITTER_MEAN = 0.01  # mean of the random extra delay of each packet (in seconds)
+JITTER_MAX = 0.08  # max random extra delay of each packet (in seconds)
+
+Packet = Tuple[float, int, int, int, int]  # arrival time, member ID, frame number, true position, RTP timestamp
+
+
+def make_packets(rng: np.random.Generator) -> List[Packet]:
+    """Every member's packets, in the order they arrive"""
+    packets = []
+    for member_id in range(MEMBERS):
+        latency = rng.uniform(*LATENCY_RANGE)
+        rtp_base = int(rng.integers(0, 2 ** 32))
+        position = int(rng.integers(0, FRAME_SAMPLES))  # senders' frames aren't in phase
+
+        talking = False
+        frame_number = 0
+        while position < (DURATION - 1) * SAMPLING_RATE:
+            # Alternate between talking and pausing (when no packets are sent)
+            spurt = int(rng.uniform(1, 5) if not talking else rng.uniform(0.5, 4)) * SAMPLING_RATE
+            talking = not talking
+            if talking:
+                for frame_position in range(position, position + spurt, FRAME_SAMPLES):
+                    jitter = min(rng.exponential(JITTER_MEAN), JITTER_MAX)
+                    arrival = (frame_position + FRAME_SAMPLES) / SAMPLING_RATE + latency + jitter
+                    frame_number += 1
+                    packets.append((arrival,
+                                    member_id,
+                                    frame_number,
+                                    frame_position,
+                                    (rtp_base + frame_position) % 2 ** 32))
+            position += spurt
+
+    packets.sort()
+    return packets
+
+
+def frame_pcm(frame_number: int) -> bytes:
+    samples = np.zeros((FRAME_SAMPLES, 2), dtype=np.int16)
+    samples[0] = frame_number
+    return samples.tobytes()
+
+
+def rtp_placement(packets: List[Packet]) -> Dict[Tuple[int, int], int]:
+    """Where each (member ID, frame number) ended up, with frames placed by VoiceTimeline"""
+    streamer = DataStreamer(voice=None, history_size=DURATION + 10, chunk_size=1)
+    sink = ClipSink(streamer.audio_buffer.chunk_bytes)
+    sink.timeline.start_time = 0.0
+
+    for arrival, member_id, frame_number, _, rtp_timestamp in packets:
+        while sink.timeline.chunk_ready(DataStreamer.JITTER_LATENCY, now=arrival):
+            streamer._buffer_chunk(sink)
+        sink.write_frame(member_id,
+                         frame_pcm(frame_number),
+                         arrival,
+                         ssrc=member_id,
+                         rtp_timestamp=rtp_timestamp)
+    while sink.timeline.staged_bytes() > 0:
+        streamer._buffer_chunk(sink)
+
+    audio_buffer = streamer.audio_buffer
+    placed = {}
+    for member_id in audio_buffer.member_ids():
+        track = b"".join(audio_buffer.read(member_id, audio_buffer.bytes_written))
+        left = np.frombuffer(track, dtype=np.int16)[::2]
+        for position in np.flatnonzero(left):
+            placed[(member_id, int(left[position]))] = int(position)
+
+    return placed
+
+
+def arrival_placement(packets: List[Packet]) -> Dict[Tuple[int, int], int]:
+    """
+    Where each (member ID, frame number) ended up, with each tick's frames
+    appended in the order they arrived, from the start of the tick's chunk
+    """
+    frames_per_chunk = SAMPLING_RATE // FRAME_SAMPLES
+    ticks: Dict[Tuple[int, int], List[int]] = {}
+    for arrival, member_id, frame_number, _, _ in packets:
+        ticks.setdefault((member_id, int(arrival)), []).append(frame_number)
+
+    placed = {}
+    for (member_id, tick), frame_numbers in ticks.items():
+        # Only the latest chunk's worth of a tick's audio fits
+        for index, frame_number in enumerate(frame_numbers[-frames_per_chunk:]):
+            placed[(member_id, frame_number)] = tick * SAMPLING_RATE + index * FRAME_SAMPLES
+
+    return placed
+
+
+def errors(packets: List[Packet], placed: Dict[Tuple[int, int], int]) -> Dict[int, np.ndarray]:
+    """
+    Each member's marker errors (in ms), with the latency common to every
+    member taken out. Frames that didn't make it into the track are left out.
+    """
+    member_errors: Dict[int, List[float]] = {member_id: [] for member_id in range(MEMBERS)}
+    for _, member_id, frame_number, position, _ in packets:
+        placed_position = placed.get((member_id, frame_number))
+        if placed_position is not None:
+            member_errors[member_id].append((placed_position - position) * 1000 / SAMPLING_RATE)
+
+    common = np.median(np.concatenate([np.array(member_error) for member_error in member_errors.values()]))
+    return {member_id: np.array(member_error) - common
+            for member_id, member_error in member_errors.items()}
+
+
+def report(name: str, member_errors: Dict[int, np.ndarray]) -> None:
+    print(name)
+    print(f"{'member':>8} {'markers':>8} {'offset (ms)':>12} {'spread p95 (ms)':>16} {'max |error| (ms)':>17}")
+    for member_id, member_error in sorted(member_errors.items()):
+        offset = np.median(member_error)
+        spread = np.percentile(np.abs(member_error - offset), 95)
+        print(f"{member_id:>8} {len(member_error):>8} {offset:>12.2f} {spread:>16.2f} "
+              f"{np.max(np.abs(member_error)):>17.2f}")
+
+
+def main():
+    rng = np.random.default_rng(0)
+    packets = make_packets(rng)
+    print(f"{len(packets)} packets from {MEMBERS} members over {DURATION}s\n")
+
+    report("arrival order (per-tick append)", errors(packets, arrival_placement(packets)))
+    print()
+    report("RTP timestamps (VoiceTimeline)", errors(packets, rtp_placement(packets)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Replay harness for the voice receive path: a synthetic voice stream is
+Opus-encoded into packets, put through simulated network conditions
+(loss, and jitter that reorders packets), and received either by
+decoding packets as they arrive (what Pycord does) or through
+JitterBuffer.
+
+Quality is measured against the same stream decoded without any loss:
+- SNR (dB) of the received audio
+- how many frames of speech came out as silence (gaps)
+- how many frame boundaries jump abruptly where the original doesn't
+  (clicks)
+
+CPU cost is the time spent receiving (reordering, decoding and
+concealing) per packet, and how many streams one core could keep up
+with at that rate.
+
+Needs libopus. Run from the repo root:
+    python -m benchmarks.bench_jitter_buffer [--opus-lib PATH] [--seconds 60]
+"""
+# Clipped modules
+from modules.jitter_buffer import JitterBuffer, JitterStats
+
+# Pycord modules
+import discord.opus as op
+
+# Other modules
+import argparse
+import numpy as np
+import sys
+import time
+from typing import Callable, List, Tuple
+
+SAMPLING_RATE = 48000
+FRAME_SAMPLES = 960  # samples per 20 ms packet
+FRAME_DURATION = FRAME_SAMPLES / SAMPLING_RATE
+CLICK_THRESHOLD = 6000  # jump between samples at a frame boundary that's heard as a click
+SCENARIOS = [  # (name, loss rate, mean jitter in seconds)
+    ("clean", 0.0, 0.0),
+    ("jitter 20ms", 0.0, 0.02),
+    ("loss 2%", 0.02, 0.005),
+    ("loss 5% + jitter 20ms", 0.05, 0.02),
+    ("loss 10% + jitter 40ms", 0.10, 0.04),
+]
+
+Packet = Tuple[int, int, bytes]  # sequence, RTP timestamp, Opus payload
+Receiver = Callable[[List[Packet]], Tuple[List[Tuple[int, bytes]], JitterStats]]
+
+
+def make_voice(seconds: float, rng: np.random.Generator) -> np.ndarray:
+    """Voice-like stereo PCM: a gliding harmonic tone, in syllable-length bursts"""
+    t = np.arange(int(seconds * SAMPLING_RATE)) / SAMPLING_RATE
+    pitch = 150 + 40 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLING_RATE
+    tone = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 6))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t + rng.uniform(0, np.pi)), 0, None)
+    mono = (6000 * tone * syllables).astype(np.int16)
+    return np.repeat(mono, 2)
+
+
+def encode(pcm: np.ndarray, rng: np.random.Generator) -> List[Packet]:
+    encoder = op.Encoder()
+    sequence = int(rng.integers(0, 2 ** 16))
+    timestamp = int(rng.integers(0, 2 ** 32))
+    frame_values = FRAME_SAMPLES * 2
+
+    packets = []
+    for i in range(len(pcm) // frame_values):
+        frame = pcm[i * frame_values:(i + 1) * frame_values].tobytes()
+        packets.append(((sequence + i) % 2 ** 16,
+                        (timestamp + i * FRAME_SAMPLES) % 2 ** 32,
+                        encoder.encode(frame, FRAME_SAMPLES)))
+    return packets
+
+
+def network(packets: List[Packet],
+            loss_rate: float,
+            jitter: float,
+            rng: np.random.Generator) -> List[Packet]:
+    """The packets that make it through, in the order they arrive"""
+    arrivals = []
+    for i, packet in enumerate(packets):
+        if rng.random() < loss_rate:
+            continue
+        delay = rng.exponential(jitter) if jitter > 0 else 0.0
+        arrivals.append((i * FRAME_DURATION + delay, packet))
+
+    arrivals.sort(key=lambda arrival: arrival[0])
+    return [packet for _, packet in arrivals]
+
+
+def receive_as_arrived(packets: List[Packet]) -> Tuple[List[Tuple[int, bytes]], JitterStats]:
+    """Decode every packet as it arrives, like Pycord's decoder"""
+    decoder = op.Decoder()
+    stats = JitterStats()
+    frames = []
+    for _, timestamp, payload in packets:
+        stats.received += 1
+        frames.append((timestamp, decoder.decode(payload, fec=False)))
+    return frames, stats
+
+
+def receive_with_jitter_buffer(packets: List[Packet]) -> Tuple[List[Tuple[int, bytes]], JitterStats]:
+    stats = JitterStats()
+    jitter_buffer = JitterBuffer(op.Decoder(), stats)
+    frames = []
+    for sequence, timestamp, payload in packets:
+        frames += jitter_buffer.push(sequence, timestamp, payload)
+    return frames, stats
+
+
+def place(frames: List[Tuple[int, bytes]], first_timestamp: int, num_values: int) -> np.ndarray:
+    """Put decoded frames where their RTP timestamps say they go (like VoiceTimeline)"""
+    out = np.zeros(num_values, dtype=np.int16)
+    for timestamp, pcm in frames:
+        start = ((timestamp - first_timestamp) % 2 ** 32) * 2
+        samples = np.frombuffer(pcm, dtype=np.int16)[:max(0, num_values - start)]
+        out[start:start + len(samples)] = samples
+    return out
+
+
+def quality(received: np.ndarray, reference: np.ndarray) -> Tuple[float, int, int]:
+    """SNR (dB), gap frames and clicks of the received audio, compared to the reference"""
+    error = received.astype(np.float64) - reference
+    snr = 10 * np.log10(np.sum(reference.astype(np.float64) ** 2) / max(np.sum(error ** 2), 1e-9))
+
+    frame_values = FRAME_SAMPLES * 2
+    received_frames = received[:len(received) // frame_values * frame_values].reshape(-1, frame_values)
+    reference_frames = reference[:len(received_frames) * frame_values].reshape(-1, frame_values)
+    gaps = int(np.sum(~received_frames.any(axis=1) & reference_frames.any(axis=1)))
+
+    boundaries = np.arange(frame_values, len(received), frame_values)
+    received_jumps = np.abs(received[boundaries].astype(np.int32) - received[boundaries - 2])
+    reference_jumps = np.abs(reference[boundaries].astype(np.int32) - reference[boundaries - 2])
+    clicks = int(np.sum((received_jumps > CLICK_THRESHOLD) & (reference_jumps < CLICK_THRESHOLD / 2)))
+
+    return snr, gaps, clicks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--opus-lib", help="path to libopus, if it isn't found on its own")
+    parser.add_argument("--seconds", type=float, default=60, help="length of the voice stream")
+    args = parser.parse_args()
+
+    if args.opus_lib is not None:
+        op.load_opus(args.opus_lib)
+    elif not op.is_loaded():
+        op._load_default()
+    if not op.is_loaded():
+        sys.exit("libopus couldn't be loaded, pass its path with --opus-lib")
+
+    rng = np.random.default_rng(0)
+    packets = encode(make_voice(args.seconds, rng), rng)
+    first_timestamp = packets[0][1]
+    num_values = len(packets) * FRAME_SAMPLES * 2
+    reference = place(receive_as_arrived(packets)[0], first_timestamp, num_values)
+
+    receivers: List[Tuple[str, Receiver]] = [("as arrived", receive_as_arrived),
+                                             ("jitter buffer", receive_with_jitter_buffer)]
+
+    print(f"{len(packets)} packets ({args.seconds:.0f}s)\n")
+    print(f"{'scenario':<24} {'receiver':<14} {'SNR (dB)':>9} {'gaps':>5} {'clicks':>7} "
+          f"{'late':>5} {'lost':>5} {'concealed':>10} {'FEC':>5} {'us/packet':>10} {'streams/core':>13}")
+    for name, loss_rate, jitter in SCENARIOS:
+        arrived = network(packets, loss_rate, jitter, np.random.default_rng(1))
+        for receiver_name, receiver in receivers:
+            start = time.process_time()
+            frames, stats = receiver(arrived)
+            elapsed = time.process_time() - start
+
+            snr, gaps, clicks = quality(place(frames, first_timestamp, num_values), reference)
+            per_packet = elapsed / len(arrived)
+            print(f"{name:<24} {receiver_name:<14} {snr:>9.1f} {gaps:>5} {clicks:>7} "
+                  f"{stats.late:>5} {stats.lost:>5} {stats.concealed:>10} {stats.recovered:>5} "
+                  f"{per_packet * 1e6:>10.1f} {1 / (per_packet / FRAME_DURATION):>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark the NumPy mixer against the old pydub overlay/concatenate path.
+
+Run from the repo root:
+    python -m benchmarks.bench_mixer
+"""
+# Clipped modules
+from modules.audio_encoder import pcm_to_wav
+from modules.audio_mixer import mix_tracks
+
+# Other modules
+from io import BytesIO
+import numpy as np
+import pydub
+import time
+import wave
+
+CLIP_SIZE = 30  # seconds
+CHUNK_SIZE = 1  # seconds
+SAMPLING_RATE = 48000
+CHANNELS = 2
+SAMPLING_WIDTH = 2
+SPEAKER_COUNTS = [2, 10, 25]
+
+
+def make_tracks(num_speakers: int, seed: int = 0):
+    """Synthetic speech-level PCM tracks, quiet enough to never saturate"""
+    rng = np.random.default_rng(seed)
+    num_samples = CLIP_SIZE * SAMPLING_RATE * CHANNELS
+    amplitude = (2 ** 15 - 1) // num_speakers
+    return [rng.integers(-amplitude, amplitude, num_samples, dtype=np.int16).tobytes()
+            for _ in range(num_speakers)]
+
+
+def pydub_mix(tracks) -> bytes:
+    """The previous DataProcessor pipeline: per-chunk WAV round trip + overlay + concat"""
+    chunk_bytes = CHUNK_SIZE * SAMPLING_RATE * CHANNELS * SAMPLING_WIDTH
+    clip = (pydub.AudioSegment
+            .silent(duration=0, frame_rate=SAMPLING_RATE)
+            .set_channels(CHANNELS)
+            .set_sample_width(SAMPLING_WIDTH))
+
+    for start in range(0, len(tracks[0]), chunk_bytes):
+        chunk = (pydub.AudioSegment
+                 .silent(duration=CHUNK_SIZE * 1000, frame_rate=SAMPLING_RATE)
+                 .set_channels(CHANNELS)
+                 .set_sample_width(SAMPLING_WIDTH))
+
+        for track in tracks:
+            member_wav = BytesIO()
+            with wave.open(member_wav, "wb") as w:
+                w.setnchannels(CHANNELS)
+                w.setsampwidth(SAMPLING_WIDTH)
+                w.setframerate(SAMPLING_RATE)
+                w.writeframes(track[start:start + chunk_bytes])
+            member_wav.seek(0)
+            chunk = chunk.overlay(pydub.AudioSegment.from_file(member_wav,
+                                                               format="wav"))
+        clip += chunk
+
+    clip_bytes = BytesIO()
+    clip.export(clip_bytes, format="wav")
+    return clip_bytes.getvalue()
+
+
+def numpy_mix(tracks) -> bytes:
+    clip = mix_tracks(tracks, num_bytes=len(tracks[0]))
+    return pcm_to_wav(clip,
+                      channels=CHANNELS,
+                      sampling_width=SAMPLING_WIDTH,
+                      sampling_rate=SAMPLING_RATE).getvalue()
+
+
+def time_it(func, tracks, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(tracks)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'speakers':>8} {'pydub (s)':>10} {'numpy (s)':>10} {'speedup':>8} identical")
+    for num_speakers in SPEAKER_COUNTS:
+        tracks = make_tracks(num_speakers)
+        identical = pydub_mix(tracks) == numpy_mix(tracks)
+
+        pydub_time = time_it(pydub_mix, tracks, repeat=1)
+        numpy_time = time_it(numpy_mix, tracks, repeat=5)
+
+        print(f"{num_speakers:>8} {pydub_time:>10.3f} {numpy_time:>10.4f} "
+              f"{pydub_time / numpy_time:>7.0f}x {identical}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Load test of the sharded deployment: how many concurrent voice sessions
+the capture path keeps up with, as worker processes are added.
+
+Simulated guilds are put on shards the way Discord does it, and shards
+are split among workers the way the driver does it (see
+`modules.sharding`). Each worker then runs its guilds' sessions the way
+a real worker would: every member's Opus packets go through their
+JitterBuffer and into the session's ClipSink, and a chunk is moved into
+the ring buffer every second. It goes as fast as it can, on a simulated
+clock.
+
+The number of workers is scaled up along with the number of guilds, and
+the capacity reported is how many sessions (of `--members` speaking
+members each) could be run in real time. Scaling should be close to
+linear up to the number of physical cores, and flat past it.
+
+Needs libopus. Run from the repo root:
+    python -m benchmarks.bench_sharding [--opus-lib PATH] [--max-workers N]
+"""
+# Clipped modules
+from benchmarks.bench_jitter_buffer import encode, make_voice
+from modules.data_streamer import ClipSink, DataStreamer
+from modules.jitter_buffer import JitterBuffer, JitterStats
+from modules.sharding import assign_shards, shard_id
+
+# Pycord modules
+import discord.opus as op
+
+# Other modules
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+
+SHARD_COUNT = 16
+HISTORY_SIZE = 30  # seconds
+FRAME_SAMPLES = 960  # samples per 20 ms packet
+PACKET_DURATION = 0.02  # seconds of audio per packet
+BYTES_PER_SECOND = 48000 * 4  # of 48 kHz stereo 16-bit PCM
+
+
+def load_opus(opus_lib: str | None) -> bool:
+    if opus_lib is not None:
+        op.load_opus(opus_lib)
+    elif not op.is_loaded():
+        op._load_default()
+    return op.is_loaded()
+
+
+def run_worker(guild_ids: List[int],
+               payloads: List[bytes],
+               members: int,
+               seconds: float,
+               opus_lib: str | None) -> Tuple[float, float, JitterStats]:
+    """Run the guilds' sessions, returning when the worker started and finished, and its counters"""
+    load_opus(opus_lib)
+    stats = JitterStats()
+
+    streamers: Dict[int, Tuple[DataStreamer, ClipSink]] = {}
+    jitter_buffers: Dict[Tuple[int, int], JitterBuffer] = {}
+    for guild_id in guild_ids:
+        streamer = DataStreamer(voice=None,
+                                history_size=HISTORY_SIZE,
+                                max_buffer_bytes=members * HISTORY_SIZE * BYTES_PER_SECOND)
+        sink = ClipSink(streamer.audio_buffer.chunk_bytes)
+        sink.timeline.start_time = 0.0
+        streamers[guild_id] = (streamer, sink)
+        for member_id in range(members):
+            jitter_buffers[(guild_id, member_id)] = JitterBuffer(op.Decoder(), stats)
+
+    start = time.time()
+    for i in range(int(seconds / PACKET_DURATION)):
+        receive_time = (i + 1) * PACKET_DURATION
+        payload = payloads[i % len(payloads)]
+        for guild_id, (streamer, sink) in streamers.items():
+            for member_id in range(members):
+                frames = jitter_buffers[(guild_id, member_id)].push(i % 2 ** 16,
+                                                                    (i * FRAME_SAMPLES) % 2 ** 32,
+                                                                    payload)
+                for rtp_timestamp, pcm in frames:
+                    sink.write_frame(member_id,
+                                     pcm,
+                                     receive_time,
+                                     ssrc=member_id,
+                                     rtp_timestamp=rtp_timestamp)
+
+            while sink.timeline.chunk_ready(DataStreamer.JITTER_LATENCY, now=receive_time):
+                streamer._buffer_chunk(sink)
+
+    return start, time.time(), stats
+
+
+def guilds_by_worker(num_guilds: int,
+                     num_workers: int,
+                     rng: np.random.Generator) -> List[List[int]]:
+    """Random guilds, split among workers by shard"""
+    worker_shards = assign_shards(list(range(SHARD_COUNT)), num_workers)
+    worker_of_shard = {shard: worker
+                       for worker, shard_ids in enumerate(worker_shards)
+                       for shard in shard_ids}
+
+    guilds: List[List[int]] = [[] for _ in worker_shards]
+    for _ in range(num_guilds):
+        guild_id = int(rng.integers(2 ** 50, 2 ** 60))  # snowflake-sized
+        guilds[worker_of_shard[shard_id(guild_id, SHARD_COUNT)]].append(guild_id)
+    return guilds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--opus-lib", help="path to libopus, if it isn't found on its own")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1,
+                        help="most worker processes to try (default: one per core)")
+    parser.add_argument("--sessions-per-worker", type=int, default=8,
+                        help="guilds added with each worker")
+    parser.add_argument("--members", type=int, default=4, help="members speaking in each session")
+    parser.add_argument("--seconds", type=float, default=20, help="simulated session length")
+    args = parser.parse_args()
+
+    if not load_opus(args.opus_lib):
+        sys.exit("libopus couldn't be loaded, pass its path with --opus-lib")
+
+    rng = np.random.default_rng(0)
+    payloads = [payload for _, _, payload in encode(make_voice(10, rng), rng)]
+    worker_counts = sorted({min(2 ** i, args.max_workers)
+                            for i in range(args.max_workers.bit_length() + 1)})
+
+    print(f"{os.cpu_count()} cores, {SHARD_COUNT} shards, {args.members} members per session, "
+          f"{args.seconds:.0f}s per session\n")
+    print(f"{'workers':>8} {'guilds':>7} {'busiest':>8} {'wall (s)':>9} {'capacity':>9} "
+          f"{'speedup':>8} {'efficiency':>11}")
+    single_capacity = None
+    context = multiprocessing.get_context("spawn")
+    for num_workers in worker_counts:
+        guilds = guilds_by_worker(args.sessions_per_worker * num_workers, num_workers, rng)
+        with ProcessPoolExecutor(max_workers=len(guilds), mp_context=context) as pool:
+            futures = [pool.submit(run_worker,
+                                   worker_guilds,
+                                   payloads,
+                                   args.members,
+                                   args.seconds,
+                                   args.opus_lib)
+                       for worker_guilds in guilds]
+            results = [future.result() for future in futures]
+
+        wall = max(end for _, end, _ in results) - min(start for start, _, _ in results)
+        capacity = sum(len(worker_guilds) for worker_guilds in guilds) * args.seconds / wall
+        single_capacity = single_capacity or capacity
+        speedup = capacity / single_capacity
+        print(f"{num_workers:>8} {sum(len(worker_guilds) for worker_guilds in guilds):>7} "
+              f"{max(len(worker_guilds) for worker_guilds in guilds):>8} {wall:>9.2f} "
+              f"{capacity:>9.1f} {speedup:>7.2f}x {speedup / num_workers:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
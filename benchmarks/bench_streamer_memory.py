@@ -0,0 +1,88 @@
+"""
+Soak test of DataStreamer's memory use: hours of fake voice packets are
+written into a ClipSink (on a simulated clock), and moved into the ring
+buffer every tick, as fast as possible. Fails if the process's peak RSS keeps growing once
+the ring buffer is full. A few minutes' worth runs with the tests
+(tests/test_streamer_memory.py).
+
+Run from the repo root:
+    python -m benchmarks.bench_streamer_memory [--hours 3] [--members 8]
+"""
+# Clipped modules
+from modules.data_streamer import ClipSink, DataStreamer
+
+# Other modules
+import argparse
+import os
+import resource
+import sys
+import time
+
+HISTORY_SIZE = 5 * 60  # seconds
+CHUNK_SIZE = 1  # seconds
+PACKET_DURATION = 0.02  # seconds of audio per voice packet
+PACKET_BYTES = 3840  # 20 ms of 48 kHz stereo 16-bit PCM
+PACKET_SAMPLES = 960  # RTP timestamp increment per packet
+BYTES_PER_SECOND = 48000 * 4  # of 48 kHz stereo 16-bit PCM
+MAX_GROWTH = 8 * 1024 ** 2  # bytes of peak RSS growth tolerated after warm-up
+
+
+def peak_rss() -> int:
+    """Peak resident set size of the process, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # KiB on Linux
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=3, help="simulated session length")
+    parser.add_argument("--members", type=int, default=8, help="members speaking at once")
+    args = parser.parse_args()
+
+    # Room for every member's track, so none are evicted
+    streamer = DataStreamer(voice=None,
+                            history_size=HISTORY_SIZE,
+                            chunk_size=CHUNK_SIZE,
+                            max_buffer_bytes=args.members * HISTORY_SIZE * BYTES_PER_SECOND)
+    sink = ClipSink(streamer.audio_buffer.chunk_bytes)
+    sink.timeline.start_time = 0.0
+    packet = os.urandom(PACKET_BYTES)
+    packets_per_tick = round(CHUNK_SIZE / PACKET_DURATION)
+    num_ticks = int(args.hours * 60 * 60 / CHUNK_SIZE)
+    report_every = max(num_ticks // 10, 1)
+
+    print(f"{'simulated':>10} {'peak RSS (MiB)':>15} {'staged (bytes)':>15}")
+    baseline = None
+    start = time.perf_counter()
+    for tick in range(1, num_ticks + 1):
+        for member_id in range(args.members):
+            for i in range(packets_per_tick):
+                packet_index = (tick - 1) * packets_per_tick + i
+                sink.write_frame(member_id,
+                                 packet,
+                                 receive_time=(packet_index + 1) * PACKET_DURATION,
+                                 ssrc=member_id,
+                                 rtp_timestamp=(packet_index * PACKET_SAMPLES) % 2 ** 32)
+        streamer._buffer_chunk(sink)
+
+        # Warmed up once the ring buffer has wrapped around
+        if tick == HISTORY_SIZE // CHUNK_SIZE:
+            baseline = peak_rss()
+
+        if tick % report_every == 0:
+            print(f"{tick * CHUNK_SIZE / 3600:>9.2f}h {peak_rss() / 1024 ** 2:>15.1f} "
+                  f"{sink.timeline.staged_bytes():>15}")
+
+    elapsed = time.perf_counter() - start
+    print(f"{args.hours}h of {args.members} members simulated in {elapsed:.1f}s")
+
+    if baseline is not None:
+        growth = peak_rss() - baseline
+        print(f"peak RSS growth after warm-up: {growth / 1024 ** 2:.1f} MiB")
+        if growth > MAX_GROWTH:
+            sys.exit(f"FAIL: memory grew by more than {MAX_GROWTH / 1024 ** 2:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark recall and query latency of the local vector index's HNSW
+search against exact (brute-force) search.
+
+Run from the repo root (needs hnswlib installed):
+    python -m benchmarks.bench_vector_index [--dim 1536] [--sizes 10000 100000 1000000]
+
+Note that exact search over 1M 1536-dim embeddings needs ~6 GB of RAM.
+"""
+# Clipped modules
+import modules.vector_index as vector_index
+
+# Other modules
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+import tempfile
+import time
+
+TOP_K = 5
+NUM_QUERIES = 200
+NUM_TOPICS = 500  # clips are clustered around topics, like real summaries
+
+
+def make_embeddings(rng: np.random.Generator, topics: np.ndarray, count: int) -> np.ndarray:
+    dim = topics.shape[1]
+    noise = rng.normal(scale=0.6, size=(count, dim)).astype(np.float32)
+    return topics[rng.integers(0, NUM_TOPICS, count)] + noise
+
+
+def timed_search(index: vector_index.GuildVectorIndex, queries: np.ndarray):
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append({timestamp for timestamp, _ in index.search(query, TOP_K)})
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    base = datetime(2025, 1, 1)
+
+    print(f"{'clips':>9} {'exact p50 (ms)':>15} {'hnsw p50 (ms)':>14} "
+          f"{'hnsw p99 (ms)':>14} {f'recall@{TOP_K}':>9} {'build (s)':>10}")
+    for size in args.sizes:
+        # Queries are about the same topics as the clips
+        topics = rng.normal(size=(NUM_TOPICS, args.dim)).astype(np.float32)
+        embeddings = make_embeddings(rng, topics, size)
+        queries = make_embeddings(rng, topics, NUM_QUERIES)
+        clips = [(base + timedelta(seconds=i), embedding)
+                 for i, embedding in enumerate(embeddings)]
+
+        with tempfile.TemporaryDirectory() as index_dir:
+            # Exact search: never switch over to HNSW
+            vector_index.HNSW_THRESHOLD = size + 1
+            exact = vector_index.GuildVectorIndex(guild_id=0, index_dir=index_dir)
+            exact.rebuild(clips)
+            exact_results, exact_latencies = timed_search(exact, queries)
+            del exact
+
+            # Approximate search
+            vector_index.HNSW_THRESHOLD = 0
+            start = time.perf_counter()
+            approx = vector_index.GuildVectorIndex(guild_id=0, index_dir=index_dir)
+            approx.rebuild(clips)
+            build_time = time.perf_counter() - start
+            approx_results, approx_latencies = timed_search(approx, queries)
+            del approx
+
+        recall = np.mean([len(exact_result & approx_result) / TOP_K
+                          for exact_result, approx_result in zip(exact_results, approx_results)])
+
+        print(f"{size:>9} {np.percentile(exact_latencies, 50):>15.2f} "
+              f"{np.percentile(approx_latencies, 50):>14.3f} "
+              f"{np.percentile(approx_latencies, 99):>14.3f} "
+              f"{recall:>9.3f} {build_time:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -69,3 +69,7 @@ SUMMARY_SYSTEM_PROMPT = client.secrets().get(
     "0daaebb1-2d9b-40dd-8c11-b32300ef78d6").data.value
 TRANSCRIPTION_MODEL = client.secrets().get(
     "56b47589-c1e1-42e9-a3ec-b32300f905a0").data.value
+
+# Sharding (only needed when running sharded, see modules/sharding.py):
+# key nodes sign the requests they forward to each other with
+ROUTER_SECRET = os.getenv("CLIPPED_ROUTER_SECRET")
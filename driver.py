@@ -1,6 +1,8 @@
 # Clipped modules
-from bw_secrets import BOT_TOKEN
+from bw_secrets import BOT_TOKEN, ROUTER_SECRET
 from models.session import ClippedSession
+from modules.session_router import SessionRouter
+import modules.sharding as sharding
 
 # Pycord modules
 import discord
@@ -11,19 +13,50 @@ import logging
 
 
 def main():
-    """ Setup bot intents and cogs and bring General Walarus to life """
+    """
+    Bring General Walarus to life: in this process, or (if
+    `CLIPPED_SHARD_COUNT` is set) in worker processes that split this
+    node's shards between them (see `modules.sharding`)
+    """
+    logging.basicConfig(level=logging.ERROR)
+
+    workers = sharding.worker_configs_from_env()
+    if workers is None:
+        run_bot()
+    else:
+        sharding.run_workers(run_bot, workers)
+
+
+def run_bot(worker: sharding.WorkerConfig | None = None):
+    """ Setup bot intents and cogs, and run the bot (on the worker's shards, if given) """
+    logging.basicConfig(level=logging.ERROR)  # worker processes don't run main()
+
     intents = discord.Intents.default()
     intents.message_content = True
     intents.members = True
     intents.voice_states = True
 
-    bot: commands.Bot = commands.Bot(command_prefix="clip", intents=intents)
+    if worker is None:
+        bot: commands.Bot = commands.Bot(command_prefix="clip", intents=intents)
+    else:
+        bot: commands.AutoShardedBot = commands.AutoShardedBot(command_prefix="clip",
+                                                               intents=intents,
+                                                               shard_ids=worker.shard_ids,
+                                                               shard_count=worker.shard_count)
     bot.load_extension("modules.cmd_gateway")
     bot.load_extension("modules.events_handler")
 
-    ClippedSession.db_clear_all_clipped_sessions()
-
-    logging.basicConfig(level=logging.ERROR)
+    # Run on the bot's event loop (before it connects), which the database
+    # client is then bound to
+    if worker is None:
+        bot.loop.run_until_complete(ClippedSession.db_clear_all_clipped_sessions())
+    else:
+        # Other nodes' sessions are still running
+        bot.loop.run_until_complete(ClippedSession.db_clear_node_clipped_sessions(worker.node_id))
+        bot.get_cog("Command Gateway").router = SessionRouter(node_id=worker.node_id,
+                                                              host=worker.router_host,
+                                                              port=worker.router_port,
+                                                              secret=ROUTER_SECRET)
 
     bot.run(BOT_TOKEN)
 
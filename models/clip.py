@@ -3,98 +3,213 @@ from __future__ import annotations
 # Clipped modules
 from bw_secrets import (CLIPS_METADATA_COLLECTION,
                         EMBEDDING_MODEL,
-                        GCS_BUCKET_NAME,
                         SUMMARY_MODEL,
                         SUMMARY_SYSTEM_PROMPT,
                         TRANSCRIPTION_MODEL)
-import modules.database as db
+from modules.audio_encoder import AudioFormat
+import modules.async_database as adb
+import modules.blob_cache as blob_cache
+import modules.blob_storage as blob_storage
+import modules.clients as clients
+from modules.query_cache import EmbeddingCache, SearchResultsCache
+import modules.vector_index as vector_index
 
 # Pycord modules
 import discord
 
 # Other modules
+import asyncio
+from collections import defaultdict
 from datetime import datetime
-from google.cloud import storage
 import io
+import logging
 import openai
-from typing import Dict, List
+import os
+from typing import Dict, List, Tuple
 import uuid
 
+_log = logging.getLogger(__name__)
+
 
 class Clip:
     DATETIME_FORMAT = "%B %-d, %Y at %-I:%M %p %Z"
+    TRANSCRIPTION_CONCURRENCY = 4  # max in-flight transcription requests per clip
+    TRANSCRIPTION_TIMEOUT = 30  # seconds before a member's transcription is given up on
+    SEARCH_PROJECTION = {"_id": 1, "transcription": 1, "summary": 1, "uri": 1}
+    QUERY_EMBEDDING_CACHE_SIZE = 10_000  # max number of query embeddings kept in memory
+    QUERY_EMBEDDING_CACHE_PATH = os.getenv("CLIPPED_EMBEDDING_CACHE_PATH")  # SQLite file, if persisted
+    SEARCH_RESULTS_CACHE_SIZE = 1_000  # max number of searches' results cached
+    SEARCH_RESULTS_CACHE_TTL = 10 * 60  # seconds before a cached search is run again
+
+    query_embeddings = EmbeddingCache(maxsize=QUERY_EMBEDDING_CACHE_SIZE,
+                                      path=QUERY_EMBEDDING_CACHE_PATH)
+    """Embeddings of previously searched queries"""
+    search_results = SearchResultsCache(maxsize=SEARCH_RESULTS_CACHE_SIZE,
+                                        ttl=SEARCH_RESULTS_CACHE_TTL)
+    """Result documents of recent searches, invalidated when a clip is stored in the guild"""
+    index_load_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+    """Per guild, held while its vector index is loaded or rebuilt, so that's only done once"""
 
     def __init__(self, guild: discord.Guild):
-        self.ai_client = openai.OpenAI()
+        self.ai_client = clients.openai_client()
 
         self.guild = guild
         self.timestamp = datetime.now()
         self.timestamp_str = self.timestamp.strftime(Clip.DATETIME_FORMAT)
 
         self.transcription = None
+        self.live_segments: List[Dict] = []
+        """Transcript segments that were transcribed live, before the clip was made"""
         self.transcription_summary = None
         self.summary_embedding = None
 
         self.blob_filename = None
 
-    def store_clip_in_blob(self, clip_bytes: io.BytesIO) -> str:
-        # Generate a unique filename
-        clip_id = str(uuid.uuid4())
-        self.blob_filename = f"{self.guild.name}-{self.guild.id}-{clip_id}.wav"
+    @property
+    def id(self) -> Dict:
+        """`_id` of the clip's metadata document"""
+        return {"guild_id": self.guild.id, "timestamp": self.timestamp}
+
+    def store_clip_in_blob(self, clip_bytes: bytes, audio_format: AudioFormat) -> str:
+        # Generate a unique filename, once, so a retried upload
+        # overwrites the same blob rather than leaving one behind
+        if self.blob_filename is None:
+            clip_id = str(uuid.uuid4())
+            self.blob_filename = f"{self.guild.name}-{self.guild.id}-{clip_id}.{audio_format.extension}"
+
+        # Upload the audio clip. The backend may store it under a
+        # different key than the name it's given
+        storage = blob_storage.get_storage()
+        self.blob_filename = storage.upload(self.blob_filename,
+                                            clip_bytes,
+                                            audio_format.content_type)
+
+        # Also cache it, so it never needs to be downloaded while it's recent
+        if not storage.is_local:
+            blob_cache.get_cache().put(self.blob_filename, clip_bytes)
 
-        # Ensure BytesIO buffer pointer is at the beginning
-        clip_bytes.seek(0)
+        return self.blob_filename
 
-        # Initialize GCS client and bucket
-        client = storage.Client()
-        bucket = client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(self.blob_filename)
+    def fetch_clip_from_blob(self) -> io.IOBase:
+        """
+        Get a file object of the stored clip, from the local blob cache if
+        it's there, or else from blob storage (and cached). The caller is
+        responsible for closing it.
+        """
+        storage = blob_storage.get_storage()
+        if storage.is_local:
+            return storage.open(self.blob_filename)
 
-        # Upload the audio clip
-        blob.upload_from_file(clip_bytes, content_type="audio/wav")
+        cache = blob_cache.get_cache()
+        clip_file = cache.open(self.blob_filename)
+        if clip_file is not None:
+            return clip_file
 
-        return self.blob_filename
+        clip_bytes = storage.download(self.blob_filename)
+        cache.put(self.blob_filename, clip_bytes)
 
-    def store_clip_metadata_in_db(self,
-                                  clip_by_member: Dict[discord.Member, io.BytesIO],
-                                  object_uri: str):
-        self.transcription = self._generate_transcription(clip_by_member)
-        self.transcription_summary = self._generate_transcription_summary()
-        self.summary_embedding = self._generate_summary_embedding()
-
-        # Fields of database document
-        self.fields = {
-            "_id": {"guild_id": self.guild.id, "timestamp": self.timestamp},
-            "transcription": self.transcription,
-            "summary": self.transcription_summary,
-            "summary_embedding": self.summary_embedding,
-            "uri": object_uri
-        }
-
-        db.create_document(collection_name=CLIPS_METADATA_COLLECTION,
-                           obj=self.fields)
-
-    def _generate_transcription(self, clip_by_member: Dict[discord.Member, io.BytesIO]) -> str:
-        segments_with_speaker = []
-
-        for member, audio_bytes in clip_by_member.items():
-            audio_bytes.name = f"{member.id}-audio.wav"
-
-            # Transcribe with timestamps
-            transcription_response = self.ai_client.audio.transcriptions.create(
-                model=TRANSCRIPTION_MODEL,
-                file=audio_bytes,
-                response_format="verbose_json"
-            )
-
-            # Transcription timestamped by segment,
-            transcript_json = transcription_response.model_dump()
-            for seg in transcript_json["segments"]:
-                segments_with_speaker.append({
-                    "member_name": member.name,
-                    "start": seg["start"],
-                    "text": seg["text"].strip()
-                })
+        clip_file = io.BytesIO(clip_bytes)
+        clip_file.name = self.blob_filename
+        return clip_file
+
+    ################################################################
+    ####################### INGESTION STAGES #######################
+    ################################################################
+
+    # Each stage persists its output (and the stage reached) in the
+    # clip's metadata document, so an interrupted clip can pick up
+    # where it left off. See `modules.ingestion`.
+
+    async def create_metadata_document(self, object_uri: str, pending_spans: List[Dict]) -> None:
+        """
+        Create the clip's metadata document, once it's been uploaded.
+        `pending_spans` describes where the audio waiting to be
+        transcribed was saved. Does nothing if the document already
+        exists.
+        """
+        await adb.bulk_upsert(collection_name=CLIPS_METADATA_COLLECTION,
+                              objs=[{"_id": self.id,
+                                     "uri": object_uri,
+                                     "stage": "uploaded",
+                                     "pending_spans": pending_spans,
+                                     "live_segments": self.live_segments}],
+                              overwrite=False)
+
+    async def transcribe(self, spans: List[Tuple[int, str, float, io.BytesIO]]) -> None:
+        """Transcribe the given (member_id, member_name, offset, audio) spans"""
+        self.transcription = await self._generate_transcription(spans)
+        await self._update_metadata_document("transcribed",
+                                             {"transcription": self.transcription})
+
+    async def summarize(self) -> None:
+        self.transcription_summary = await self._generate_transcription_summary()
+        await self._update_metadata_document("summarized",
+                                             {"summary": self.transcription_summary})
+
+    async def embed(self) -> None:
+        self.summary_embedding = await self._generate_summary_embedding()
+        await self._update_metadata_document("embedded",
+                                             {"summary_embedding": self.summary_embedding})
+
+    async def index(self) -> None:
+        """Make the clip searchable in its guild's vector index"""
+        index = await Clip._get_vector_index(self.guild)
+        await asyncio.to_thread(index.add, self.timestamp, self.summary_embedding)
+        Clip.search_results.invalidate(self.guild.id)
+        await self._update_metadata_document("indexed")
+
+    async def _update_metadata_document(self, stage: str, fields: Dict | None = None) -> None:
+        await adb.update_document(collection_name=CLIPS_METADATA_COLLECTION,
+                                  filter={"_id": self.id},
+                                  update_query={"$set": {**(fields or {}), "stage": stage}})
+
+    @staticmethod
+    async def get_unfinished_documents(final_stage: str) -> List[Dict]:
+        """Metadata documents of every clip whose ingestion hasn't reached `final_stage`"""
+        return await adb.read_document(collection_name=CLIPS_METADATA_COLLECTION,
+                                       filter={"stage": {"$exists": True, "$ne": final_stage}})
+
+    @staticmethod
+    def from_document(guild: discord.Guild, doc: Dict) -> Clip:
+        """Restore a clip (and whatever's been generated for it so far) from its metadata document"""
+        clip = Clip(guild)
+        clip.set_timestamp(doc["_id"]["timestamp"])
+        clip.blob_filename = doc.get("uri")
+        clip.transcription = doc.get("transcription")
+        clip.live_segments = doc.get("live_segments", [])
+        clip.transcription_summary = doc.get("summary")
+        clip.summary_embedding = doc.get("summary_embedding")
+
+        return clip
+
+    async def _generate_transcription(self,
+                                      spans: List[Tuple[int, str, float, io.BytesIO]]) -> str:
+        """
+        Transcribe each member's voiced spans, and merge them (and any
+        segments transcribed live) into a single transcript. Every span
+        comes with its start offset into the clip, so segments from all
+        members can be put back in order.
+        """
+        # Spans are transcribed concurrently, up to a limit
+        semaphore = asyncio.Semaphore(Clip.TRANSCRIPTION_CONCURRENCY)
+        results = await asyncio.gather(*[self._transcribe_span(member_id, member_name,
+                                                               offset, audio_bytes, semaphore)
+                                         for member_id, member_name, offset, audio_bytes in spans])
+
+        # A span whose transcription failed is left out, rather
+        # than failing the whole clip
+        failed = [f"{member_name}@{offset:.1f}s"
+                  for (_, member_name, offset, _), segments in zip(spans, results)
+                  if segments is None]
+        if len(spans) > 0 and len(failed) == len(spans):
+            raise Exception("Transcription failed for every member in the clip")
+        elif len(failed) > 0:
+            _log.warning(f"Partial transcript, transcription failed for: {failed}")
+
+        segments_with_speaker = self.live_segments + [seg
+                                                      for span_segments in results
+                                                      if span_segments is not None
+                                                      for seg in span_segments]
 
         # Sort all segments by start time
         ordered_segments = sorted(
@@ -108,23 +223,57 @@ class Clip:
 
         return "\n".join(full_transcript)
 
-    def _generate_transcription_summary(self) -> str:
+    async def _transcribe_span(self,
+                               member_id: int,
+                               member_name: str,
+                               offset: float,
+                               audio_bytes: io.BytesIO,
+                               semaphore: asyncio.Semaphore) -> List[Dict] | None:
+        """
+        Transcribe one span of a member's audio into timestamped segments,
+        with timestamps relative to the start of the clip. Returns None
+        if the request fails or times out.
+        """
+        async with semaphore:
+            try:
+                # Transcribe with timestamps
+                transcription_response = await asyncio.wait_for(
+                    self.ai_client.audio.transcriptions.create(
+                        model=TRANSCRIPTION_MODEL,
+                        file=audio_bytes,
+                        response_format="verbose_json"
+                    ),
+                    timeout=Clip.TRANSCRIPTION_TIMEOUT)
+            except (openai.OpenAIError, asyncio.TimeoutError):
+                _log.exception(f"Failed to transcribe audio (member_id={member_id}, "
+                               f"offset={offset})")
+                return None
+
+        # Transcription timestamped by segment, shifted by where
+        # the span starts within the clip
+        transcript_json = transcription_response.model_dump()
+        return [{"member_name": member_name,
+                 "start": offset + seg["start"],
+                 "text": seg["text"].strip()}
+                for seg in transcript_json["segments"]]
+
+    async def _generate_transcription_summary(self) -> str:
         if self.transcription is None:
             raise Exception("Transcription hasn't been generated yet. "
                             "Call _generate_transcription() first")
 
         input = SUMMARY_SYSTEM_PROMPT + self.transcription
-        summary_response = self.ai_client.responses.create(model=SUMMARY_MODEL,
-                                                           input=input)
+        summary_response = await self.ai_client.responses.create(model=SUMMARY_MODEL,
+                                                                 input=input)
         return summary_response.output[0].content[0].text
 
-    def _generate_summary_embedding(self):
+    async def _generate_summary_embedding(self):
         if self.transcription_summary is None:
             raise Exception("Transcription summary hasn't been generated yet. "
                             "Call _generate_transcription_summary() first")
 
-        embedding_response = self.ai_client.embeddings.create(model=EMBEDDING_MODEL,
-                                                              input=self.transcription_summary)
+        embedding_response = await self.ai_client.embeddings.create(model=EMBEDDING_MODEL,
+                                                                    input=self.transcription_summary)
         return embedding_response.data[0].embedding
 
     def set_timestamp(self, timestamp: datetime):
@@ -132,7 +281,7 @@ class Clip:
         self.timestamp_str = self.timestamp.strftime(Clip.DATETIME_FORMAT)
 
     @staticmethod
-    def query_for(guild: discord.Guild, query: str, top_k: int) -> List[Clip]:
+    async def query_for(guild: discord.Guild, query: str, top_k: int) -> List[Clip]:
         """
         Run a vector search query through the clip transcriptions for the
         given guild, and return the top k Clip results.
@@ -140,25 +289,27 @@ class Clip:
         if top_k > 10:
             raise Exception("Can't query for more than top 10 results")
 
-        ai_client = openai.OpenAI()
-        embedding_response = ai_client.embeddings.create(model=EMBEDDING_MODEL,
-                                                         input=query)
-        embedding = embedding_response.data[0].embedding
-
-        result_docs = db.vector_search(embedding=embedding,
-                                       collection_name=CLIPS_METADATA_COLLECTION,
-                                       top_k=top_k,
-                                       filter={
-                                           "_id.guild_id": {
-                                               "$eq": guild.id
-                                           }
-                                       },
-                                       projection={
-                                           "_id": 1,
-                                           "transcription": 1,
-                                           "summary": 1,
-                                           "uri": 1
-                                       })
+        results_key = Clip.search_results.key(guild.id, query, top_k)
+        result_docs = Clip.search_results.get(results_key)
+        if result_docs is None:
+            embedding = await Clip._get_query_embedding(query)
+
+            try:
+                result_docs = await Clip._local_vector_search(guild, embedding, top_k)
+            except Exception:
+                _log.exception("Local vector search failed, falling back to Atlas "
+                               f"(guild_id={guild.id})")
+                result_docs = await adb.vector_search(embedding=embedding,
+                                                      collection_name=CLIPS_METADATA_COLLECTION,
+                                                      top_k=top_k,
+                                                      filter={
+                                                          "_id.guild_id": {
+                                                              "$eq": guild.id
+                                                          }
+                                                      },
+                                                      projection=Clip.SEARCH_PROJECTION)
+
+            Clip.search_results.set(results_key, result_docs)
 
         results: List[Clip] = []
         for doc in result_docs:
@@ -179,3 +330,79 @@ class Clip:
             results.append(clip)
 
         return results
+
+    @staticmethod
+    async def _get_query_embedding(query: str) -> List[float]:
+        """Embed the query, unless it (or the same query, normalized) was embedded before"""
+        embedding = await asyncio.to_thread(Clip.query_embeddings.get, EMBEDDING_MODEL, query)
+        if embedding is not None:
+            return embedding
+
+        ai_client = clients.openai_client()
+        embedding_response = await ai_client.embeddings.create(model=EMBEDDING_MODEL,
+                                                               input=query)
+        embedding = embedding_response.data[0].embedding
+
+        await asyncio.to_thread(Clip.query_embeddings.set, EMBEDDING_MODEL, query, embedding)
+        return embedding
+
+    @staticmethod
+    async def _local_vector_search(guild: discord.Guild,
+                                   embedding: List[float],
+                                   top_k: int) -> List[Dict]:
+        """
+        Search the guild's in-process vector index, then fetch the matching
+        clips' documents in one round trip. Documents come back in the same
+        shape as `vector_search()` results, scores included.
+        """
+        index = await Clip._get_vector_index(guild)
+        matches = await asyncio.to_thread(index.search, embedding, top_k)
+
+        scores = {timestamp: score for timestamp, score in matches}
+        docs = await adb.read_many(collection_name=CLIPS_METADATA_COLLECTION,
+                                   ids=[{"guild_id": guild.id, "timestamp": timestamp}
+                                        for timestamp in scores],
+                                   projection=Clip.SEARCH_PROJECTION)
+        for doc in docs:
+            doc["score"] = scores[doc["_id"]["timestamp"]]
+
+        return sorted(docs, key=lambda doc: doc["score"], reverse=True)
+
+    @staticmethod
+    async def _get_vector_index(guild: discord.Guild) -> vector_index.GuildVectorIndex:
+        """
+        Get the guild's vector index, loading it from disk the first time
+        it's used. If it isn't on disk yet, or is missing clips the database
+        says were indexed (e.g. its files were rebuilt by `reindex.py` while
+        the bot was adding a clip), it's built from the guild's clips in
+        the database.
+        """
+        index = vector_index.get_index(guild.id)
+        # Not just checked outside the lock: the index counts as loaded
+        # before it's been checked against the database (and rebuilt)
+        async with Clip.index_load_locks[guild.id]:
+            if not index.loaded:
+                await Clip._load_vector_index(guild, index)
+
+        return index
+
+    @staticmethod
+    async def _load_vector_index(guild: discord.Guild, index: vector_index.GuildVectorIndex) -> None:
+        if index.exists_on_disk():
+            await asyncio.to_thread(index.load)
+            num_indexed = await adb.count_documents(
+                collection_name=CLIPS_METADATA_COLLECTION,
+                filter={"_id.guild_id": guild.id,
+                        "$or": [{"stage": {"$exists": False}}, {"stage": "indexed"}]})
+            if len(index) >= num_indexed:
+                return
+            _log.warning(f"Vector index on disk is missing clips, rebuilding it "
+                         f"(guild_id={guild.id}, on_disk={len(index)}, indexed={num_indexed})")
+
+        docs = await adb.read_document(collection_name=CLIPS_METADATA_COLLECTION,
+                                       filter={"_id.guild_id": guild.id,
+                                               "summary_embedding": {"$exists": True}},
+                                       projection={"_id": 1, "summary_embedding": 1})
+        clips = [(doc["_id"]["timestamp"], doc["summary_embedding"])
+                 for doc in docs]
+        await asyncio.to_thread(index.rebuild, clips)
@@ -1,93 +1,160 @@
 import discord
-import pymongo
 
-from modules import database as db
+from modules import async_database as adb
+from modules.ttl_cache import TTLCache
 from bw_secrets import BOT_USER_ID, MEMBERS_COLLECTION
 
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 
 class ClippedMember:
+    OPT_IN_CACHE_SIZE = 10_000  # max number of members' opt-in statuses cached
+    OPT_IN_CACHE_TTL = 15 * 60  # seconds before a cached opt-in status is re-read
+
+    opt_in_cache = TTLCache(maxsize=OPT_IN_CACHE_SIZE, ttl=OPT_IN_CACHE_TTL)
+    """Members' opt-in statuses, keyed by (guild_id, member_id)"""
+
     def __init__(self,
                  member: discord.Member,
                  opted_in: bool):
         self.guild = member.guild
 
         # Fields of database document
-        self.fields = {
-            "_id": {"member_id": member.id, "guild_id": self.guild.id},
-            "name": member.name,
-            "guild_name": self.guild.name,
-            "opted_in": opted_in
-        }
-        self.db_client = pymongo.MongoClient()
+        self.fields = ClippedMember._member_fields(member, opted_in)
 
-    def create_member_document_in_db(self):
-        db.create_document(collection_name=MEMBERS_COLLECTION,
-                           obj=self.fields)
+    async def create_member_document_in_db(self):
+        await adb.create_document(collection_name=MEMBERS_COLLECTION,
+                                  obj=self.fields)
 
     @staticmethod
-    def member_exists(guild_id: int, member_id: int) -> bool:
+    async def member_exists(guild_id: int, member_id: int) -> bool:
+        if ClippedMember.opt_in_cache.get((guild_id, member_id)) is not None:
+            return True  # only members with a document are ever cached
+
         filter = {"_id": {"member_id": member_id, "guild_id": guild_id}}
         projection = {"_id": 1}
 
-        results = db.read_document(collection_name=MEMBERS_COLLECTION,
-                                   filter=filter,
-                                   projection=projection)
+        results = await adb.read_document(collection_name=MEMBERS_COLLECTION,
+                                          filter=filter,
+                                          projection=projection)
 
         return len(results) >= 1
 
     @staticmethod
-    def get_opted_in_members(members: List[discord.Member]) -> List[discord.Member]:
-        statuses = ClippedMember.get_opted_in_statuses(members)
+    async def get_opted_in_members(members: List[discord.Member]) -> List[discord.Member]:
+        statuses = await ClippedMember.get_opted_in_statuses(members)
         opted_in = [member for member, opted_in in statuses.items()
                     if opted_in]
         return opted_in
 
     @staticmethod
-    def get_opted_in_statuses(members: List[discord.Member]) -> Dict[discord.Member, bool]:
-        statuses = {}
+    async def get_new_members(members: List[discord.Member]) -> List[discord.Member]:
+        """
+        Find which of the given members don't have a document in the DB yet
+        (i.e. haven't interacted with the bot before), in one round trip.
+        """
+        statuses = await ClippedMember._read_opted_in_statuses(members)
+        return [member for member in members
+                if (member.guild.id, member.id) not in statuses]
 
+    @staticmethod
+    async def get_opted_in_statuses(members: List[discord.Member]) -> Dict[discord.Member, bool]:
+        members = [member for member in members
+                   if member.id != BOT_USER_ID]  # skip the Clipped bot
+
+        # Fetch any `opt_in` statuses that aren't cached from the DB
+        statuses = await ClippedMember._read_opted_in_statuses(members)
+        new_members = [member for member in members
+                       if (member.guild.id, member.id) not in statuses]
+
+        # If members don't exist in DB, create new member documents,
+        # defaulting to opt-in status (unless they've opted out in the
+        # meantime, so what's stored is read back)
+        if len(new_members) > 0:
+            await ClippedMember.set_opted_in_statuses(members=new_members,
+                                                      opted_in=True,
+                                                      overwrite=False)
+            statuses.update(await ClippedMember._read_opted_in_statuses(new_members))
+
+        # Statuses are taken from what was just read, not the cache (which
+        # may have evicted them since), and anyone without one is left out
+        return {member: statuses.get((member.guild.id, member.id), False)
+                for member in members}
+
+    @staticmethod
+    async def _read_opted_in_statuses(members: List[discord.Member]) -> Dict[Tuple[int, int], bool]:
+        """
+        Opt-in statuses of whichever of the given members have a document,
+        keyed by (guild_id, member_id): from the cache, or else from the DB
+        (in one round trip), caching them along the way
+        """
+        statuses = {}
+        uncached = []
         for member in members:
-            if member.id == BOT_USER_ID:  # skip the Clipped bot
-                continue
-
-            # Fetch members' `opt_in` status from DB
-            guild = member.guild
-            filter = {"_id": {"member_id": member.id, "guild_id": guild.id}}
-            projection = {"_id": 0, "opted_in": 1}
-            query_results = db.read_document(collection_name=MEMBERS_COLLECTION,
-                                             filter=filter,
-                                             projection=projection)
-
-            # If member doesn't exist in DB, create new member document
-            opted_in = True  # default to opt-in status
-            if len(query_results) == 0:
-                ClippedMember.set_opted_in_status(guild=member.guild,
-                                                  member=member,
-                                                  opted_in=opted_in)
+            key = (member.guild.id, member.id)
+            opted_in = ClippedMember.opt_in_cache.get(key)
+            if opted_in is None:
+                uncached.append(member)
             else:
-                opted_in = query_results[0]["opted_in"]
+                statuses[key] = opted_in
+
+        if len(uncached) == 0:
+            return statuses
 
-            statuses[member] = opted_in
+        results = await adb.read_many(collection_name=MEMBERS_COLLECTION,
+                                      ids=[ClippedMember._member_id(member)
+                                           for member in uncached],
+                                      projection={"_id": 1, "opted_in": 1})
+        for doc in results:
+            key = (doc["_id"]["guild_id"], doc["_id"]["member_id"])
+            ClippedMember.opt_in_cache.set(key, doc["opted_in"])
+            statuses[key] = doc["opted_in"]
 
         return statuses
 
     @staticmethod
-    def set_opted_in_status(guild: discord.Guild,
-                            member: discord.Member,
-                            opted_in: bool) -> None:
-        unique_id = {"member_id": member.id, "guild_id": guild.id}
-
-        # Check if members's opt-in preference for this server already exists
-        results = db.read_document(collection_name=MEMBERS_COLLECTION,
-                                   filter={"_id": unique_id},
-                                   projection={"_id": 1})
-
-        if len(results) < 1:  # create new document if not
-            clipped_member = ClippedMember(member, opted_in)
-            clipped_member.create_member_document_in_db()
-        else:  # otherwise, update existing document
-            db.update_document(collection_name=MEMBERS_COLLECTION,
-                               filter={"_id": unique_id},
-                               update_query={"$set": {"opted_in": opted_in}})
+    async def set_opted_in_status(guild: discord.Guild,
+                                  member: discord.Member,
+                                  opted_in: bool) -> None:
+        await ClippedMember.set_opted_in_statuses(members=[member],
+                                                  opted_in=opted_in)
+
+    @staticmethod
+    async def set_opted_in_statuses(members: List[discord.Member],
+                                    opted_in: bool,
+                                    overwrite: bool = True) -> None:
+        """
+        Set the opt-in status of all the given members, creating their
+        documents if they don't exist yet, in one round trip. If
+        `overwrite` is False, members that already have a document keep
+        whatever status they had.
+        """
+        docs = [ClippedMember._member_fields(member, opted_in)
+                for member in members]
+        await adb.bulk_upsert(collection_name=MEMBERS_COLLECTION,
+                              objs=docs,
+                              overwrite=overwrite)
+
+        # Write through to the cache, so the next clip sees the change. If
+        # existing documents were kept, the status stored may not be the
+        # one given (e.g. they opted out in the meantime), so it's re-read
+        for member in members:
+            if overwrite:
+                ClippedMember.opt_in_cache.set((member.guild.id, member.id), opted_in)
+            else:
+                ClippedMember.opt_in_cache.pop((member.guild.id, member.id))
+
+    @staticmethod
+    def _member_id(member: discord.Member) -> Dict[str, int]:
+        """Unique ID of a member's document"""
+        return {"member_id": member.id, "guild_id": member.guild.id}
+
+    @staticmethod
+    def _member_fields(member: discord.Member, opted_in: bool) -> Dict:
+        """Fields of a member's database document"""
+        return {
+            "_id": ClippedMember._member_id(member),
+            "name": member.name,
+            "guild_name": member.guild.name,
+            "opted_in": opted_in
+        }
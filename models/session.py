@@ -1,17 +1,24 @@
 import asyncio
 from bw_secrets import CLIPPED_SESSIONS_COLLECTION
 import discord
+from modules.clip_executor import ClipExecutor
 from modules.data_processor import DataProcessor
 from modules.data_streamer import DataStreamer
-import modules.database as db
+from modules.live_transcriber import LiveTranscriber
+import modules.async_database as adb
+from typing import Dict
 
 
 class ClippedSession:
     def __init__(self,
                  voice: discord.VoiceClient,
                  started_by: discord.Member,
-                 clip_size: int = 30,
-                 chunk_size: int = 1):
+                 history_size: int = 30,
+                 chunk_size: int = 1,
+                 max_buffer_bytes: int = 512 * 1024 ** 2,
+                 live_transcription_executor: ClipExecutor | None = None,
+                 clip_executor: ClipExecutor | None = None,
+                 node: Dict[str, str] | None = None):
         self.guild_id = voice.guild.id
         self.guild_name = voice.guild.name
         self.channel_id = voice.channel.id
@@ -19,14 +26,26 @@ class ClippedSession:
         self.started_by = started_by
 
         self.streamer = DataStreamer(voice,
-                                     clip_size=clip_size,
-                                     chunk_size=chunk_size)
+                                     history_size=history_size,
+                                     chunk_size=chunk_size,
+                                     max_buffer_bytes=max_buffer_bytes)
         asyncio.create_task(self.streamer.start(),
                             name="ClippedSession > stream task")
-        self.processor = DataProcessor(voice, self.streamer)
+
+        # Voice is only transcribed as it comes in if there's an executor to do it in
+        self.transcriber = None
+        if live_transcription_executor is not None:
+            self.transcriber = LiveTranscriber(voice,
+                                               self.streamer.audio_buffer,
+                                               history_size=history_size,
+                                               executor=live_transcription_executor)
+            self.transcriber.start()
+
+        self.processor = DataProcessor(voice, self.streamer, self.transcriber)
 
         self.last_ui_message: discord.InteractionMessage = None
         self.voice = voice
+        self.clip_executor = clip_executor  # runs the guild's clip jobs, if they're run in one
 
         # Fields of database document
         self.db_fields = {"_id": self.guild_id,
@@ -37,14 +56,30 @@ class ClippedSession:
                               "user_id": self.started_by.id,
                               "user_name": self.started_by.name
                           }}
-        db.create_document(collection_name=CLIPPED_SESSIONS_COLLECTION,
-                           obj=self.db_fields)
+        if node is not None:
+            # When running sharded, the node holding the session (and its
+            # voice buffer), so clip requests can be routed to it
+            self.db_fields["node"] = node
+
+    async def create_session_document_in_db(self):
+        await adb.create_document(collection_name=CLIPPED_SESSIONS_COLLECTION,
+                                  obj=self.db_fields)
 
-    def stop_session(self):
+    async def stop_session(self):
         self.streamer.stop()
-        db.delete_document(collection_name=CLIPPED_SESSIONS_COLLECTION,
-                           id=self.guild_id)
+        if self.transcriber is not None:
+            self.transcriber.stop()
+        if self.clip_executor is not None:
+            self.clip_executor.close_guild(self.guild_id)
+        await adb.delete_document(collection_name=CLIPPED_SESSIONS_COLLECTION,
+                                  id=self.guild_id)
+
+    @staticmethod
+    async def db_clear_all_clipped_sessions() -> None:
+        await adb.delete_all_documents(collection_name=CLIPPED_SESSIONS_COLLECTION)
 
     @staticmethod
-    def db_clear_all_clipped_sessions() -> None:
-        db.delete_all_documents(collection_name=CLIPPED_SESSIONS_COLLECTION)
+    async def db_clear_node_clipped_sessions(node_id: str) -> None:
+        """Clear the sessions a node held, e.g. before it restarts (other nodes' are left alone)"""
+        await adb.delete_all_documents(collection_name=CLIPPED_SESSIONS_COLLECTION,
+                                       filter={"node.id": node_id})
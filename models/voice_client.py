@@ -1,6 +1,9 @@
 from bw_secrets import BOT_TOKEN, BOT_USER_ID
+from modules.jitter_buffer import JitterBuffer, JitterStats
 
 from discord import abc, Client, VoiceClient
+import discord.opus as op
+from discord.sinks import RawData
 
 import asyncio
 import datetime
@@ -34,6 +37,11 @@ class ClippedVoiceClient(VoiceClient):
         self.heartbeat_task = None
         self.event_listener = None
 
+        self.jitter_buffers: dict[int, JitterBuffer] = {}
+        """Jitter buffer (and decoder) of each SSRC we've received voice from"""
+        self.jitter_stats = JitterStats()
+        """Counters of received voice packets, across every SSRC in the guild"""
+
         headers = {
             "Authorization": f"Bot {BOT_TOKEN}",
             "Content-Type": "application/json"
@@ -103,6 +111,7 @@ class ClippedVoiceClient(VoiceClient):
 
         self.stop()
         self._connected.clear()
+        _log.info(f"Voice receive stats: {self.jitter_stats.as_dict()}")
 
         try:
             if self.ws:
@@ -122,6 +131,43 @@ class ClippedVoiceClient(VoiceClient):
             if self.socket:
                 self.socket.close()
 
+    def unpack_audio(self, data):
+        """
+        Decode received voice packets through each SSRC's jitter buffer
+        (rather than Pycord's decoder), so they're decoded in order and
+        lost ones are concealed. Each frame goes to the sink along with
+        its RTP timestamp, so it's placed where it was spoken rather than
+        padded with silence guessed from when it arrived (see
+        `VoiceTimeline`).
+        """
+        if 200 <= data[1] <= 204 or self.paused:
+            return  # RTCP packet, which we don't need, or not listening
+
+        packet = RawData(data, self)
+        jitter_buffer = self.jitter_buffers.get(packet.ssrc)
+        if jitter_buffer is None:
+            jitter_buffer = JitterBuffer(op.Decoder(), self.jitter_stats)
+            self.jitter_buffers[packet.ssrc] = jitter_buffer
+
+        frames = jitter_buffer.push(packet.sequence, packet.timestamp, packet.decrypted_data)
+
+        # Frames from before we know who's speaking are dropped, rather than
+        # holding up the socket (they're still decoded, to keep the decoder's state)
+        user = self.ws.ssrc_map.get(packet.ssrc)
+        if user is None:
+            return
+
+        write_frame = getattr(self.sink, "write_frame", None)
+        for rtp_timestamp, pcm in frames:
+            if write_frame is not None:
+                write_frame(user["user_id"],
+                            pcm,
+                            packet.receive_time,
+                            ssrc=packet.ssrc,
+                            rtp_timestamp=rtp_timestamp)
+            else:
+                self.sink.write(pcm, user["user_id"])
+
     async def _event_loop(self, websocket: ClientConnection):
         # Start listening for events
         while True:
@@ -130,7 +176,7 @@ class ClippedVoiceClient(VoiceClient):
             if event["op"] == 0:
                 self.last_sequence = event["s"]
                 if event["t"] == "GUILD_CREATE":
-                    _log.info(f"Connected to '{event["d"]["name"]}' server")
+                    _log.info(f"Connected to '{event['d']['name']}' server")
                 elif event["t"] == "VOICE_STATE_UPDATE":
                     _log.info(f"Voice state updated")
                     self.vc_state_data = event["d"]
@@ -0,0 +1,295 @@
+"""
+The bot's MongoDB layer. Every operation is a coroutine (so a slow
+MongoDB response never blocks the event loop), over one client shared by
+the whole process. Startup tasks that run before the bot connects run on
+the bot's event loop too (see `driver.py`), since the client is bound to
+the loop it's first used on.
+"""
+# Clipped modules
+from bw_secrets import MONGO_CONN_STRING, MONGO_DB_NAME
+
+# Other modules
+import bisect
+import functools
+import pymongo as mg
+import time
+from typing import AsyncIterator, Dict, List, Set
+
+MAX_POOL_SIZE = 50  # max connections to MongoDB shared by the whole bot
+MIN_POOL_SIZE = 5  # connections kept open, even when idle
+MAX_IDLE_TIME_MS = 5 * 60 * 1000  # idle connections above the minimum are closed after this
+WAIT_QUEUE_TIMEOUT_MS = 10 * 1000  # max time to wait for a free connection
+
+client = mg.AsyncMongoClient(MONGO_CONN_STRING,
+                             maxPoolSize=MAX_POOL_SIZE,
+                             minPoolSize=MIN_POOL_SIZE,
+                             maxIdleTimeMS=MAX_IDLE_TIME_MS,
+                             waitQueueTimeoutMS=WAIT_QUEUE_TIMEOUT_MS)
+db = client[MONGO_DB_NAME]
+
+known_collections: Set[str] | None = None
+"""Names of the collections in the database, loaded on first use"""
+
+
+#########################################################################
+########################### LATENCY TRACKING ############################
+#########################################################################
+
+class LatencyHistogram:
+    """Counts of operation latencies, bucketed by upper bound (in seconds)"""
+
+    BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+               0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf")]
+
+    def __init__(self):
+        self.counts = [0] * len(LatencyHistogram.BUCKETS)
+        """Number of observations in each bucket"""
+        self.total = 0.0
+        """Sum of all observed latencies, in seconds"""
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LatencyHistogram.BUCKETS, seconds)] += 1
+        self.total += seconds
+
+    def snapshot(self) -> Dict:
+        count = sum(self.counts)
+        return {
+            "count": count,
+            "mean": self.total / count if count > 0 else 0.0,
+            "buckets": {f"le_{bound}": bucket_count
+                        for bound, bucket_count in zip(LatencyHistogram.BUCKETS,
+                                                       self.counts)}
+        }
+
+
+latency_histograms: Dict[str, LatencyHistogram] = {}
+"""Latency histogram of each database operation, by operation name"""
+
+
+def get_latency_stats() -> Dict[str, Dict]:
+    """Snapshot of every database operation's latency histogram"""
+    return {operation: histogram.snapshot()
+            for operation, histogram in latency_histograms.items()}
+
+
+def _timed(func):
+    """Record the latency of every call to a database operation"""
+    histogram = latency_histograms.setdefault(func.__name__, LatencyHistogram())
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+#########################################################################
+########################## COLLECTION CHECKS ############################
+#########################################################################
+
+async def load_known_collections() -> None:
+    """Cache the names of the collections in the database"""
+    global known_collections
+    known_collections = set(await db.list_collection_names())
+
+
+async def _check_collection(collection_name: str) -> None:
+    if known_collections is None or collection_name not in known_collections:
+        # the collection may have been created since we last checked
+        await load_known_collections()
+
+    if collection_name not in known_collections:
+        raise Exception(f"Collection name '{collection_name}' doesn't exist")
+
+
+#########################################################################
+####################### LOW-LEVEL CRUD OPERATIONS #######################
+#########################################################################
+
+@_timed
+async def create_document(collection_name: str, obj) -> str:
+    await _check_collection(collection_name)
+
+    collection = db[collection_name]
+    inserted_id = (await collection.insert_one(obj)).inserted_id
+
+    return inserted_id
+
+
+@_timed
+async def read_document(collection_name: str, filter, projection=None) -> List:
+    await _check_collection(collection_name)
+
+    collection = db[collection_name]
+    results = [doc async for doc in collection.find(filter, projection)]
+
+    return results
+
+
+@_timed
+async def count_documents(collection_name: str, filter) -> int:
+    await _check_collection(collection_name)
+
+    collection = db[collection_name]
+    count = await collection.count_documents(filter)
+
+    return count
+
+
+async def stream_documents(collection_name: str,
+                           filter,
+                           projection=None,
+                           sort=None,
+                           batch_size: int = 1000) -> AsyncIterator[Dict]:
+    """
+    Iterate over matching documents with a cursor, fetching `batch_size`
+    at a time, rather than reading them all into memory at once
+    """
+    await _check_collection(collection_name)
+
+    collection = db[collection_name]
+    cursor = collection.find(filter, projection, sort=sort, batch_size=batch_size)
+    async for doc in cursor:
+        yield doc
+
+
+@_timed
+async def update_document(collection_name: str, filter, update_query) -> None:
+    await _check_collection(collection_name)
+
+    collection = db[collection_name]
+    result = await collection.update_one(filter, update_query)
+
+    if result.matched_count < 1:
+        raise Exception(
+            f"No documents were updated (collection={collection_name}, "
+            f"filter={filter})")
+
+
+@_timed
+async def delete_document(collection_name: str, id: str) -> None:
+    await _check_collection(collection_name)
+
+    collection = db[collection_name]
+    delete_count = (await collection.delete_one({"_id": id})).deleted_count
+
+    if delete_count < 1:
+        raise Exception(
+            f"No documents deleted (collection={collection_name}, id={id})")
+
+
+@_timed
+async def delete_all_documents(collection_name: str, filter=None) -> None:
+    """Delete every document in the collection (or just those matching `filter`)"""
+    await _check_collection(collection_name)
+
+    collection = db[collection_name]
+    result = await collection.delete_many(filter or {})
+
+    if not result.acknowledged:
+        raise Exception(
+            "There was a problem deleting all documents "
+            f"(collection={collection_name})")
+
+
+#########################################################################
+########################### BATCH OPERATIONS ############################
+#########################################################################
+
+@_timed
+async def insert_many(collection_name: str, objs: List) -> List:
+    await _check_collection(collection_name)
+
+    if len(objs) == 0:
+        return []
+
+    collection = db[collection_name]
+    inserted_ids = (await collection.insert_many(objs)).inserted_ids
+
+    return inserted_ids
+
+
+@_timed
+async def read_many(collection_name: str, ids: List, projection=None) -> List:
+    """Read every document whose `_id` is in `ids`, in one round trip"""
+    await _check_collection(collection_name)
+
+    if len(ids) == 0:
+        return []
+
+    collection = db[collection_name]
+    results = [doc async for doc in collection.find({"_id": {"$in": ids}}, projection)]
+
+    return results
+
+
+@_timed
+async def bulk_upsert(collection_name: str, objs: List[Dict], overwrite: bool = True) -> None:
+    """
+    Upsert every document in `objs` (matched by `_id`) in one round trip.
+    If `overwrite` is False, documents that already exist are left as-is
+    and only missing ones are created.
+    """
+    await _check_collection(collection_name)
+
+    if len(objs) == 0:
+        return
+
+    operator = "$set" if overwrite else "$setOnInsert"
+    requests = [mg.UpdateOne({"_id": obj["_id"]},
+                             {operator: {field: value
+                                         for field, value in obj.items()
+                                         if field != "_id"}},
+                             upsert=True)
+                for obj in objs]
+
+    collection = db[collection_name]
+    result = await collection.bulk_write(requests, ordered=False)
+
+    if not result.acknowledged:
+        raise Exception(
+            "There was a problem upserting documents "
+            f"(collection={collection_name})")
+
+
+#########################################################################
+######################## MISCELLANEOUS FUNCTIONS ########################
+#########################################################################
+
+@_timed
+async def vector_search(embedding: List[float],
+                        collection_name: str,
+                        top_k: int = 5,
+                        filter: any = None,
+                        projection: any = None) -> List:
+    collection = db[collection_name]
+
+    pipeline = [
+        {
+            "$vectorSearch": {
+                "exact": True,
+                "index": "vector_index",
+                "limit": top_k,
+                "path": "summary_embedding",
+                "queryVector": embedding
+            }
+        }
+    ]
+
+    if filter is not None:
+        pipeline[0]["$vectorSearch"]["filter"] = filter
+    if projection is not None:
+        proj_obj = {"$project": dict(projection)}  # copy, so the caller's projection isn't modified
+        proj_obj["$project"]["score"] = {  # allows us to fetch the vector search score
+            "$meta": "vectorSearchScore"
+        }
+        pipeline.append(proj_obj)
+
+    cursor = await collection.aggregate(pipeline)
+    results = [doc async for doc in cursor]
+
+    return results
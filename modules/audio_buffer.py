@@ -0,0 +1,183 @@
+# Pycord modules
+import discord.opus as op
+
+# Other modules
+import logging
+from typing import Dict, List, Set, Tuple
+
+_log = logging.getLogger(__name__)
+
+
+class AudioRingBuffer:
+    """
+    Fixed-size, preallocated ring buffer of raw PCM audio. Each member gets
+    their own track, but every track shares a single write cursor, so all
+    tracks are always aligned to the same point in time.
+
+    Any window of the history can be read as (at most two) views into the
+    ring, in O(1) and without copying anything, however long the history.
+
+    Memory: each member's track holds the whole history as Discord decodes
+    it, 48 kHz stereo 16-bit PCM (the same lossless audio clips are
+    archived from), i.e. 192,000 bytes per second of history (~57.6 MB for
+    5 minutes). The buffer never holds more than `max_bytes` of tracks.
+    Once it's full, a new member's track only replaces the track of a
+    member who hasn't spoken for the whole history (i.e. it's all
+    silence), so no audio is ever lost to make room. If there's no such
+    member, the new member isn't buffered until there is.
+    """
+
+    CHANNELS = op.Decoder.CHANNELS  # channels stored
+    SAMPLING_RATE = op.Decoder.SAMPLING_RATE  # sampling rate stored
+    SAMPLE_WIDTH = op.Decoder.SAMPLE_SIZE // op.Decoder.CHANNELS  # bytes per sample (16-bit)
+
+    def __init__(self, history_size: int, chunk_size: int, max_bytes: int):
+        self.channels = AudioRingBuffer.CHANNELS
+        """Number of channels of the stored PCM"""
+        self.sampling_width = AudioRingBuffer.SAMPLE_WIDTH
+        """Bytes per sample of the stored PCM"""
+        self.sampling_rate = AudioRingBuffer.SAMPLING_RATE
+        """Sampling rate of the stored PCM"""
+        self.frame_size = self.channels * self.sampling_width
+        """Size of a single stored PCM frame (all channels), in bytes"""
+        self.bytes_per_second = self.sampling_rate * self.frame_size
+        """Bytes of stored PCM audio per second"""
+        self.chunk_bytes = int(chunk_size * self.sampling_rate) * self.frame_size
+        """Number of bytes written to each track per chunk tick"""
+        self.capacity = int(history_size / chunk_size) * self.chunk_bytes
+        """Number of bytes of audio each track holds"""
+        self.max_tracks = max_bytes // self.capacity
+        """Most member tracks that fit within the buffer's memory cap"""
+        self.cursor = 0
+        """Write position shared by all tracks, in bytes"""
+        self.bytes_written = 0
+        """Total bytes written to each track, capped at `capacity`"""
+
+        if self.max_tracks < 1:
+            raise Exception(f"Buffer memory cap ({max_bytes} bytes) can't hold even "
+                            f"one member's history ({self.capacity} bytes)")
+
+        self._tracks: Dict[int, bytearray] = {}
+        self._views: Dict[int, memoryview] = {}
+        self._last_written: Dict[int, int] = {}
+        self._rejected: Set[int] = set()  # members not buffered for lack of room (warned about once)
+        self._tick = 0
+        self._silence = memoryview(bytes(self.chunk_bytes))
+
+    @property
+    def seconds_buffered(self) -> float:
+        """Seconds of history currently in the buffer"""
+        return self.bytes_written / self.bytes_per_second
+
+    @property
+    def seconds_recorded(self) -> float:
+        """
+        Seconds of audio written since the buffer was created, including
+        what's since been overwritten. Used as the buffer's clock, e.g. the
+        most recent audio ends at `seconds_recorded`.
+        """
+        return self._tick * self.chunk_bytes / self.bytes_per_second
+
+    def write_chunk(self, member_id: int, pcm: memoryview) -> bool:
+        """
+        Write the member's chunk of decoded PCM at the write cursor, up to
+        `chunk_bytes` long; the rest of the chunk is silence. The member's
+        track is allocated the first time they're seen (if there's room);
+        every later tick is allocation-free. Returns False if there's no
+        room for the member's track.
+        """
+        view = self._views.get(member_id)
+        if view is None:
+            view = self._add_track(member_id)
+            if view is None:
+                return False
+
+        pcm = memoryview(pcm).cast("B")
+        num_bytes = min(len(pcm), self.chunk_bytes)
+        start = self.cursor
+        view[start:start + num_bytes] = pcm[:num_bytes]
+        view[start + num_bytes:start + self.chunk_bytes] = self._silence[num_bytes:]
+
+        self._last_written[member_id] = self._tick
+        return True
+
+    def advance(self) -> None:
+        """
+        Fill the current chunk with silence for any member that didn't
+        write this tick, then move the shared write cursor forward.
+        """
+        for member_id, last_written in self._last_written.items():
+            if last_written != self._tick:
+                self._views[member_id][self.cursor:self.cursor + self.chunk_bytes] = self._silence
+
+        self.cursor = (self.cursor + self.chunk_bytes) % self.capacity
+        self.bytes_written = min(self.bytes_written + self.chunk_bytes,
+                                 self.capacity)
+        self._tick += 1
+
+    def member_ids(self) -> List[int]:
+        """IDs of all members that have a track in this buffer"""
+        return list(self._tracks.keys())
+
+    def __contains__(self, member_id: int) -> bool:
+        return member_id in self._tracks
+
+    def window(self, duration: float, offset: float = 0) -> Tuple[int, int]:
+        """
+        Convert a window of `duration` seconds, ending `offset` seconds ago,
+        into (length, end offset) in bytes, clamped to what's buffered.
+        """
+        end_offset = min(int(offset * self.sampling_rate) * self.frame_size,
+                         self.bytes_written)
+        num_bytes = min(int(duration * self.sampling_rate) * self.frame_size,
+                        self.bytes_written - end_offset)
+
+        return num_bytes, end_offset
+
+    def read(self, member_id: int, num_bytes: int, end_offset: int = 0) -> List[memoryview]:
+        """
+        Get `num_bytes` of the member's track, ending `end_offset` bytes
+        before the most recent audio (see `window()`), oldest first. It's
+        returned as read-only views into the ring (no copy is made): one
+        view, or two if the window wraps around the end of the ring.
+        """
+        track = self._views[member_id]
+        end = (self.cursor - end_offset) % self.capacity
+        start = end - num_bytes
+
+        if start >= 0:
+            views = [track[start:end]]
+        else:
+            views = [track[start + self.capacity:], track[:end]]
+
+        return [view.toreadonly() for view in views if len(view) > 0]
+
+    def _add_track(self, member_id: int) -> memoryview | None:
+        """
+        Give a new member a track: a new one if there's room, or else the
+        track of whichever member has gone the longest without speaking,
+        if their whole history is silence. None if neither.
+        """
+        if len(self._tracks) < self.max_tracks:
+            track = bytearray(self.capacity)
+        else:
+            least_recent = min(self._last_written, key=self._last_written.get)
+            silent_ticks = self._tick - self._last_written[least_recent]
+            if silent_ticks * self.chunk_bytes <= self.bytes_written:
+                # Evicting them would lose audio (they may even have spoken this tick)
+                if member_id not in self._rejected:
+                    self._rejected.add(member_id)
+                    _log.warning(f"Audio buffer is full ({len(self._tracks)} members), not "
+                                 f"buffering a new member's audio (member_id={member_id})")
+                return None
+
+            # Their track is all silence already, so it's reused as-is
+            track = self._tracks.pop(least_recent)
+            del self._views[least_recent]
+            del self._last_written[least_recent]
+
+        self._rejected.discard(member_id)
+        view = memoryview(track)
+        self._tracks[member_id] = track
+        self._views[member_id] = view
+        return view
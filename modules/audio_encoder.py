@@ -0,0 +1,81 @@
+"""Encoding of raw 16-bit PCM audio into the formats clips are stored and sent in"""
+# Other modules
+from io import BytesIO
+import pydub
+from typing import Dict
+import wave
+
+
+class AudioFormat:
+    """An output format for clips, and how to encode it"""
+
+    def __init__(self,
+                 name: str,
+                 extension: str,
+                 content_type: str,
+                 export_args: Dict[str, str] | None = None):
+        self.name = name
+        """Name the format is selected by"""
+        self.extension = extension
+        """File extension for clips in this format"""
+        self.content_type = content_type
+        """MIME type for clips in this format"""
+        self.export_args = export_args
+        """Arguments to pydub's (ffmpeg-backed) export, or None to write WAV directly"""
+
+
+WAV = AudioFormat(name="wav",
+                  extension="wav",
+                  content_type="audio/wav")
+FLAC = AudioFormat(name="flac",
+                   extension="flac",
+                   content_type="audio/flac",
+                   export_args={"format": "flac"})
+OPUS = AudioFormat(name="opus",
+                   extension="ogg",
+                   content_type="audio/ogg",
+                   export_args={"format": "ogg", "codec": "libopus", "bitrate": "64k"})
+
+AUDIO_FORMATS: Dict[str, AudioFormat] = {audio_format.name: audio_format
+                                         for audio_format in [WAV, FLAC, OPUS]}
+"""All supported formats, by name"""
+
+
+def pcm_to_wav(pcm,
+               channels: int,
+               sampling_width: int,
+               sampling_rate: int) -> BytesIO:
+    """Wrap raw PCM data (any bytes-like object) in a WAV header"""
+    wav_bytes = BytesIO()
+    with wave.open(wav_bytes, "wb") as w:
+        # write WAV headers
+        w.setnchannels(channels)
+        w.setsampwidth(sampling_width)
+        w.setframerate(sampling_rate)
+        # write the actual audio data
+        w.writeframes(pcm)
+    wav_bytes.seek(0)
+
+    return wav_bytes
+
+
+def encode_pcm(pcm,
+               audio_format: AudioFormat,
+               channels: int,
+               sampling_width: int,
+               sampling_rate: int) -> bytes:
+    """Encode raw PCM data (any bytes-like object) into the given format"""
+    if audio_format.export_args is None:
+        return pcm_to_wav(pcm,
+                          channels=channels,
+                          sampling_width=sampling_width,
+                          sampling_rate=sampling_rate).getvalue()
+
+    segment = pydub.AudioSegment(data=bytes(pcm),
+                                 sample_width=sampling_width,
+                                 frame_rate=sampling_rate,
+                                 channels=channels)
+    encoded = BytesIO()
+    segment.export(encoded, **audio_format.export_args)
+
+    return encoded.getvalue()
@@ -0,0 +1,87 @@
+"""Vectorized mixing of raw 16-bit PCM audio"""
+# Clipped modules
+from modules.audio_encoder import AudioFormat, encode_pcm
+from modules.vad import detect_voiced_spans
+
+# Other modules
+import numpy as np
+from typing import Dict, Iterable, List, Tuple
+
+INT16_MIN = np.iinfo(np.int16).min
+INT16_MAX = np.iinfo(np.int16).max
+
+
+def mix_tracks(tracks: Iterable[memoryview], num_bytes: int) -> np.ndarray:
+    """
+    Mix members' raw int16 PCM tracks into a single track, `num_bytes` long.
+    Samples are summed in an int32 accumulator, then saturated back into
+    the int16 range, so loud overlapping speakers clip instead of wrapping.
+    """
+    accumulator = np.zeros(num_bytes // 2, dtype=np.int32)
+
+    for track in tracks:
+        samples = np.frombuffer(track, dtype=np.int16)
+        accumulator[:len(samples)] += samples
+
+    np.clip(accumulator, INT16_MIN, INT16_MAX, out=accumulator)
+    return accumulator.astype(np.int16)
+
+
+def render_clip(tracks: Dict[int, bytes],
+                num_bytes: int,
+                clip_formats: List[AudioFormat],
+                span_format: AudioFormat,
+                channels: int,
+                sampling_width: int,
+                sampling_rate: int,
+                transcribed_until: Dict[int, float] | None = None) -> Tuple[List[bytes],
+                                                                          Dict[int, List[Tuple[float, bytes]]]]:
+    """
+    Mix members' PCM tracks (keyed by member ID) into a single clip,
+    encoded once in each of `clip_formats`. Each member's own track is
+    cut into just the spans where they're speaking, encoded in
+    `span_format` and paired with its start offset (in seconds) into the
+    clip. Members who never spoke are left out. Only takes and returns
+    plain bytes, so it can be run in a worker process.
+
+    `transcribed_until` gives how many seconds at the start of each
+    member's track are already transcribed (see `LiveTranscriber`), so
+    spans are only cut from the rest of it.
+
+    A single full-length track (e.g. a clip of just one member) already
+    is the clip, so it's encoded as-is, without mixing.
+    """
+    if len(tracks) == 1 and len(next(iter(tracks.values()))) == num_bytes:
+        mixed = np.frombuffer(next(iter(tracks.values())), dtype=np.int16)
+    else:
+        mixed = mix_tracks(tracks.values(), num_bytes=num_bytes)
+    clips = [encode_pcm(mixed,
+                        audio_format=clip_format,
+                        channels=channels,
+                        sampling_width=sampling_width,
+                        sampling_rate=sampling_rate)
+             for clip_format in clip_formats]
+
+    frame_size = channels * sampling_width
+    member_spans: Dict[int, List[Tuple[float, bytes]]] = {}
+    for member_id, pcm in tracks.items():
+        skip = int((transcribed_until or {}).get(member_id, 0) * sampling_rate)
+        pcm_view = memoryview(pcm)
+        spans = [(skip + start, skip + end)
+                 for start, end in detect_voiced_spans(pcm_view[skip * frame_size:],
+                                                       channels=channels,
+                                                       sampling_rate=sampling_rate)]
+        if len(spans) == 0:
+            continue
+
+        member_spans[member_id] = [
+            (start / sampling_rate,
+             encode_pcm(pcm_view[start * frame_size:end * frame_size],
+                        audio_format=span_format,
+                        channels=channels,
+                        sampling_width=sampling_width,
+                        sampling_rate=sampling_rate))
+            for start, end in spans
+        ]
+
+    return clips, member_spans
@@ -0,0 +1,173 @@
+"""
+On-disk LRU cache of clip blobs, so a clip that's fetched again (e.g.
+a popular search result, or a clip that was just made) is read from
+local disk rather than downloaded from blob storage again.
+
+Cached blobs are memory-mapped when read, so sending one doesn't copy
+it into the process's memory first. Once the cache grows past its size
+cap, the least recently used blobs are evicted.
+"""
+# Other modules
+from collections import OrderedDict
+import hashlib
+import io
+import logging
+import mmap
+import os
+import threading
+import uuid
+
+_log = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv("CLIPPED_BLOB_CACHE_DIR", "blob_cache")
+MAX_BYTES = int(os.getenv("CLIPPED_BLOB_CACHE_MAX_BYTES", 2 * 1024 ** 3))  # size cap of the cache
+
+
+class MappedBlob(io.RawIOBase):
+    """Read-only, seekable file object over a memory-mapped cached blob"""
+
+    def __init__(self, path: str, name: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._pos = 0
+
+        self.name = name
+        """Name of the blob"""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        num_bytes = max(0, min(len(buffer), len(self._map) - self._pos))
+        buffer[:num_bytes] = self._map[self._pos:self._pos + num_bytes]
+        self._pos += num_bytes
+        return num_bytes
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._map) + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        if not self.closed:
+            self._map.close()
+        super().close()
+
+
+class BlobCache:
+    """Size-capped, least-recently-used cache of blobs on local disk"""
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = MAX_BYTES):
+        self.cache_dir = cache_dir
+        """Directory that cached blobs are stored in"""
+        self.max_bytes = max_bytes
+        """Total size of cached blobs before the least recently used are evicted"""
+        self.size = 0
+        """Current total size of cached blobs, in bytes"""
+
+        self._entries: OrderedDict[str, int] = OrderedDict()  # file name -> size, least recent first
+        self._lock = threading.Lock()
+
+        # Pick up blobs cached before a restart, in the order they were last used
+        os.makedirs(cache_dir, exist_ok=True)
+        files = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(".tmp"):
+                os.remove(entry.path)  # left behind by a crash mid-write
+            elif entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, file_name, size in sorted(files):
+            self._entries[file_name] = size
+            self.size += size
+        self._evict()
+
+    def open(self, blob_name: str) -> MappedBlob | None:
+        """Open the cached blob, or return None if it isn't cached"""
+        file_name = BlobCache._file_name(blob_name)
+        path = os.path.join(self.cache_dir, file_name)
+
+        with self._lock:
+            if file_name not in self._entries:
+                return None
+            self._entries.move_to_end(file_name)
+
+            try:
+                os.utime(path)  # so recency survives restarts
+                return MappedBlob(path, blob_name)
+            except (OSError, ValueError):
+                # File went missing (or is empty), so it's not actually cached
+                self.size -= self._entries.pop(file_name)
+                return None
+
+    def put(self, blob_name: str, data) -> None:
+        """Cache a blob's contents (any bytes-like object)"""
+        size = memoryview(data).nbytes
+        if size == 0 or size > self.max_bytes:
+            return  # empty files can't be memory-mapped, and huge ones would evict everything
+
+        file_name = BlobCache._file_name(blob_name)
+        path = os.path.join(self.cache_dir, file_name)
+
+        # Write to a temporary file first, so a blob is never read half-written
+        temp_path = os.path.join(self.cache_dir, f"{uuid.uuid4()}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+
+        with self._lock:
+            os.replace(temp_path, path)
+            self.size += size - self._entries.pop(file_name, 0)
+            self._entries[file_name] = size
+            self._evict()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, blob_name: str) -> bool:
+        with self._lock:
+            return BlobCache._file_name(blob_name) in self._entries
+
+    def _evict(self) -> None:
+        while self.size > self.max_bytes and len(self._entries) > 0:
+            file_name, size = self._entries.popitem(last=False)
+            self.size -= size
+            try:
+                # Safe even if the blob is still mapped somewhere
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _file_name(blob_name: str) -> str:
+        # Blob names include guild names, so they can't be used as file names as-is
+        extension = os.path.splitext(blob_name)[1]
+        return hashlib.sha256(blob_name.encode()).hexdigest() + extension
+
+
+_cache: BlobCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> BlobCache:
+    """The process-wide blob cache, created on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = BlobCache()
+            _log.info(f"Blob cache has {len(_cache)} blobs ({_cache.size} bytes)")
+
+        return _cache
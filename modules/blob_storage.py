@@ -0,0 +1,206 @@
+"""
+Where encoded clips are stored. The backend is picked with the
+`CLIPPED_BLOB_STORAGE` environment variable:
+
+- `gcs` (default): Google Cloud Storage, in the `GCS_BUCKET_NAME` bucket
+- `local`: content-addressed files on local disk, under
+  `CLIPPED_LOCAL_BLOB_DIR`, so the bot (and its benchmarks) can run
+  without any cloud storage at all
+- `s3`: any S3-compatible store (needs `boto3`), in the
+  `CLIPPED_S3_BUCKET` bucket, at `CLIPPED_S3_ENDPOINT_URL` if it isn't
+  AWS itself
+"""
+# Other modules
+import abc
+from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
+import hashlib
+import io
+import os
+import threading
+import uuid
+
+try:
+    from boto3.s3.transfer import TransferConfig
+except ImportError:
+    TransferConfig = None
+
+BACKEND = os.getenv("CLIPPED_BLOB_STORAGE", "gcs")
+LOCAL_BLOB_DIR = os.getenv("CLIPPED_LOCAL_BLOB_DIR", "blobs")
+S3_BUCKET = os.getenv("CLIPPED_S3_BUCKET")
+UPLOAD_CHUNK_SIZE = 4 * 256 * 1024  # bytes per chunk of large uploads (a multiple of 256 KiB, for GCS)
+
+
+class BlobStorage(abc.ABC):
+    """Interface of a blob storage backend"""
+
+    is_local = False
+    """Whether blobs are already on local disk, so there's no point caching them locally"""
+
+    @abc.abstractmethod
+    def upload(self, name: str, data: bytes, content_type: str) -> str:
+        """
+        Store a blob under the given name (overwriting it, if it exists),
+        and return the key it can be fetched with. The key is the name,
+        unless the backend names blobs itself.
+        """
+
+    @abc.abstractmethod
+    def download(self, key: str) -> bytes:
+        """Read a whole blob"""
+
+    @abc.abstractmethod
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        """Read `length` bytes of a blob, starting at byte `start`"""
+
+    def open(self, key: str) -> io.IOBase:
+        """Open a blob as a readable, seekable file object. The caller closes it."""
+        blob_file = io.BytesIO(self.download(key))
+        blob_file.name = key
+        return blob_file
+
+
+class GCSBlobStorage(BlobStorage):
+    def __init__(self, bucket: storage.Bucket):
+        self.bucket = bucket
+
+    def upload(self, name: str, data: bytes, content_type: str) -> str:
+        # Uploaded in chunks with a resumable upload session, so a dropped
+        # connection only resends the chunk it was on
+        blob = self.bucket.blob(name, chunk_size=UPLOAD_CHUNK_SIZE)
+        blob.upload_from_file(io.BytesIO(data),
+                              content_type=content_type,
+                              checksum="crc32c",
+                              retry=DEFAULT_RETRY)
+        return name
+
+    def download(self, key: str) -> bytes:
+        return self.bucket.blob(key).download_as_bytes()
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        if length <= 0:
+            return b""
+        return self.bucket.blob(key).download_as_bytes(start=start, end=start + length - 1)
+
+
+class S3BlobStorage(BlobStorage):
+    def __init__(self, client, bucket_name: str):
+        self.client = client
+        """boto3 S3 client"""
+        self.bucket_name = bucket_name
+
+    def upload(self, name: str, data: bytes, content_type: str) -> str:
+        # Large blobs are uploaded as a multipart upload, one chunk at a time
+        config = TransferConfig(multipart_threshold=UPLOAD_CHUNK_SIZE,
+                                multipart_chunksize=UPLOAD_CHUNK_SIZE,
+                                max_concurrency=1)
+        self.client.upload_fileobj(io.BytesIO(data),
+                                   self.bucket_name,
+                                   name,
+                                   ExtraArgs={"ContentType": content_type},
+                                   Config=config)
+        return name
+
+    def download(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket_name, Key=key)["Body"].read()
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        if length <= 0:
+            return b""
+        response = self.client.get_object(Bucket=self.bucket_name,
+                                          Key=key,
+                                          Range=f"bytes={start}-{start + length - 1}")
+        return response["Body"].read()
+
+
+class LocalBlobStorage(BlobStorage):
+    """
+    Blobs stored on local disk, content-addressed: each blob's key is the
+    SHA-256 of its contents (plus the name's extension), and it's stored
+    under two levels of directories named after the start of the hash,
+    so no directory gets too many files. Storing the same contents twice
+    only stores them once.
+    """
+
+    is_local = True
+
+    def __init__(self, root_dir: str = LOCAL_BLOB_DIR):
+        self.root_dir = root_dir
+        """Directory blobs are stored under"""
+
+    def path(self, key: str) -> str:
+        """Path of the blob's file"""
+        if os.path.basename(key) != key or key.startswith("."):
+            raise Exception(f"Invalid blob key ({key})")
+        return os.path.join(self.root_dir, key[:2], key[2:4], key)
+
+    def upload(self, name: str, data: bytes, content_type: str) -> str:
+        key = hashlib.sha256(data).hexdigest() + os.path.splitext(name)[1]
+        path = self.path(key)
+        if os.path.exists(path):
+            return key  # already stored
+
+        # Write to a temporary file first, so a blob is never read half-written
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        return key
+
+    def download(self, key: str) -> bytes:
+        with open(self.path(key), "rb") as f:
+            return f.read()
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        if length <= 0:
+            return b""
+        with open(self.path(key), "rb") as f:
+            return os.pread(f.fileno(), length, start)
+
+    def open(self, key: str) -> io.IOBase:
+        return open(self.path(key), "rb")
+
+
+_storage: BlobStorage | None = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> BlobStorage:
+    """The configured blob storage backend, created on first use"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = _create_storage(BACKEND)
+
+        return _storage
+
+
+def reset_storage() -> None:
+    """
+    Forget the storage backend, so it's created afresh (with new clients)
+    the next time it's used, e.g. once the clients it was made with are closed
+    """
+    global _storage
+    with _storage_lock:
+        _storage = None
+
+
+def _create_storage(backend: str) -> BlobStorage:
+    if backend not in ("gcs", "local", "s3"):
+        raise Exception(f"Unknown blob storage backend '{backend}' "
+                        "(expected 'gcs', 'local' or 's3')")
+
+    if backend == "local":
+        return LocalBlobStorage()
+
+    # Only the cloud backends need their clients (and secrets)
+    import modules.clients as clients
+
+    if backend == "gcs":
+        return GCSBlobStorage(clients.clips_bucket())
+
+    if S3_BUCKET is None:
+        raise Exception("CLIPPED_S3_BUCKET must be set to use S3 blob storage")
+    return S3BlobStorage(clients.s3_client(), S3_BUCKET)
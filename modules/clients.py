@@ -0,0 +1,98 @@
+"""
+Process-wide clients for external services (OpenAI, Cloud Storage, S3).
+Each is created the first time it's needed and then shared, so
+credentials are only discovered once, and connections are pooled and
+reused across every clip and search rather than opened per call.
+
+To run against a local Cloud Storage emulator (e.g. fake-gcs-server),
+set `STORAGE_EMULATOR_HOST` (e.g. to `http://localhost:4443`). The
+storage client then talks to it with anonymous credentials.
+"""
+# Clipped modules
+from bw_secrets import GCS_BUCKET_NAME
+import modules.blob_storage as blob_storage
+
+# Other modules
+from google.cloud import storage
+import openai
+import requests
+import os
+import threading
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+GCS_POOL_SIZE = 16  # connections kept open to Cloud Storage (at least the clip I/O workers)
+
+_openai_client: openai.AsyncOpenAI | None = None
+_storage_client: storage.Client | None = None
+_s3_client = None
+_lock = threading.Lock()
+
+
+def openai_client() -> openai.AsyncOpenAI:
+    """The shared async OpenAI client"""
+    global _openai_client
+    with _lock:
+        if _openai_client is None:
+            # Its HTTP client pools (and keeps alive) connections on its own
+            _openai_client = openai.AsyncOpenAI()
+
+        return _openai_client
+
+
+def storage_client() -> storage.Client:
+    """The shared Cloud Storage client (it's thread-safe, so it can be used from worker threads)"""
+    global _storage_client
+    with _lock:
+        if _storage_client is None:
+            _storage_client = storage.Client()
+
+            # By default, only 10 connections are pooled, fewer than
+            # there can be concurrent uploads/downloads
+            adapter = requests.adapters.HTTPAdapter(pool_connections=GCS_POOL_SIZE,
+                                                    pool_maxsize=GCS_POOL_SIZE)
+            _storage_client._http.mount("https://", adapter)
+            _storage_client._http.mount("http://", adapter)  # i.e. an emulator
+
+        return _storage_client
+
+
+def clips_bucket() -> storage.Bucket:
+    """The bucket clips are stored in"""
+    return storage_client().bucket(GCS_BUCKET_NAME)
+
+
+def s3_client():
+    """
+    The shared S3 client (boto3 clients are thread-safe). Set
+    `CLIPPED_S3_ENDPOINT_URL` to use an S3-compatible store other than AWS.
+    """
+    global _s3_client
+    with _lock:
+        if _s3_client is None:
+            if boto3 is None:
+                raise Exception("boto3 must be installed to use S3")
+            _s3_client = boto3.client("s3", endpoint_url=os.getenv("CLIPPED_S3_ENDPOINT_URL"))
+
+        return _s3_client
+
+
+async def close() -> None:
+    """Close every client that was created (i.e. on shutdown)"""
+    global _openai_client, _storage_client, _s3_client
+    with _lock:
+        ai_client, _openai_client = _openai_client, None
+        gcs_client, _storage_client = _storage_client, None
+        aws_client, _s3_client = _s3_client, None
+    # The storage backend holds onto the clients being closed
+    blob_storage.reset_storage()
+
+    if ai_client is not None:
+        await ai_client.close()
+    if gcs_client is not None:
+        gcs_client.close()
+    if aws_client is not None:
+        aws_client.close()
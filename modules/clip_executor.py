@@ -0,0 +1,138 @@
+# Other modules
+import asyncio
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+import multiprocessing
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Deque, Dict
+
+_log = logging.getLogger(__name__)
+
+
+class ClipExecutor:
+    """
+    Runs clip jobs off of the event loop. Blocking I/O stages (cloud
+    storage, OpenAI, MongoDB) run in a thread pool and CPU-heavy stages
+    (mixing, encoding) run in a process pool, so a clip being processed
+    in one guild never stalls heartbeats or voice receive in another.
+
+    Each guild gets its own bounded job queue, worked through one job at
+    a time. When a guild's queue is full, new jobs are rejected rather
+    than piling up.
+    """
+
+    LATENCY_SAMPLES = 256  # number of recent latencies kept per stage
+
+    def __init__(self,
+                 io_workers: int = 8,
+                 cpu_workers: int = 2,
+                 queue_size: int = 3):
+        self.io_pool = ThreadPoolExecutor(max_workers=io_workers,
+                                          thread_name_prefix="clip-io")
+        """Pool for stages that block on I/O"""
+        self.cpu_pool = ProcessPoolExecutor(max_workers=cpu_workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        """Pool for CPU-heavy stages"""
+        self.queue_size = queue_size
+        """Maximum number of pending clip jobs per guild"""
+
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._stage_latencies: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=ClipExecutor.LATENCY_SAMPLES))
+
+    def submit(self, guild_id: int, job: Callable[[], Awaitable]) -> bool:
+        """
+        Queue a clip job for the given guild. Returns False, without
+        queueing the job, if the guild's queue is already full.
+        """
+        queue = self._queues.get(guild_id)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self._queues[guild_id] = queue
+            self._workers[guild_id] = asyncio.create_task(
+                self._worker(guild_id, queue),
+                name=f"ClipExecutor > guild {guild_id} worker")
+
+        try:
+            queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return False
+
+        return True
+
+    async def run_io(self, stage: str, func: Callable, *args) -> Any:
+        """Run a blocking I/O stage in the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await self.timed(stage, loop.run_in_executor(self.io_pool, func, *args))
+
+    async def run_cpu(self, stage: str, func: Callable, *args) -> Any:
+        """
+        Run a CPU-heavy stage in the process pool. `func` and its
+        arguments must be picklable.
+        """
+        loop = asyncio.get_running_loop()
+        return await self.timed(stage, loop.run_in_executor(self.cpu_pool, func, *args))
+
+    async def timed(self, stage: str, awaitable: Awaitable) -> Any:
+        """Await a stage, recording how long it took"""
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self._stage_latencies[stage].append(time.perf_counter() - start)
+
+    def metrics(self) -> Dict[str, Dict]:
+        """
+        Current queue depth for each guild, and latency stats (in seconds)
+        over the most recent runs of each stage.
+        """
+        stage_latency = {}
+        for stage, latencies in self._stage_latencies.items():
+            samples = sorted(latencies)
+            stage_latency[stage] = {
+                "count": len(samples),
+                "mean": statistics.fmean(samples),
+                "p50": samples[len(samples) // 2],
+                "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+                "max": samples[-1]
+            }
+
+        return {
+            "queue_depth": {guild_id: queue.qsize()
+                            for guild_id, queue in self._queues.items()},
+            "stage_latency": stage_latency
+        }
+
+    def close_guild(self, guild_id: int) -> None:
+        """
+        Cancel the guild's worker (and whatever job it's on) and drop its
+        queue, e.g. once its session has ended. A later job for the guild
+        starts them afresh.
+        """
+        worker = self._workers.pop(guild_id, None)
+        if worker is not None:
+            worker.cancel()
+        self._queues.pop(guild_id, None)
+
+    def shutdown(self) -> None:
+        """Cancel all guild workers and shut down the worker pools"""
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers.clear()
+        self._queues.clear()
+
+        self.io_pool.shutdown(wait=False, cancel_futures=True)
+        self.cpu_pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _worker(self, guild_id: int, queue: asyncio.Queue) -> None:
+        while True:
+            job = await queue.get()
+            try:
+                await self.timed("job", job())
+            except Exception:
+                _log.exception(f"Clip job failed (guild_id={guild_id})")
+            finally:
+                queue.task_done()
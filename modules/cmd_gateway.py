@@ -4,6 +4,12 @@ from models.clip import Clip
 from models.member import ClippedMember
 from models.session import ClippedSession
 from models.voice_client import ClippedVoiceClient
+from modules.audio_encoder import AUDIO_FORMATS
+from modules.clip_executor import ClipExecutor
+import modules.clients as clients
+from modules.ingestion import IngestionPipeline
+from modules.session_router import SessionRouter
+import modules.vector_index as vector_index
 from ui.controls_view import ControlsView
 from ui.search_result_view import SearchResultView
 
@@ -14,20 +20,52 @@ from discord.ext import commands
 
 # Other modules
 import asyncio
-from datetime import datetime
-from typing import Callable, Dict
+from datetime import datetime, timedelta
+import os
+from typing import Callable, Dict, List
 
 
 class GatewayCog(Cog, name="Command Gateway"):
     """Encapsulates all of Clipped's supported commands"""
 
-    CLIP_SIZE = 30  # length of clips (in seconds)
+    CLIP_SIZE = 30  # default length of clips (in seconds)
+    MAX_CLIP_SIZE = 2 * 60  # longest clip that can be requested (in seconds)
+    HISTORY_SIZE = 5 * 60  # how far back clips can go (in seconds)
+    BUFFER_MEMORY_CAP = 512 * 1024 ** 2  # max bytes of voice buffered per guild (57.6 MB per member who's spoken, so up to 9 members)
     CHUNK_SIZE = 1  # length of audio chunks in buffer (in seconds)
-
+    CLIP_IO_WORKERS = 8  # threads for blocking clip I/O (storage, OpenAI, DB)
+    CLIP_CPU_WORKERS = 2  # processes for clip mixing/encoding
+    CLIP_QUEUE_SIZE = 3  # max pending clip jobs per guild
+    LIVE_TRANSCRIPTION = os.getenv("CLIPPED_LIVE_TRANSCRIPTION", "0") == "1"  # transcribe voice as it comes in
+    ARCHIVE_FORMAT = AUDIO_FORMATS["flac"]  # format clips are stored in
+    DISCORD_FORMAT = AUDIO_FORMATS["opus"]  # format clips are sent to Discord in
+    TRANSCRIPTION_FORMAT = AUDIO_FORMATS["opus"]  # format sent for transcription
+
+    # Memory: a process's voice history takes 57.6 MB (5 minutes of 48 kHz
+    # stereo) for each member who's spoken in each of its sessions (e.g.
+    # ~230 MB for a 4-member session), and at most BUFFER_MEMORY_CAP per
+    # session, so up to 512 MiB times the number of sessions it holds.
+    # Past the cap, a new member only gets the track of one who's been
+    # silent for the whole history (see `AudioRingBuffer`). When running
+    # sharded, that's per worker (see `modules.sharding`).
     clipped_sessions: Dict[int, ClippedSession] = {}
 
     def __init__(self, bot: discord.Bot):
         self.bot = bot
+        self.clip_executor = ClipExecutor(io_workers=GatewayCog.CLIP_IO_WORKERS,
+                                          cpu_workers=GatewayCog.CLIP_CPU_WORKERS,
+                                          queue_size=GatewayCog.CLIP_QUEUE_SIZE)
+        self.ingestion = IngestionPipeline(self.clip_executor)
+        self.router: SessionRouter | None = None
+        """Routes clip requests between nodes (only set when running sharded, see `driver.py`)"""
+
+    def cog_unload(self):
+        self.clip_executor.shutdown()
+        if self.router is not None:
+            self.bot.loop.create_task(self.router.stop())
+        vector_index.save_all()
+        Clip.query_embeddings.close()
+        self.bot.loop.create_task(clients.close())
 
     ################################################################
     #################### RESEND CONTROL BUTTONS ####################
@@ -70,45 +108,230 @@ class GatewayCog(Cog, name="Command Gateway"):
 
     @commands.slash_command(
         name="clipthat",
-        description="Clip the last 30 seconds of voice activity.",
+        description="Clip recent voice activity (the last 30 seconds, by default).",
         guild_ids=[DEV_GUILD_ID])
     @discord.option("user",
                     description="A specific user you want to clip.",
                     type=discord.Member,
                     required=False)
-    async def cmd_clip_that(self, ctx: discord.ApplicationContext, user: discord.Member):
+    @discord.option("duration",
+                    description="Length of the clip, in seconds.",
+                    type=int,
+                    min_value=1,
+                    max_value=MAX_CLIP_SIZE,
+                    required=False)
+    @discord.option("offset",
+                    description="How many seconds ago the clip should end.",
+                    type=int,
+                    min_value=0,
+                    max_value=HISTORY_SIZE - 1,
+                    required=False)
+    async def cmd_clip_that(self,
+                            ctx: discord.ApplicationContext,
+                            user: discord.Member,
+                            duration: int,
+                            offset: int):
         """Definition for `/clipthat` slash command."""
         await ctx.defer()  # make take a while to process, this extends timeout
         params = {
             "respond_func": ctx.respond,
             "guild": ctx.guild,
-            "user": ctx.author
+            "user": ctx.author,
+            "member": user,
+            "duration": duration,
+            "offset": offset,
+            "interaction": ctx.interaction
         }
         await self._clip_that_handler(**params)
 
     async def _clip_that_handler(self,
                                  respond_func: Callable,
                                  guild: discord.Guild,
-                                 user: discord.Member) -> None:
+                                 user: discord.Member,
+                                 member: discord.Member | None = None,
+                                 duration: int | None = None,
+                                 offset: int | None = None,
+                                 interaction: discord.Interaction | None = None) -> None:
+        """
+        Handler for `/clipthat` (and the Clip That button). `user` is who
+        asked for the clip; if `member` is given, only they're clipped.
+        When running sharded, the request is forwarded (with `interaction`,
+        to reply through) if another node holds the guild's session.
+        """
+        duration = duration or GatewayCog.CLIP_SIZE
+        offset = offset or 0
+
         if user.voice is None:
             await respond_func(":warning: You must be in a voice channel")
             return
+        if duration + offset > GatewayCog.HISTORY_SIZE:
+            await respond_func(f":warning: I can only clip the last "
+                               f"{GatewayCog.HISTORY_SIZE} seconds")
+            return
 
-        async def process_clip():
-            session = GatewayCog.clipped_sessions[guild.id]
-            clip_bytes = session.processor.process_audio_data()
+        session = GatewayCog.clipped_sessions.get(guild.id)
+        if session is None and self.router is not None and interaction is not None:
+            if await self._route_clip_that(respond_func, interaction, guild, user,
+                                           member, duration, offset):
+                return
+        if session is None:
+            await respond_func(":warning: Make sure you've started a Clipped "
+                               "session with `/joinvc`")
+            return
 
-            # Immediately send clip w/ overlayed voice to text channel
-            file = discord.File(clip_bytes, filename="clip.wav")
+        await self._clip_session(respond_func, session, member, duration, offset)
+
+    async def _clip_session(self,
+                            respond_func: Callable,
+                            session: ClippedSession,
+                            member: discord.Member | None,
+                            duration: int,
+                            offset: int,
+                            members: List[discord.Member] | None = None) -> None:
+        """
+        Clip a session this node holds, going only by the session's own
+        state (its voice client and buffer) and the members given, so it
+        works the same for requests forwarded by other nodes. `members` are
+        who's clipped (default: whoever's in the session's voice channel).
+        """
+        guild = session.voice.guild
+        if offset >= session.streamer.audio_buffer.seconds_buffered:
+            await respond_func(f":warning: I've only been listening for "
+                               f"{int(session.streamer.audio_buffer.seconds_buffered)} seconds")
+            return
+        if member is not None:
+            if member.id not in session.streamer.audio_buffer:
+                await respond_func(f":warning: I haven't heard anything from "
+                                   f"{member.display_name} to clip")
+                return
+            if len(await ClippedMember.get_opted_in_members([member])) == 0:
+                await respond_func(f":warning: {member.display_name} hasn't "
+                                   f"opted in to being clipped")
+                return
+
+        # Timestamped from when the clip ends, not when it was requested,
+        # and the window is fixed now, not when the clip's job gets to run
+        clip = Clip(guild)
+        clip.set_timestamp(clip.timestamp - timedelta(seconds=offset))
+        end = session.streamer.audio_buffer.seconds_recorded - offset
+
+        async def process_clip():
+            clip_by_format, clip_by_member, live_segments = await session.processor.process_clip(
+                self.clip_executor,
+                clip_formats=[GatewayCog.DISCORD_FORMAT, GatewayCog.ARCHIVE_FORMAT],
+                span_format=GatewayCog.TRANSCRIPTION_FORMAT,
+                duration=duration,
+                end=end,
+                member=member,
+                members=members)
+            clip.live_segments = live_segments
+
+            # Clip and its metadata are persisted in storage for later
+            # retrieval in the background, outside the guild's queue, so
+            # only getting the clip into the text channel holds up the
+            # next one. The upload reads its own copy of the clip, so it
+            # never shares a file position with the reply
+            self.ingestion.submit(clip,
+                                  clip_by_format[GatewayCog.ARCHIVE_FORMAT].getvalue(),
+                                  GatewayCog.ARCHIVE_FORMAT,
+                                  clip_by_member)
+
+            # Send clip w/ overlayed voice to text channel
+            file = discord.File(clip_by_format[GatewayCog.DISCORD_FORMAT],
+                                filename=f"clip.{GatewayCog.DISCORD_FORMAT.extension}")
             await respond_func(file=file)
 
-            # Persist clip and its metadata in storage for later retrieval
-            clip_by_member = session.processor.process_audio_data_by_member()
-            clip = Clip(guild)
-            object_uri = clip.store_clip_in_blob(clip_bytes)
-            clip.store_clip_metadata_in_db(clip_by_member, object_uri)
+        if not self.clip_executor.submit(guild.id, process_clip):
+            await respond_func(":warning: I'm busy processing other clips in this "
+                               "server, try again in a bit")
 
-        asyncio.create_task(process_clip())
+    async def _route_clip_that(self,
+                               respond_func: Callable,
+                               interaction: discord.Interaction,
+                               guild: discord.Guild,
+                               user: discord.Member,
+                               member: discord.Member | None,
+                               duration: int,
+                               offset: int) -> bool:
+        """
+        Forward a clip request to the node holding the guild's session.
+        Returns False if no other node holds one.
+        """
+        node = await self.router.find_node(guild.id)
+        if node is None or node["id"] == self.router.node_id:
+            return False
+
+        # The other node replies with a followup, which needs a response first
+        if not interaction.response.is_done():
+            await interaction.response.defer()
+
+        # This node runs the guild's shard, so it's the one that knows who's
+        # in the session's voice channel (where the bot is)
+        voice_state = guild.me.voice if guild.me.voice is not None else user.voice
+        request = {"guild_id": guild.id,
+                   "member_id": member.id if member is not None else None,
+                   "member_ids": [channel_member.id for channel_member in voice_state.channel.members],
+                   "duration": duration,
+                   "offset": offset,
+                   "application_id": interaction.application_id,
+                   "token": interaction.token}
+        if not await self.router.forward_clip_that(node, request):
+            await respond_func(":warning: I couldn't reach the part of me that's "
+                               "listening in this server, try again in a bit")
+        return True
+
+    async def routed_clip_that_handler(self, request: Dict) -> bool:
+        """
+        Handler for clip requests forwarded by other nodes (see
+        `_route_clip_that`). Returns False if this node doesn't hold the
+        guild's session.
+
+        The node that forwarded it runs the guild's shard (see
+        `sharding.shard_id`), so it's already checked the request against
+        its cache of the guild (e.g. that the user's in voice), and sent
+        who's in the voice channel. This node may not run that shard
+        (anymore), so its own cache of the guild may be missing or stale:
+        the clip is made from the session's state and the members sent.
+        """
+        if request["application_id"] != self.bot.application_id:
+            return False  # only ever reply to our own interactions
+        session = GatewayCog.clipped_sessions.get(request["guild_id"])
+        if session is None:
+            return False
+
+        members = [member
+                   for member in await asyncio.gather(*[self._session_member(session, member_id)
+                                                        for member_id in request["member_ids"]])
+                   if member is not None]
+        member = None
+        if request["member_id"] is not None:
+            member = await self._session_member(session, request["member_id"])
+
+        followup = self.router.followup(request["application_id"], request["token"])
+        if request["member_id"] is not None and member is None:
+            await followup.send(":warning: I couldn't find who you asked me to clip")
+            return True
+
+        await self._clip_session(respond_func=followup.send,
+                                 session=session,
+                                 member=member,
+                                 duration=request["duration"],
+                                 offset=request["offset"],
+                                 members=members)
+        return True
+
+    async def _session_member(self, session: ClippedSession, member_id: int) -> discord.Member | None:
+        """
+        A member of a session's guild: from this node's cache if it has
+        them, or else from Discord
+        """
+        member = session.voice.guild.get_member(member_id)
+        if member is not None:
+            return member
+        try:
+            return await session.voice.guild.fetch_member(member_id)
+        except discord.HTTPException:
+            return None
 
     ################################################################
     ######################### JOINING VOICE ########################
@@ -144,7 +367,7 @@ class GatewayCog(Cog, name="Command Gateway"):
         if voice is None:
             return
 
-        self._start_capturing_voice(voice, user)
+        await self._start_capturing_voice(voice, user)
 
         if GatewayCog.clipped_sessions.get(guild.id) is not None:
             # indicates voice connection succeeded and a Clipped
@@ -171,14 +394,21 @@ class GatewayCog(Cog, name="Command Gateway"):
 
         return voice_client
 
-    def _start_capturing_voice(self,
-                               voice: discord.VoiceClient,
-                               user: discord.Member) -> None:
+    async def _start_capturing_voice(self,
+                                     voice: discord.VoiceClient,
+                                     user: discord.Member) -> None:
         guild = voice.guild
         new_session = ClippedSession(voice=voice,
                                      started_by=user,
-                                     clip_size=GatewayCog.CLIP_SIZE,
-                                     chunk_size=GatewayCog.CHUNK_SIZE)
+                                     history_size=GatewayCog.HISTORY_SIZE,
+                                     chunk_size=GatewayCog.CHUNK_SIZE,
+                                     max_buffer_bytes=GatewayCog.BUFFER_MEMORY_CAP,
+                                     live_transcription_executor=(self.clip_executor
+                                                                  if GatewayCog.LIVE_TRANSCRIPTION
+                                                                  else None),
+                                     clip_executor=self.clip_executor,
+                                     node=self.router.node() if self.router is not None else None)
+        await new_session.create_session_document_in_db()
         GatewayCog.clipped_sessions[guild.id] = new_session
 
     async def _display_gui(self,
@@ -260,9 +490,9 @@ class GatewayCog(Cog, name="Command Gateway"):
                              guild: discord.Guild,
                              member: discord.Member):
         """Handler for `/optin` slash command."""
-        ClippedMember.set_opted_in_status(guild=guild,
-                                          member=member,
-                                          opted_in=True)
+        await ClippedMember.set_opted_in_status(guild=guild,
+                                                member=member,
+                                                opted_in=True)
 
         msg = ("**OPT-IN CONFIRMATION**\n"
                f"You have ***opted in*** to audio capture in '{guild.name}', "
@@ -294,9 +524,9 @@ class GatewayCog(Cog, name="Command Gateway"):
                               guild: discord.Guild,
                               member: discord.Member) -> None:
         """Handler for `/optout` slash command."""
-        ClippedMember.set_opted_in_status(guild=guild,
-                                          member=member,
-                                          opted_in=False)
+        await ClippedMember.set_opted_in_status(guild=guild,
+                                                member=member,
+                                                opted_in=False)
 
         msg = ("**OPT-OUT CONFIRMATION**\n"
                f"You have ***opted out*** of audio capture in '{guild.name}', "
@@ -332,7 +562,7 @@ class GatewayCog(Cog, name="Command Gateway"):
                                   guild: discord.Guild,
                                   query: str):
         """Handler for `/searchfor` slash command."""
-        query_results = Clip.query_for(guild, query, top_k=5)
+        query_results = await Clip.query_for(guild, query, top_k=5)
 
         if len(query_results) < 1:
             await respond_func(f":warning: Search query didn't return anything! (query: `{query}`)")
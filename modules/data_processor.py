@@ -1,200 +1,160 @@
 # Clipped modules
 from models.member import ClippedMember
+from modules.audio_encoder import AudioFormat
+from modules.audio_mixer import render_clip
+from modules.clip_executor import ClipExecutor
 from modules.data_streamer import DataStreamer
+from modules.live_transcriber import LiveTranscriber
 
 # Pycord modules
 import discord
-import discord.opus as op
-import discord.sinks as sinks
 
 # Other modules
 from io import BytesIO
-import pydub
-from typing import Dict, List
-import wave
+from typing import Dict, List, Tuple
 
 
 class DataProcessor:
     def __init__(self,
                  voice: discord.VoiceClient,
-                 streamer: DataStreamer):
+                 streamer: DataStreamer,
+                 transcriber: LiveTranscriber | None = None):
         self.vc = voice
         """Client of voice channel that this audio data is coming from"""
         self.streamer = streamer
         """DataStreamer object whose audio data we're processing"""
-        self.clip_size = streamer.clip_size
-        """The size of a clip, in seconds"""
+        self.transcriber = transcriber
+        """Transcriber of the streamer's audio as it comes in, if it's live-transcribed"""
+        self.history_size = streamer.history_size
+        """Seconds of audio kept in the buffer, i.e. how far back clips can go"""
         self.chunk_size = streamer.chunk_size
         """Size of audio chunks in buffer, in seconds"""
 
-        # WAV header parameters
-        self.channels = op.Decoder.CHANNELS
-        self.sampling_width = op.Decoder.SAMPLE_SIZE // self.channels
-        self.sampling_rate = op.Decoder.SAMPLING_RATE
-
-    def process_audio_data(self) -> BytesIO:
+        # WAV header parameters (of the PCM the ring buffer stores)
+        self.channels = streamer.audio_buffer.channels
+        self.sampling_width = streamer.audio_buffer.sampling_width
+        self.sampling_rate = streamer.audio_buffer.sampling_rate
+
+    async def process_clip(self,
+                           executor: ClipExecutor,
+                           clip_formats: List[AudioFormat],
+                           span_format: AudioFormat,
+                           duration: float,
+                           end: float | None = None,
+                           member: discord.Member | None = None,
+                           members: List[discord.Member] | None = None) -> Tuple[Dict[AudioFormat, BytesIO],
+                                                                             Dict[discord.Member, List[Tuple[float, BytesIO]]],
+                                                                             List[Dict]]:
         """
-        Transforms raw AudioData chunks from Pycord into a "clip",
-        outputted in WAV format.
+        Transforms a window of members' raw PCM tracks from the ring buffer
+        (the `duration` seconds of audio ending at `end`, on the buffer's
+        clock, see `AudioRingBuffer.seconds_recorded`) into a "clip" (all
+        members' audio overlayed), encoded in each of `clip_formats`, along with the spans of each member's own audio
+        where they're actually speaking, encoded in `span_format` and
+        paired with its start offset (in seconds) into the clip. Members
+        who didn't speak are left out. Both are built from the same
+        snapshot of the buffer, so opt-in statuses are only looked up
+        once. The per-member spans are primarily used so per-member
+        transcription can be offloaded elsewhere.
+
+        `end` is taken when the clip is asked for, so the clip is of the
+        same audio however long it waits to be processed (as long as it
+        hasn't been overwritten since). If not given, the clip ends with
+        the most recent audio.
+
+        If `member` is given, the clip is only of them: only their track
+        is read from the buffer, and it's used as the clip without mixing.
+        Otherwise it's of `members` (by default, whoever's in the voice
+        channel).
+
+        If the session is live-transcribed, whatever of the clip has
+        already been transcribed is returned as transcript segments (with
+        `start` relative to the clip), and spans are only cut from the
+        rest. Otherwise, the segments are empty.
+
+        The mixing and encoding run in the executor's process pool.
         """
 
         # This outlines the outputs of each step within this
         # audio data processing pipeline
-        filtered_data: List[Dict[discord.Member, sinks.AudioData]]
-        wav_chunks: List[Dict[discord.Member, BytesIO]]
-        standardized_wav_chunks: List[Dict[discord.Member, pydub.AudioSegment]]
-        overlayed_wav_chunks: List[pydub.AudioSegment]
-        clip: pydub.AudioSegment
+        opted_in: Dict[int, discord.Member]
+        filtered_data: Dict[int, bytes]
+        clips: List[bytes]
+        clip_by_member_id: Dict[int, List[Tuple[float, bytes]]]
+        live_segments: List[Dict]
+        transcribed_until: Dict[int, float]
 
         # These actually carry out the series of steps in the pipeline
-        filtered_data = self._filter_opted_in_members()
-        wav_chunks = self._prepend_wav_headers(filtered_data)
-        overlayed_wav_chunks = self._overlay_member_audios(wav_chunks)
-        clip = self._concatenate_chunks(overlayed_wav_chunks, overlay=True)
-
-        # Return final clip as BytesIO object
-        clip_bytes_io = BytesIO()
-        clip.export(clip_bytes_io, format="wav")
-        clip_bytes_io.seek(0)
-
-        return clip_bytes_io
-
-    def process_audio_data_by_member(self):
+        if member is not None:
+            members = [member]
+        elif members is None:
+            members = self.vc.channel.members
+        opted_in = await executor.timed("opt_in_lookup", self._get_opted_in_members(members))
+        audio_buffer = self.streamer.audio_buffer
+        offset = 0 if end is None else max(audio_buffer.seconds_recorded - end, 0)
+        num_bytes, end_offset = audio_buffer.window(duration, offset)
+        filtered_data = self._snapshot_opted_in_tracks(opted_in, num_bytes, end_offset)
+        live_segments, transcribed_until = self._slice_live_transcript(list(filtered_data.keys()),
+                                                                       num_bytes,
+                                                                       end_offset)
+        clips, clip_by_member_id = await executor.run_cpu("mix_and_encode",
+                                                          render_clip,
+                                                          filtered_data,
+                                                          num_bytes,
+                                                          clip_formats,
+                                                          span_format,
+                                                          self.channels,
+                                                          self.sampling_width,
+                                                          self.sampling_rate,
+                                                          transcribed_until)
+
+        clip_by_format = {clip_format: BytesIO(clip)
+                          for clip_format, clip in zip(clip_formats, clips)}
+
+        clip_by_member: Dict[discord.Member, List[Tuple[float, BytesIO]]] = {}
+        for member_id, spans in clip_by_member_id.items():
+            member = opted_in[member_id]
+            clip_by_member[member] = []
+            for offset, span in spans:
+                span_bytes = BytesIO(span)
+                span_bytes.name = f"{member.id}-{offset:.2f}-audio.{span_format.extension}"
+                clip_by_member[member].append((offset, span_bytes))
+
+        return clip_by_format, clip_by_member, live_segments
+
+    async def _get_opted_in_members(self, members: List[discord.Member]) -> Dict[int, discord.Member]:
+        """Look up which of the given members are 'opted-in', by member ID"""
+        return {member.id: member
+                for member
+                in await ClippedMember.get_opted_in_members(members)}
+
+    def _snapshot_opted_in_tracks(self,
+                                  opted_in: Dict[int, discord.Member],
+                                  num_bytes: int,
+                                  end_offset: int) -> Dict[int, bytes]:
         """
-        Transforms raw AudioData chunks from Pycord into a list of 
-        synced, equal-length WAV clips for each member that spoke. 
-        This function is primarily used so per-member transcription
-        can be offloaded elsewhere.
+        Filter for 'opted-in' users, copying the clip's window of each of
+        their PCM tracks out of the ring buffer so it can keep filling
+        while the clip is processed elsewhere. Only the window is copied,
+        not the rest of the history.
         """
-
-        # This outlines the outputs of each step within this
-        # audio data processing pipeline
-        filtered_data: List[Dict[discord.Member, sinks.AudioData]]
-        wav_chunks: List[Dict[discord.Member, BytesIO]]
-        clip_by_member: Dict[discord.Member, pydub.AudioSegment]
-
-        # These actually carry out the series of the steps in the pipeline.
-        # It's pretty much the same as process_audio_data(), but we skip
-        # the step of overlaying all members' audio.
-        filtered_data = self._filter_opted_in_members()
-        wav_chunks = self._prepend_wav_headers(filtered_data)
-        clip_by_member = self._concatenate_chunks(wav_chunks, overlay=False)
-
-        # Convert users' AudioSegments to BytesIO for more flexibility downstream
-        clip_by_member_bytes: Dict[discord.Member, BytesIO] = {}
-        for user, audio in clip_by_member.items():
-            audio_bytes = BytesIO()
-            audio.export(audio_bytes, format="wav")
-            audio_bytes.seek(0)
-            clip_by_member_bytes[user] = audio_bytes
-
-        return clip_by_member_bytes
-
-    def _filter_opted_in_members(self):
-        """Filter for 'opted-in' users"""
-        opted_in = {member.id: member
-                    for member
-                    in ClippedMember.get_opted_in_members(self.vc.channel.members)}
-        filtered_data: List[Dict[discord.Member, sinks.AudioData]] = []
-        for chunk in self.streamer.audio_data_buffer:
-            filtered_chunk = {opted_in[member_id]: data
-                              for member_id, data in chunk.items()
-                              if member_id in opted_in.keys()}
-            filtered_data.append(filtered_chunk)
+        audio_buffer = self.streamer.audio_buffer
+        filtered_data = {member_id: b"".join(audio_buffer.read(member_id, num_bytes, end_offset))
+                         for member_id in opted_in.keys()
+                         if member_id in audio_buffer}
 
         return filtered_data
 
-    def _prepend_wav_headers(self, filtered_data):
-        """
-        Convert all users' audio data within each chunk to 
-        WAV format by prepending WAV headers.
-        """
-        wav_chunks: List[Dict[discord.Member, BytesIO]] = []
-        for chunk in filtered_data:
-            wav_chunk: Dict[discord.Member, BytesIO] = {}
-            for member, member_audio_data in chunk.items():
-                member_wav = BytesIO()
-                with wave.open(member_wav, "wb") as w:
-                    # write WAV headers
-                    w.setnchannels(self.channels)
-                    w.setsampwidth(self.sampling_width)
-                    w.setframerate(self.sampling_rate)
-                    # write the actual audio data
-                    w.writeframes(member_audio_data.file.getvalue())
-                member_wav.seek(0)
-                wav_chunk[member] = member_wav
-            wav_chunks.append(wav_chunk)
-
-        return wav_chunks
-
-    def _overlay_member_audios(self, wav_chunks: List[Dict[discord.Member, BytesIO]]):
-        """Overlay all users' audio for each WAV audio chunk"""
-        overlayed_wav_chunks: List[pydub.AudioSegment] = []
-        for chunk in wav_chunks:
-            # initialize base with a silent chunk
-            overlayed_wav_chunk = (pydub.AudioSegment
-                                   .silent(duration=self.chunk_size * 1000)
-                                   .set_channels(self.channels)
-                                   .set_sample_width(self.sampling_width)
-                                   .set_frame_rate(self.sampling_rate))
-
-            # iteratively overlay all the users' voices
-            for user_audio_data in chunk.values():
-                # Convert BytesIO to pydub.AudioSegment
-                user_audio_segment = pydub.AudioSegment.from_file(file=user_audio_data,
-                                                                  format="wav")
-                overlayed_wav_chunk = (overlayed_wav_chunk
-                                       .overlay(user_audio_segment))
-
-            overlayed_wav_chunks.append(overlayed_wav_chunk)
-
-        return overlayed_wav_chunks
-
-    def _concatenate_chunks(self, wav_chunks: List[Dict[discord.Member, BytesIO]], overlay=True):
-        """
-        Concatenate WAV audio chunks into single clip. If the given
-        WAV chunks are an overlay of members, then this function will
-        output a pydub.AudioSegment. Otherwise, if it's not an overlay
-        (i.e. WAV chunks are still separated by user), then this function
-        will return a dictionary, mapping each user to their own 
-        concatenated pydub.AudioSegment.
-        """
-        clip = None
-        if overlay:
-            clip: pydub.AudioSegment = (pydub.AudioSegment
-                                        .silent(duration=0)
-                                        .set_channels(self.channels)
-                                        .set_sample_width(self.sampling_width)
-                                        .set_frame_rate(self.sampling_rate))
-
-            for chunk in wav_chunks:
-                if not isinstance(chunk, pydub.AudioSegment):
-                    raise Exception("Chunks within wav_chunks should be of type pydub.AudioSegment "
-                                    "if wav_chunks is an overlay of all members' audio. "
-                                    f"Instead got chunks of type '{type(chunk)}'")
-
-                clip += chunk
-        else:
-            clip: Dict[discord.Member, pydub.AudioSegment] = {}
-
-            for chunk in wav_chunks:
-                if not isinstance(chunk, Dict):
-                    raise Exception("Chunks within wav_chunks should be of type Dict if wav_chunks "
-                                    "is not an overlay (i.e. audio data is separated by member). "
-                                    f"Instead got chunks of type '{type(chunk)}'")
-
-                for member, new_member_chunk in chunk.items():
-                    member_audio_segment = clip.get(member)
-                    if member_audio_segment is None:
-                        member_audio_segment = (pydub.AudioSegment
-                                                .silent(duration=0)
-                                                .set_channels(self.channels)
-                                                .set_sample_width(self.sampling_width)
-                                                .set_frame_rate(self.sampling_rate))
-
-                    # Convert BytesIO to pydub.AudioSegment
-                    new_member_segment = pydub.AudioSegment.from_file(file=new_member_chunk,
-                                                                      format="wav")
-                    clip[member] = member_audio_segment + new_member_segment
-
-        return clip
+    def _slice_live_transcript(self,
+                               member_ids: List[int],
+                               num_bytes: int,
+                               end_offset: int) -> Tuple[List[Dict], Dict[int, float]]:
+        """What's already been transcribed of the clip's window (see `LiveTranscriber.slice()`)"""
+        if self.transcriber is None:
+            return [], {}
+
+        audio_buffer = self.streamer.audio_buffer
+        end = audio_buffer.seconds_recorded - end_offset / audio_buffer.bytes_per_second
+        start = end - num_bytes / audio_buffer.bytes_per_second
+
+        return self.transcriber.slice(member_ids, start, end)
@@ -1,32 +1,74 @@
+# Clipped modules
+from modules.audio_buffer import AudioRingBuffer
+from modules.voice_timeline import VoiceTimeline
+
 # Pycord modules
 import discord
 import discord.opus as op
-from discord.sinks import Sink, PCMSink
+from discord.sinks import Filters, Sink, PCMSink
 
 # Other modules
 import asyncio
-from typing import Deque
+import threading
+import time
+
+
+class ClipSink(PCMSink):
+    """
+    PCMSink that stages each member's decoded frames on the session's
+    timeline (see `VoiceTimeline`), rather than appending them to a file.
+    Writes are guarded by a lock, so the stream loop can safely take
+    chunks while Pycord's decoder thread is still writing to the sink.
+    """
+
+    def __init__(self, chunk_bytes: int, *, filters=None):
+        super().__init__(filters=filters)
+        self.lock = threading.Lock()
+        """Guards `timeline` against concurrent reads and writes"""
+        self.timeline = VoiceTimeline(chunk_bytes)
+        """Members' frames, staged where they belong in time"""
+
+    def write_frame(self,
+                    user_id: int,
+                    pcm: bytes,
+                    receive_time: float,
+                    ssrc: int | None = None,
+                    rtp_timestamp: int | None = None) -> None:
+        """Stage a decoded frame, by its RTP timestamp if it has one (see `ClippedVoiceClient`)"""
+        with self.lock:
+            self.timeline.place(user_id, pcm, receive_time, ssrc, rtp_timestamp)
+
+    @Filters.container
+    def write(self, data, user):
+        # Frames written without their RTP timestamp are placed by when they arrived
+        self.write_frame(user, data, time.perf_counter())
 
 
 class DataStreamer:
+    JITTER_LATENCY = 0.2  # seconds a chunk is held back for late packets before it's buffered
+
     def __init__(self,
                  voice: discord.VoiceClient,
-                 clip_size: int = 30,
-                 chunk_size: int = 1):
-        self.audio_data_buffer: Deque[dict] = Deque(
-            maxlen=int(clip_size / chunk_size) + 1)
-        """Buffer of audio data, straight from Pycord"""
+                 history_size: int = 30,
+                 chunk_size: int = 1,
+                 max_buffer_bytes: int = 512 * 1024 ** 2):
+        self.audio_buffer = AudioRingBuffer(history_size=history_size,
+                                            chunk_size=chunk_size,
+                                            max_bytes=max_buffer_bytes)
+        """Ring buffer of each member's most recent PCM audio"""
         self.voice = voice
         """Voice client we're streaming audio from"""
         self.is_streaming = False
         """Indicates whether or not we're actively capturing audio"""
-        self.clip_size = clip_size
-        """Size of clips in seconds"""
+        self.history_size = history_size
+        """Seconds of audio kept in the buffer, i.e. how far back clips can go"""
         self.chunk_size = chunk_size
         """Size of audio chunks in buffer, in seconds"""
         self.stream_loop_task = None
         """Task that's running the loop to stream voice data from Discord"""
 
+        self._chunk = memoryview(bytearray(self.audio_buffer.chunk_bytes))  # reused every tick
+
     async def start(self) -> None:
         """Begin streaming audio data into buffers"""
         if self.is_streaming:
@@ -36,19 +78,37 @@ class DataStreamer:
             pass
 
         async def stream_loop():
-            sink = PCMSink()
+            sink = ClipSink(self.audio_buffer.chunk_bytes)
             self.is_streaming = True
             self.voice.start_recording(sink, noop_callback)
 
+            # Chunks are buffered on the timeline's clock, not the loop's,
+            # so a late wake-up catches up rather than drifting
             while True:
                 await asyncio.sleep(self.chunk_size)
-
-                # sink.audio_data.
+                while sink.timeline.chunk_ready(DataStreamer.JITTER_LATENCY):
+                    self._buffer_chunk(sink)
 
         self.stream_loop_task = (asyncio
                                  .get_event_loop()
                                  .create_task(stream_loop()))
 
+    def _buffer_chunk(self, sink: ClipSink) -> None:
+        """
+        Move each member's audio for the next chunk of the timeline out of
+        the sink, into their track in the ring buffer (through a single
+        reused chunk buffer). The sink only ever holds what's arrived ahead
+        of the ring buffer, so memory stays the same however long the
+        session runs.
+        """
+        with sink.lock:
+            for member_id in sink.timeline.member_ids():
+                num_bytes = sink.timeline.take_chunk(member_id, self._chunk)
+                self.audio_buffer.write_chunk(member_id, self._chunk[:num_bytes])
+            sink.timeline.advance()
+
+        self.audio_buffer.advance()
+
     def stop(self) -> None:
         """Stop streaming audio data into buffers"""
         if not self.is_streaming:
@@ -78,6 +138,5 @@ class DataStreamer:
         sample_size = op.Decoder.SAMPLE_SIZE
 
         num_bytes = int(duration * sampling_rate * sample_size)
-        print(f"\n\n{num_bytes}\n\n")
 
         return num_bytes
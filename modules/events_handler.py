@@ -24,6 +24,13 @@ class EventsCog(Cog, name="Event Handler"):
     async def on_ready(self):
         print("Clipped bot ready")
 
+        gateway: GatewayCog = self.bot.get_cog("Command Gateway")
+        if gateway.router is not None:
+            await gateway.router.start(gateway.routed_clip_that_handler)
+
+        # Finish ingesting clips that were interrupted by a restart
+        await gateway.ingestion.resume_pending(self.bot)
+
     ####################################################################
     ################### VOICE CHANNEL STATUS UPDATE ####################
     ####################################################################
@@ -57,7 +64,7 @@ class EventsCog(Cog, name="Event Handler"):
 
         bot_left_vc = member_updated.id == BOT_USER_ID and after.channel is None
         if bot_left_vc:
-            self._stop_capturing_voice(guild)
+            await self._stop_capturing_voice(guild)
             if GatewayCog.clipped_sessions.get(guild.id) is not None:
                 # mapping may not exist if bot failed voice connection
                 # and is undergoing a reconnect
@@ -75,32 +82,33 @@ class EventsCog(Cog, name="Event Handler"):
             # Bot isn't in voice, so no need to send notification
             return
 
-        for member in voice.members:
-            if member.id == BOT_USER_ID:  # skip the bot itself
-                continue
-
-            member_exists = ClippedMember.member_exists(guild_id=member.guild.id,
-                                                        member_id=member.id)
-            if not member_exists:
-                ClippedMember.set_opted_in_status(
-                    member.guild, member, opted_in=True)
-                dm = await member.create_dm()
-                view = OptInView(member=member,
-                                 opt_in_handler=GatewayCog.opt_in_handler,
-                                 opt_out_handler=GatewayCog.opt_out_handler,
-                                 show_opt_in=True,
-                                 show_opt_out=True)
-
-                msg = ("**OPT-IN PREFERENCE OPTIONS**\n"
-                       "Your voice is currently being captured by the Clipped bot in "
-                       f"the '{member.guild.name}' server for any audio clips "
-                       "generated. You may click either option below to opt-in or "
-                       "opt-out of voice capture moving forward")
-                await dm.send(msg, view=view)
-
-    def _stop_capturing_voice(self, guild: discord.Guild):
+        members = [member for member in voice.members
+                   if member.id != BOT_USER_ID]  # skip the bot itself
+
+        # Look up and create all new members' documents in one go
+        new_members = await ClippedMember.get_new_members(members)
+        await ClippedMember.set_opted_in_statuses(members=new_members,
+                                                  opted_in=True,
+                                                  overwrite=False)
+
+        for member in new_members:
+            dm = await member.create_dm()
+            view = OptInView(member=member,
+                             opt_in_handler=GatewayCog.opt_in_handler,
+                             opt_out_handler=GatewayCog.opt_out_handler,
+                             show_opt_in=True,
+                             show_opt_out=True)
+
+            msg = ("**OPT-IN PREFERENCE OPTIONS**\n"
+                   "Your voice is currently being captured by the Clipped bot in "
+                   f"the '{member.guild.name}' server for any audio clips "
+                   "generated. You may click either option below to opt-in or "
+                   "opt-out of voice capture moving forward")
+            await dm.send(msg, view=view)
+
+    async def _stop_capturing_voice(self, guild: discord.Guild):
         session = GatewayCog.clipped_sessions[guild.id]
-        session.stop_session()
+        await session.stop_session()
 
 
 def setup(bot):
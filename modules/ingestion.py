@@ -0,0 +1,285 @@
+"""
+Staged ingestion of clips into storage and search:
+
+    uploaded -> transcribed -> summarized -> embedded -> indexed
+
+Each stage persists its output (and the stage reached) in the clip's
+metadata document before the next one starts, and is retried with
+backoff if it fails, so a failure only costs the stage it happened in.
+Clips that didn't make it through every stage (e.g. the bot crashed or
+restarted mid-clip) are picked back up with `resume_pending()`.
+
+Clips are ingested in the background (see `submit()`), outside of their
+guild's clip queue, so a slow stage (or its retries) never holds up the
+next clip's reply.
+
+Member audio waiting to be transcribed is saved under `INGEST_DIR`
+until the clip is transcribed, so it survives a restart too. It's saved
+before the clip's metadata document exists, so audio left behind by a
+crash in between is swept up by `resume_pending()`.
+"""
+# Clipped modules
+from models.clip import Clip
+from modules.audio_encoder import AudioFormat
+from modules.clip_executor import ClipExecutor
+from modules.sharding import shard_id
+
+# Pycord modules
+import discord
+
+# Other modules
+import asyncio
+from collections import defaultdict
+import io
+import logging
+import os
+import random
+import shutil
+import time
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+
+_log = logging.getLogger(__name__)
+
+INGEST_DIR = os.getenv("CLIPPED_INGEST_DIR", "pending_clips")
+STAGES = ["uploaded", "transcribed", "summarized", "embedded", "indexed"]
+MAX_ATTEMPTS = 5  # attempts at a stage before the clip is left for the next restart
+BACKOFF_BASE = 1.0  # seconds before the first retry, doubled on each retry after
+BACKOFF_MAX = 60.0  # max seconds between retries
+RESUME_CONCURRENCY = 2  # max pending clips resumed at once
+INGEST_CONCURRENCY = 4  # max new clips ingested at once (the rest wait their turn)
+
+
+class IngestionPipeline:
+    """Runs clips through the ingestion stages, and tracks each stage's throughput"""
+
+    def __init__(self, executor: ClipExecutor, ingest_dir: str = INGEST_DIR):
+        self.executor = executor
+        """Executor that blocking stages are run in"""
+        self.ingest_dir = ingest_dir
+        """Directory that audio waiting to be transcribed is saved in"""
+
+        self._started_at = time.monotonic()
+        self._created_at = time.time()  # spans saved before this are from a previous run
+        self._completed: Dict[str, int] = defaultdict(int)
+        self._retries: Dict[str, int] = defaultdict(int)
+        self._failed: Dict[str, int] = defaultdict(int)
+        self._resumed = False
+        self._ingesting = asyncio.Semaphore(INGEST_CONCURRENCY)
+        self._tasks: Set[asyncio.Task] = set()  # referenced so they aren't garbage collected
+
+    def submit(self,
+               clip: Clip,
+               clip_bytes: bytes,
+               audio_format: AudioFormat,
+               clip_by_member: Dict[discord.Member, List[Tuple[float, io.BytesIO]]]) -> None:
+        """
+        Ingest the clip (see `ingest()`) in a background task, without
+        waiting for it. At most `INGEST_CONCURRENCY` clips are ingested at
+        once; the rest wait for one of them to finish.
+        """
+        async def ingest():
+            async with self._ingesting:
+                try:
+                    await self.ingest(clip, clip_bytes, audio_format, clip_by_member)
+                except Exception:
+                    _log.exception(f"Ingestion failed (id={clip.id})")
+
+        task = asyncio.create_task(ingest())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def ingest(self,
+                     clip: Clip,
+                     clip_bytes: bytes,
+                     audio_format: AudioFormat,
+                     clip_by_member: Dict[discord.Member, List[Tuple[float, io.BytesIO]]]) -> bool:
+        """
+        Upload the clip and run it through every ingestion stage. Returns
+        whether it made it all the way through. If not, it's left at the
+        last stage it completed.
+        """
+        pending_spans = await self.executor.run_io("ingest_save_spans",
+                                                   self._save_spans,
+                                                   clip,
+                                                   clip_by_member)
+
+        async def upload():
+            object_uri = await self.executor.run_io("upload",
+                                                    clip.store_clip_in_blob,
+                                                    clip_bytes,
+                                                    audio_format)
+            await clip.create_metadata_document(object_uri, pending_spans)
+
+        if not await self._run_stage(clip, "uploaded", upload):
+            return False
+
+        return await self._run_from(clip, "uploaded", pending_spans)
+
+    async def resume_pending(self, bot: discord.Bot) -> None:
+        """
+        Pick back up every clip whose ingestion didn't finish. Only runs
+        once per pipeline, since the bot can become ready more than once.
+        """
+        if self._resumed:
+            return
+        self._resumed = True
+
+        def owns_guild(guild_id: int) -> bool:
+            # Other workers resume the clips of guilds on their shards
+            return (not isinstance(bot, discord.AutoShardedBot)
+                    or bot.shard_ids is None
+                    or shard_id(guild_id, bot.shard_count) in bot.shard_ids)
+
+        docs = await Clip.get_unfinished_documents(final_stage=STAGES[-1])
+        await self.executor.run_io("ingest_sweep_spans",
+                                   self._sweep_orphaned_spans,
+                                   docs,
+                                   owns_guild)
+
+        docs = [doc for doc in docs if owns_guild(doc["_id"]["guild_id"])]
+        if len(docs) == 0:
+            return
+        _log.info(f"Resuming ingestion of {len(docs)} clip(s)")
+
+        semaphore = asyncio.Semaphore(RESUME_CONCURRENCY)
+
+        async def resume(doc: Dict):
+            guild = bot.get_guild(doc["_id"]["guild_id"])
+            if guild is None:
+                _log.warning(f"Can't resume ingestion, not in guild anymore (id={doc['_id']})")
+                return
+
+            async with semaphore:
+                await self._run_from(Clip.from_document(guild, doc),
+                                     doc["stage"],
+                                     doc.get("pending_spans", []))
+
+        await asyncio.gather(*[resume(doc) for doc in docs])
+
+    def metrics(self) -> Dict[str, Dict]:
+        """
+        For each stage: how many clips completed it, how many retries and
+        failures (after every attempt) there were, and its throughput in
+        clips per minute since the pipeline was created.
+        """
+        minutes = max(time.monotonic() - self._started_at, 1e-9) / 60
+        return {stage: {"completed": self._completed[stage],
+                        "retries": self._retries[stage],
+                        "failed": self._failed[stage],
+                        "per_minute": self._completed[stage] / minutes}
+                for stage in STAGES}
+
+    async def _run_from(self, clip: Clip, stage: str, pending_spans: List[Dict]) -> bool:
+        """Run every stage after `stage`, stopping at the first one that fails"""
+        stage_funcs: Dict[str, Callable[[], Awaitable]] = {
+            "transcribed": lambda: self._transcribe(clip, pending_spans),
+            "summarized": clip.summarize,
+            "embedded": clip.embed,
+            "indexed": clip.index
+        }
+
+        if stage != "uploaded":
+            # Saved audio is only needed until the clip is transcribed
+            await self.executor.run_io("ingest_remove_spans",
+                                       self._remove_spans,
+                                       pending_spans)
+
+        for next_stage in STAGES[STAGES.index(stage) + 1:]:
+            if not await self._run_stage(clip, next_stage, stage_funcs[next_stage]):
+                return False
+
+        return True
+
+    async def _run_stage(self, clip: Clip, stage: str, func: Callable[[], Awaitable]) -> bool:
+        """Run a stage, retrying with exponential backoff (and jitter) if it fails"""
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                await self.executor.timed(f"ingest_{stage}", func())
+            except Exception:
+                if attempt == MAX_ATTEMPTS:
+                    _log.exception(f"Ingestion stage '{stage}' failed, giving up until "
+                                   f"the next restart (id={clip.id})")
+                    self._failed[stage] += 1
+                    return False
+
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+                delay *= random.uniform(0.5, 1.0)
+                _log.warning(f"Ingestion stage '{stage}' failed, retrying in {delay:.1f}s "
+                             f"(id={clip.id}, attempt={attempt})", exc_info=True)
+                self._retries[stage] += 1
+                await asyncio.sleep(delay)
+            else:
+                self._completed[stage] += 1
+                return True
+
+    async def _transcribe(self, clip: Clip, pending_spans: List[Dict]) -> None:
+        spans = await self.executor.run_io("ingest_load_spans", self._load_spans, pending_spans)
+        await clip.transcribe(spans)
+        await self.executor.run_io("ingest_remove_spans", self._remove_spans, pending_spans)
+
+    def _save_spans(self,
+                    clip: Clip,
+                    clip_by_member: Dict[discord.Member, List[Tuple[float, io.BytesIO]]]) -> List[Dict]:
+        """Save members' audio spans to disk, returning where each was saved"""
+        if not any(clip_by_member.values()):
+            return []
+
+        clip_dir = os.path.join(self.ingest_dir,
+                                f"{clip.guild.id}-{clip.timestamp:%Y%m%d%H%M%S%f}")
+        os.makedirs(clip_dir, exist_ok=True)
+
+        pending_spans = []
+        for member, spans in clip_by_member.items():
+            for offset, audio_bytes in spans:
+                path = os.path.join(clip_dir, os.path.basename(audio_bytes.name))
+                with open(path, "wb") as f:
+                    f.write(audio_bytes.getbuffer())
+
+                pending_spans.append({"member_id": member.id,
+                                      "member_name": member.name,
+                                      "offset": offset,
+                                      "path": path})
+
+        return pending_spans
+
+    @staticmethod
+    def _load_spans(pending_spans: List[Dict]) -> List[Tuple[int, str, float, io.BytesIO]]:
+        spans = []
+        for span in pending_spans:
+            with open(span["path"], "rb") as f:
+                audio_bytes = io.BytesIO(f.read())
+            audio_bytes.name = os.path.basename(span["path"])  # file type is detected from its name
+
+            spans.append((span["member_id"], span["member_name"], span["offset"], audio_bytes))
+
+        return spans
+
+    def _sweep_orphaned_spans(self, docs: List[Dict], owns_guild: Callable[[int], bool]) -> None:
+        """
+        Remove the saved audio of clips that never got a metadata document
+        (the bot stopped between saving it and creating the document), in
+        guilds this worker owns
+        """
+        if not os.path.isdir(self.ingest_dir):
+            return
+
+        pending_dirs = {os.path.basename(os.path.dirname(span["path"]))
+                        for doc in docs
+                        for span in doc.get("pending_spans", [])}
+
+        for entry in os.scandir(self.ingest_dir):
+            guild_id = entry.name.split("-", 1)[0]
+            if (not entry.is_dir()
+                    or not guild_id.isdigit()
+                    or not owns_guild(int(guild_id))
+                    or entry.name in pending_dirs
+                    or entry.stat().st_mtime >= self._created_at):  # may be a clip being ingested now
+                continue
+
+            _log.info(f"Removing audio of a clip that was never stored (dir={entry.path})")
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    @staticmethod
+    def _remove_spans(pending_spans: List[Dict]) -> None:
+        for clip_dir in {os.path.dirname(span["path"]) for span in pending_spans}:
+            shutil.rmtree(clip_dir, ignore_errors=True)
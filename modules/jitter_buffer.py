@@ -0,0 +1,152 @@
+"""
+Per-SSRC jitter buffer in front of the Opus decoder, so out-of-order
+and lost UDP packets don't turn into clicks and gaps in clips.
+
+Packets are held until they can be decoded in sequence order. Once
+`REORDER_DEPTH` later packets have arrived while one is still missing,
+it's declared lost and concealed: from the next packet's forward error
+correction (FEC) data if it has any, or else with the decoder's packet
+loss concealment (PLC). A packet that turns up after it was concealed
+is too late, and is dropped.
+"""
+# Pycord modules
+import discord.opus as op
+
+# Other modules
+from typing import Dict, List, Tuple
+
+REORDER_DEPTH = 3  # packets that can arrive past a missing one before it's declared lost
+MAX_CONCEALED = 5  # max frames concealed per gap (longer gaps are mostly left as silence)
+RESET_GAP = 1_000  # sequence number jump taken to mean the stream restarted
+SEQUENCE_MOD = 2 ** 16  # RTP sequence numbers are 16-bit and wrap around
+SILENCE_FRAME = b"\xf8\xff\xfe"  # Opus frame sent when a member stops talking
+
+
+class JitterStats:
+    """Counters of received voice packets (e.g. across all of a guild's SSRCs)"""
+
+    def __init__(self):
+        self.received = 0
+        """Packets received"""
+        self.late = 0
+        """Packets that arrived after they'd already been concealed, or twice"""
+        self.lost = 0
+        """Packets that never arrived in time"""
+        self.concealed = 0
+        """Frames synthesized in place of lost packets (with FEC or PLC)"""
+        self.recovered = 0
+        """Concealed frames that were recovered from FEC data"""
+
+    def as_dict(self) -> Dict[str, int]:
+        return {"received": self.received,
+                "late": self.late,
+                "lost": self.lost,
+                "concealed": self.concealed,
+                "recovered": self.recovered}
+
+
+class JitterBuffer:
+    """Reorders one SSRC's packets, decoding them in order and concealing lost ones"""
+
+    def __init__(self,
+                 decoder: op.Decoder,
+                 stats: JitterStats,
+                 depth: int = REORDER_DEPTH):
+        self.decoder = decoder
+        """This SSRC's Opus decoder (decoding is stateful, so it's never shared)"""
+        self.stats = stats
+        """Counters this buffer adds to"""
+        self.depth = depth
+        """Packets that can arrive past a missing one before it's declared lost"""
+
+        self._next_sequence: int | None = None
+        self._pending: Dict[int, Tuple[int, bytes]] = {}  # sequence -> (RTP timestamp, payload)
+
+    def push(self, sequence: int, rtp_timestamp: int, payload: bytes) -> List[Tuple[int, bytes]]:
+        """
+        Add a received packet's (decrypted) Opus payload. Returns every
+        frame that's now ready, in order, as (RTP timestamp, PCM).
+        Silence frames are passed over, like Pycord does.
+        """
+        self.stats.received += 1
+        frames = []
+
+        if self._next_sequence is not None:
+            ahead = self._ahead(sequence)
+            if abs(ahead) >= RESET_GAP:
+                # The stream restarted, so whatever's held can't be waited on anymore
+                frames += self._drain()
+            elif ahead < 0 or sequence in self._pending:
+                self.stats.late += 1
+                return frames
+
+        if self._next_sequence is None:
+            self._next_sequence = sequence
+        self._pending[sequence] = (rtp_timestamp, payload)
+
+        return frames + self._release()
+
+    def _release(self) -> List[Tuple[int, bytes]]:
+        frames = []
+        while len(self._pending) > 0:
+            packet = self._pending.pop(self._next_sequence, None)
+            if packet is not None:
+                frames += self._decode(*packet)
+                self._next_sequence = (self._next_sequence + 1) % SEQUENCE_MOD
+            elif len(self._pending) > self.depth:
+                frames += self._conceal()
+            else:
+                break  # still waiting on the missing packet
+
+        return frames
+
+    def _conceal(self) -> List[Tuple[int, bytes]]:
+        """Skip past the missing packets, concealing (up to `MAX_CONCEALED` of) them"""
+        next_sequence = min(self._pending.keys(), key=self._ahead)
+        gap = self._ahead(next_sequence)
+        next_timestamp, next_payload = self._pending[next_sequence]
+        self.stats.lost += gap
+
+        frames = []
+        for i in range(min(gap, MAX_CONCEALED)):
+            timestamp = (next_timestamp - (gap - i) * op.Decoder.SAMPLES_PER_FRAME) % 2 ** 32
+            try:
+                if i == gap - 1 and next_payload != SILENCE_FRAME:
+                    # The next packet carries a lower quality copy of this one
+                    pcm = self.decoder.decode(next_payload, fec=True)
+                    self.stats.recovered += 1
+                else:
+                    pcm = self.decoder.decode(None, fec=False)
+            except op.OpusError:
+                continue
+
+            self.stats.concealed += 1
+            frames.append((timestamp, pcm))
+
+        self._next_sequence = next_sequence
+        return frames
+
+    def _decode(self, rtp_timestamp: int, payload: bytes) -> List[Tuple[int, bytes]]:
+        if payload == SILENCE_FRAME:
+            return []
+
+        try:
+            return [(rtp_timestamp, self.decoder.decode(payload, fec=False))]
+        except op.OpusError:
+            # A corrupt packet is as good as lost
+            self.stats.lost += 1
+            self.stats.concealed += 1
+            return [(rtp_timestamp, self.decoder.decode(None, fec=False))]
+
+    def _drain(self) -> List[Tuple[int, bytes]]:
+        """Decode everything held, in order, without waiting on what's missing"""
+        frames = []
+        for sequence in sorted(self._pending.keys(), key=self._ahead):
+            frames += self._decode(*self._pending[sequence])
+        self._pending.clear()
+        self._next_sequence = None
+        return frames
+
+    def _ahead(self, sequence: int) -> int:
+        """How many packets `sequence` is ahead of the next one due (negative if behind)"""
+        return (sequence - self._next_sequence + SEQUENCE_MOD // 2) % SEQUENCE_MOD - SEQUENCE_MOD // 2
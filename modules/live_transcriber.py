@@ -0,0 +1,320 @@
+"""
+Live transcription of a session's voice, as it's buffered, so a clip's
+transcript is mostly ready before the clip is even made.
+
+Every `STEP` seconds, each opted-in member's last `WINDOW` seconds of
+audio are transcribed. Consecutive windows overlap by `OVERLAP` seconds,
+so a word cut off at the end of one window is heard whole in the next:
+
+    window 1  |----------------------|
+    window 2                   |----------------------|
+                               ^ overlap
+
+Segments near the end of a window are held back until the next window
+(which covers them whole), and segments the previous window already
+committed are dropped, by where their midpoint falls. A segment that's
+cut off by the end of a window, but started too early for the next
+window to have it whole, is held back too, and the member's next window
+reaches back to where it starts. Timestamps are on the audio buffer's
+clock (`AudioRingBuffer.seconds_recorded`), and segments older than the
+buffer's history are pruned, so the transcript never outgrows the audio
+it describes.
+
+A clip then takes the already-transcribed part of its window from the
+transcript, and only transcribes what's left (at most the last couple
+of windows' worth) on its own.
+"""
+# Clipped modules
+from bw_secrets import TRANSCRIPTION_MODEL
+from models.member import ClippedMember
+from modules.audio_buffer import AudioRingBuffer
+from modules.audio_encoder import OPUS, AudioFormat, encode_pcm
+from modules.clip_executor import ClipExecutor
+import modules.clients as clients
+from modules.vad import detect_voiced_spans
+
+# Pycord modules
+import discord
+
+# Other modules
+import asyncio
+from collections import deque
+import io
+import logging
+from typing import Awaitable, Callable, Deque, Dict, List, Tuple
+
+_log = logging.getLogger(__name__)
+
+WINDOW = 30  # length of each transcribed window (in seconds)
+OVERLAP = 10  # overlap between consecutive windows (in seconds)
+STEP = WINDOW - OVERLAP  # time between windows (in seconds)
+MAX_SEGMENTS = 2_000  # max transcript segments kept per member
+WINDOW_FORMAT = OPUS  # format windows are sent for transcription in
+TRANSCRIPTION_TIMEOUT = 30  # seconds before a window's transcription is given up on
+CUT_OFF_MARGIN = 1.0  # segments ending this close to the end of a window (in seconds) may be cut off
+
+Transcribe = Callable[[io.BytesIO], Awaitable[List[Dict]]]
+"""
+Transcribes an audio file into segments ({"start", "end", "text"}, with
+times in seconds into the file)
+"""
+
+
+async def openai_transcribe(audio_bytes: io.BytesIO) -> List[Dict]:
+    """Transcribe audio with OpenAI, into timestamped segments"""
+    response = await asyncio.wait_for(
+        clients.openai_client().audio.transcriptions.create(model=TRANSCRIPTION_MODEL,
+                                                            file=audio_bytes,
+                                                            response_format="verbose_json"),
+        timeout=TRANSCRIPTION_TIMEOUT)
+    return response.model_dump()["segments"]
+
+
+def encode_window(pcm: bytes,
+                  audio_format: AudioFormat,
+                  channels: int,
+                  sampling_width: int,
+                  sampling_rate: int) -> bytes | None:
+    """
+    Encode a window of a member's PCM audio, or return None if there's
+    no speech in it (so it isn't worth transcribing). Only takes and
+    returns plain bytes, so it can be run in a worker process.
+    """
+    if len(detect_voiced_spans(pcm, channels=channels, sampling_rate=sampling_rate)) == 0:
+        return None
+
+    return encode_pcm(pcm,
+                      audio_format=audio_format,
+                      channels=channels,
+                      sampling_width=sampling_width,
+                      sampling_rate=sampling_rate)
+
+
+class MemberTranscript:
+    """One member's rolling transcript"""
+
+    def __init__(self, member_name: str):
+        self.member_name = member_name
+        self.segments: Deque[Dict] = deque(maxlen=MAX_SEGMENTS)
+        """Committed segments, oldest first, with times on the buffer's clock"""
+        self.covered_from: float | None = None
+        """Start of the audio that's been transcribed without gaps, if any has"""
+        self.covered_until = 0.0
+        """End of the audio that's been transcribed without gaps"""
+        self.committed_until = 0.0
+        """End of the last committed segment"""
+        self.pending_from: float | None = None
+        """Start of the first segment left for the next window, which starts (a margin) before it"""
+
+
+class LiveTranscriber:
+    """Transcribes a session's buffered voice in the background, as it comes in"""
+
+    def __init__(self,
+                 voice: discord.VoiceClient,
+                 audio_buffer: AudioRingBuffer,
+                 history_size: float,
+                 executor: ClipExecutor,
+                 transcribe: Transcribe = openai_transcribe,
+                 window: float = WINDOW,
+                 overlap: float = OVERLAP):
+        if not 0 <= overlap < window:
+            raise Exception(f"Window overlap ({overlap}s) must be less than the window ({window}s)")
+
+        self.voice = voice
+        """Voice client whose members are transcribed"""
+        self.audio_buffer = audio_buffer
+        """Ring buffer that audio is read from"""
+        self.history_size = history_size
+        """Seconds of transcript kept, i.e. as far back as the buffer goes"""
+        self.executor = executor
+        """Executor that windows are encoded in"""
+        self.transcribe = transcribe
+        """Function that transcribes each window"""
+        self.window = window
+        """Length of each transcribed window, in seconds"""
+        self.overlap = overlap
+        """Overlap between consecutive windows, in seconds"""
+        self.transcripts: Dict[int, MemberTranscript] = {}
+        """Each member's transcript, by member ID"""
+        self.task: asyncio.Task | None = None
+        """Task that's running the transcription loop"""
+
+        # WAV parameters
+        self.channels = audio_buffer.channels
+        self.sampling_width = audio_buffer.sampling_width
+        self.sampling_rate = audio_buffer.sampling_rate
+
+    def start(self) -> None:
+        """Begin transcribing in the background"""
+        async def transcribe_loop():
+            while True:
+                await asyncio.sleep(self.window - self.overlap)
+                try:
+                    members = await ClippedMember.get_opted_in_members(self.voice.channel.members)
+                    await self.transcribe_window(members)
+                except Exception:
+                    _log.exception("Live transcription failed, trying again next window")
+
+        if self.task is None:
+            self.task = asyncio.create_task(transcribe_loop(),
+                                            name="LiveTranscriber > transcribe task")
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def transcribe_window(self, members: List[discord.Member]) -> None:
+        """
+        Transcribe the latest window of each of the given members' audio,
+        and add it to their transcripts
+        """
+        # Snapshot every member's window at the same point in time
+        window_end = self.audio_buffer.seconds_recorded
+        windows: Dict[int, Tuple[discord.Member, bytes, float]] = {}
+        for member in members:
+            if member.id not in self.audio_buffer:
+                continue
+
+            # A member's window reaches back to (a margin before) what the
+            # last one left for it, by at most a step, so it never keeps growing
+            transcript = self.transcripts.get(member.id)
+            duration = self.window
+            if transcript is not None and transcript.pending_from is not None:
+                duration = min(max(duration, window_end - transcript.pending_from + CUT_OFF_MARGIN),
+                               2 * self.window - self.overlap)
+
+            num_bytes, _ = self.audio_buffer.window(duration)
+            windows[member.id] = (member,
+                                  b"".join(self.audio_buffer.read(member.id, num_bytes)),
+                                  window_end - num_bytes / self.audio_buffer.bytes_per_second)
+
+        # Members who weren't transcribed this time have a gap in their transcript
+        for member_id, transcript in self.transcripts.items():
+            if member_id not in windows:
+                transcript.covered_from = None
+                transcript.pending_from = None
+
+        await asyncio.gather(*[self._transcribe_member(member, pcm, window_start, window_end)
+                               for member, pcm, window_start in windows.values()])
+        self._prune(window_end)
+
+    def slice(self,
+              member_ids: List[int],
+              start: float,
+              end: float) -> Tuple[List[Dict], Dict[int, float]]:
+        """
+        Get what's already been transcribed of the given members between
+        `start` and `end` (on the buffer's clock). Returns the segments,
+        with `start` relative to the slice, and how many seconds from the
+        start of the slice each member is transcribed up to. A member
+        whose transcript doesn't cover the start of the slice isn't
+        included at all.
+        """
+        segments: List[Dict] = []
+        transcribed_until: Dict[int, float] = {}
+
+        for member_id in member_ids:
+            transcript = self.transcripts.get(member_id)
+            if transcript is None or transcript.covered_from is None or transcript.covered_from > start:
+                continue
+
+            until = min(transcript.covered_until, end)
+            if until <= start:
+                continue
+
+            transcribed_until[member_id] = until - start
+            segments.extend({"member_name": transcript.member_name,
+                             "start": max(seg["start"] - start, 0.0),
+                             "text": seg["text"]}
+                            for seg in transcript.segments
+                            if start <= (seg["start"] + seg["end"]) / 2 < until)
+
+        return segments, transcribed_until
+
+    async def _transcribe_member(self,
+                                 member: discord.Member,
+                                 pcm: bytes,
+                                 window_start: float,
+                                 window_end: float) -> None:
+        transcript = self.transcripts.get(member.id)
+        if transcript is None:
+            transcript = MemberTranscript(member.name)
+            self.transcripts[member.id] = transcript
+
+        # Only gapless coverage counts, so a clip never takes a transcript
+        # with a hole in it
+        next_start = window_end - self.overlap
+        contiguous = (transcript.covered_from is not None
+                      and window_start <= transcript.covered_until)
+
+        try:
+            audio = await self.executor.run_cpu("live_encode",
+                                                encode_window,
+                                                pcm,
+                                                WINDOW_FORMAT,
+                                                self.channels,
+                                                self.sampling_width,
+                                                self.sampling_rate)
+            if audio is None:
+                segments = []  # no speech in the window
+            else:
+                audio_bytes = io.BytesIO(audio)
+                audio_bytes.name = f"{member.id}-live.{WINDOW_FORMAT.extension}"
+                segments = await self.executor.timed("live_transcribe", self.transcribe(audio_bytes))
+        except Exception:
+            _log.exception(f"Failed to transcribe live window (member_id={member.id})")
+            transcript.covered_from = None
+            transcript.pending_from = None
+            return
+
+        if not contiguous:
+            transcript.covered_from = window_start
+            transcript.committed_until = window_start
+
+        # Segments ending in the last half of the overlap may be cut off,
+        # so they're left for the next window, which has them whole
+        cutoff = window_end - self.overlap / 2
+        transcript.pending_from = None
+        for seg in segments:
+            seg_start = window_start + seg["start"]
+            seg_end = window_start + seg["end"]
+            if (seg_start + seg_end) / 2 <= transcript.committed_until:
+                continue  # already committed from the previous window
+            if seg_end > cutoff and seg_start >= next_start:
+                # The rest are in the next window, whole (which starts a
+                # margin before them, in case their start is off a bit)
+                transcript.pending_from = seg_start
+                break
+            if seg_end > window_end - CUT_OFF_MARGIN and seg_start > window_start + 2 * CUT_OFF_MARGIN:
+                # Cut off, but starts before the next window would, so the
+                # next window reaches back to it (unless this window already
+                # did, i.e. it's too long to ever be heard whole)
+                transcript.pending_from = seg_start
+                break
+
+            transcript.segments.append({"start": seg_start,
+                                        "end": seg_end,
+                                        "text": seg["text"].strip()})
+            transcript.committed_until = seg_end
+
+        transcript.covered_until = max(next_start if transcript.pending_from is None
+                                       else transcript.pending_from,
+                                       transcript.committed_until)
+        if len(transcript.segments) == MAX_SEGMENTS:
+            # The oldest segments may have been pushed out
+            transcript.covered_from = max(transcript.covered_from, transcript.segments[0]["start"])
+
+    def _prune(self, now: float) -> None:
+        """Drop what's older than the buffer's history"""
+        oldest = now - self.history_size
+        for member_id in list(self.transcripts.keys()):
+            transcript = self.transcripts[member_id]
+            while len(transcript.segments) > 0 and transcript.segments[0]["end"] < oldest:
+                transcript.segments.popleft()
+
+            if transcript.covered_from is not None:
+                transcript.covered_from = max(transcript.covered_from, oldest)
+            elif len(transcript.segments) == 0 and member_id not in self.audio_buffer:
+                del self.transcripts[member_id]
@@ -0,0 +1,117 @@
+"""
+Caches for `/searchfor`, so a repeated (or re-run) search doesn't have to
+embed the query again, or search the guild's clips again.
+"""
+# Clipped modules
+from modules.ttl_cache import TTLCache
+
+# Other modules
+import numpy as np
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Tuple
+
+
+def normalize_query(query: str) -> str:
+    """Case and whitespace don't change what a query is asking for"""
+    return " ".join(query.lower().split())
+
+
+class EmbeddingCache:
+    """
+    LRU cache of query embeddings, keyed by (embedding model, normalized
+    query). If given a `path`, entries are also persisted to a SQLite
+    database there, so they survive restarts.
+    """
+
+    def __init__(self, maxsize: int, path: str | None = None):
+        self.path = path
+        """SQLite database file that embeddings are persisted to (None to keep them in memory only)"""
+
+        # Embeddings for a given model never change, so they never expire
+        self._memory = TTLCache(maxsize=maxsize, ttl=float("inf"))
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS query_embeddings ("
+                             "model TEXT NOT NULL, "
+                             "query TEXT NOT NULL, "
+                             "embedding BLOB NOT NULL, "
+                             "PRIMARY KEY (model, query))")
+            self._db.commit()
+
+    def get(self, model: str, query: str) -> List[float] | None:
+        """Get the cached embedding of the query, or None if it isn't cached"""
+        key = (model, normalize_query(query))
+        embedding = self._memory.get(key)
+        if embedding is not None or self._db is None:
+            return embedding
+
+        with self._db_lock:
+            row = self._db.execute("SELECT embedding FROM query_embeddings "
+                                   "WHERE model = ? AND query = ?", key).fetchone()
+        if row is None:
+            return None
+
+        embedding = np.frombuffer(row[0], dtype=np.float32).tolist()
+        self._memory.set(key, embedding)
+        return embedding
+
+    def set(self, model: str, query: str, embedding: List[float]) -> None:
+        key = (model, normalize_query(query))
+        self._memory.set(key, embedding)
+        if self._db is None:
+            return
+
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)",
+                             (*key, np.asarray(embedding, dtype=np.float32).tobytes()))
+            self._db.commit()
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+
+class SearchResultsCache:
+    """
+    Cache of recent search results, keyed by (guild_id, normalized query,
+    top k). A guild's results are invalidated whenever a clip is stored
+    in it, since the new clip may belong in them.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        # Invalidating a guild bumps its generation, which is part of every
+        # key, so its stale results are never read again (and eventually
+        # fall out of the LRU)
+        self._results = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def key(self, guild_id: int, query: str, top_k: int) -> Tuple[Any, ...]:
+        """
+        Key of a search's results. Take the key before running the search,
+        so its results aren't cached as current if a clip was stored while
+        it was running.
+        """
+        with self._lock:
+            generation = self._generations.get(guild_id, 0)
+        return (guild_id, generation, normalize_query(query), top_k)
+
+    def get(self, key: Tuple[Any, ...]) -> List[Dict] | None:
+        """Get the cached result documents of the search, or None if it isn't cached"""
+        return self._results.get(key)
+
+    def set(self, key: Tuple[Any, ...], results: List[Dict]) -> None:
+        self._results.set(key, results)
+
+    def invalidate(self, guild_id: int) -> None:
+        """Forget every cached search in the guild"""
+        with self._lock:
+            self._generations[guild_id] = self._generations.get(guild_id, 0) + 1
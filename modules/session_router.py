@@ -0,0 +1,149 @@
+"""
+Routing of clip requests to whichever node holds a guild's session,
+when the bot's running sharded (see `modules.sharding`).
+
+Each session's document in `CLIPPED_SESSIONS_COLLECTION` records the
+node (worker process) holding its voice buffer, and where that node's
+router listens. A node asked to clip a guild it doesn't hold a session
+for (e.g. its shard moved to another node while the session was still
+running there) looks the session up and forwards the request. The node
+holding the buffer clips it, and replies through the interaction's
+followup webhook, so the reply still shows up as the command's response.
+
+The router only listens on the host other nodes reach it at, and every
+forwarded request is signed with `ROUTER_SECRET` (an HMAC of when it was
+sent and its body), so only other nodes can get a node to clip a guild
+or reply to an interaction. Requests that are unsigned, badly signed, or
+too old to not be a replay are refused before they're handled.
+"""
+# Clipped modules
+from bw_secrets import CLIPPED_SESSIONS_COLLECTION
+import modules.async_database as adb
+
+# Pycord modules
+import discord
+
+# Other modules
+import aiohttp
+from aiohttp import web
+import hashlib
+import hmac
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Dict
+
+_log = logging.getLogger(__name__)
+
+FORWARD_TIMEOUT = 10  # seconds to wait for another node to accept a forwarded request
+MAX_REQUEST_AGE = 30  # seconds a signed request is accepted for (allowing for clock skew between nodes)
+SIGNATURE_HEADER = "X-Clipped-Signature"
+TIMESTAMP_HEADER = "X-Clipped-Timestamp"
+
+
+class SessionRouter:
+    """This node's end of clip request routing: forwards requests, and serves forwarded ones"""
+
+    def __init__(self, node_id: str, host: str, port: int, secret: str | None):
+        if not secret:
+            raise Exception("A router secret (CLIPPED_ROUTER_SECRET) must be set to run sharded")
+
+        self.node_id = node_id
+        """Unique name of this node"""
+        self.url = f"http://{host}:{port}"
+        """URL other nodes reach this node's router at"""
+        self.host = host
+        """Host the router listens on (the one other nodes reach it at, never every interface)"""
+        self.port = port
+        """Port the router listens on"""
+
+        self._secret = secret.encode()
+
+        self._runner: web.AppRunner | None = None
+        self._session: aiohttp.ClientSession | None = None
+
+    def node(self) -> Dict[str, str]:
+        """This node, as recorded in the documents of the sessions it holds"""
+        return {"id": self.node_id, "url": self.url}
+
+    async def start(self, clip_that_handler: Callable[[Dict], Awaitable[bool]]) -> None:
+        """
+        Start serving requests forwarded by other nodes. `clip_that_handler`
+        handles a forwarded clip request, returning False if this node
+        doesn't hold the guild's session (anymore).
+        """
+        if self._runner is not None:
+            return
+
+        async def handle_clip_that(request: web.Request) -> web.Response:
+            body = await request.read()
+            if not self._verify(body,
+                                request.headers.get(TIMESTAMP_HEADER, ""),
+                                request.headers.get(SIGNATURE_HEADER, "")):
+                _log.warning(f"Refused an unsigned or badly signed request from {request.remote}")
+                return web.Response(status=403)
+
+            try:
+                accepted = await clip_that_handler(json.loads(body))
+            except (ValueError, KeyError, TypeError):
+                return web.Response(status=400)
+            return web.Response(status=202 if accepted else 404)
+
+        app = web.Application()
+        app.router.add_post("/clipthat", handle_clip_that)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=self.host, port=self.port).start()
+        self._session = aiohttp.ClientSession()
+        _log.info(f"Node {self.node_id} routing clip requests at {self.url}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def find_node(self, guild_id: int) -> Dict[str, str] | None:
+        """The node holding the guild's session, if any node does"""
+        docs = await adb.read_document(collection_name=CLIPPED_SESSIONS_COLLECTION,
+                                       filter={"_id": guild_id},
+                                       projection={"node": 1})
+        if len(docs) == 0:
+            return None
+        return docs[0].get("node")
+
+    async def forward_clip_that(self, node: Dict[str, str], request: Dict) -> bool:
+        """Forward a clip request to another node, returning whether it took it on"""
+        body = json.dumps(request).encode()
+        timestamp = str(int(time.time()))
+        headers = {"Content-Type": "application/json",
+                   TIMESTAMP_HEADER: timestamp,
+                   SIGNATURE_HEADER: self._sign(body, timestamp)}
+        try:
+            async with self._session.post(f"{node['url']}/clipthat",
+                                          data=body,
+                                          headers=headers,
+                                          timeout=aiohttp.ClientTimeout(total=FORWARD_TIMEOUT)) as response:
+                return response.status == 202
+        except (aiohttp.ClientError, TimeoutError) as e:
+            _log.warning(f"Couldn't forward clip request to node {node['id']}: {e}")
+            return False
+
+    def _sign(self, body: bytes, timestamp: str) -> str:
+        return hmac.new(self._secret, timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+
+    def _verify(self, body: bytes, timestamp: str, signature: str) -> bool:
+        """Whether a request was signed with our secret, recently enough not to be a replay"""
+        try:
+            age = abs(time.time() - int(timestamp))
+        except ValueError:
+            return False
+        if age > MAX_REQUEST_AGE:
+            return False
+        return hmac.compare_digest(self._sign(body, timestamp), signature)
+
+    def followup(self, application_id: int, token: str) -> discord.Webhook:
+        """Webhook for replying to an interaction received by another node"""
+        return discord.Webhook.partial(application_id, token, session=self._session)
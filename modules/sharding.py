@@ -0,0 +1,145 @@
+"""
+Sharded deployment, for when one process (one event loop, one core)
+can't keep up with every guild's voice.
+
+The bot's shards are split among worker processes, each running its own
+`AutoShardedBot` on the shards it was given. Discord sends each guild's
+events (voice state updates, interactions) to exactly one shard, so the
+capture and clip processing of every guild is pinned to the worker
+holding its shard, and workers share nothing but the database.
+
+Configured with environment variables:
+- `CLIPPED_SHARD_COUNT`: shards across every node (if unset, the bot
+  runs unsharded, in a single process)
+- `CLIPPED_SHARD_IDS`: shards run on this node, e.g. "0,1,2,3" (default:
+  all of them)
+- `CLIPPED_WORKERS`: worker processes on this node (default: one per core)
+- `CLIPPED_NODE_NAME`: this node's name in session documents (default:
+  its hostname)
+- `CLIPPED_ROUTER_HOST` / `CLIPPED_ROUTER_PORT`: address (on a private
+  network) other nodes can reach this node's workers at, and that they
+  listen on (see `SessionRouter`), each worker on the port plus its index
+- `CLIPPED_ROUTER_SECRET`: key nodes sign forwarded requests with (the
+  same on every node)
+"""
+# Other modules
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import socket
+from typing import Callable, List
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_ROUTER_PORT = 8470  # port the first worker's router listens on
+RESTART_LIMIT = 5  # times a crashed worker is restarted before it's given up on
+
+
+class WorkerConfig:
+    """What a single worker process runs"""
+
+    def __init__(self,
+                 index: int,
+                 shard_ids: List[int],
+                 shard_count: int,
+                 node_id: str,
+                 router_host: str,
+                 router_port: int):
+        self.index = index
+        """Index of the worker on its node"""
+        self.shard_ids = shard_ids
+        """Shards the worker's bot runs"""
+        self.shard_count = shard_count
+        """Shards across every node"""
+        self.node_id = node_id
+        """Unique name of the worker, recorded in the documents of the sessions it holds"""
+        self.router_host = router_host
+        """Host other nodes reach the worker's router at, and the only one it listens on"""
+        self.router_port = router_port
+        """Port the worker's router listens on"""
+
+
+def shard_id(guild_id: int, shard_count: int) -> int:
+    """Shard that Discord sends the guild's events to"""
+    return (guild_id >> 22) % shard_count
+
+
+def assign_shards(shard_ids: List[int], num_workers: int) -> List[List[int]]:
+    """Split shards evenly among (at most) `num_workers` workers"""
+    assigned = [shard_ids[i::num_workers] for i in range(num_workers)]
+    return [worker_shard_ids for worker_shard_ids in assigned if len(worker_shard_ids) > 0]
+
+
+def worker_configs_from_env() -> List[WorkerConfig] | None:
+    """This node's workers, or None if the bot isn't sharded"""
+    shard_count = os.getenv("CLIPPED_SHARD_COUNT")
+    if shard_count is None:
+        return None
+
+    shard_count = int(shard_count)
+    shard_ids = os.getenv("CLIPPED_SHARD_IDS")
+    shard_ids = (list(range(shard_count)) if shard_ids is None
+                 else [int(shard) for shard in shard_ids.split(",")])
+    if any(shard < 0 or shard >= shard_count for shard in shard_ids):
+        raise Exception(f"Shard IDs must be less than the shard count "
+                        f"(shard_ids={shard_ids}, shard_count={shard_count})")
+
+    num_workers = int(os.getenv("CLIPPED_WORKERS", os.cpu_count() or 1))
+    node_name = os.getenv("CLIPPED_NODE_NAME", socket.gethostname())
+    router_host = os.getenv("CLIPPED_ROUTER_HOST", socket.gethostname())
+    router_port = int(os.getenv("CLIPPED_ROUTER_PORT", DEFAULT_ROUTER_PORT))
+
+    return [WorkerConfig(index=index,
+                         shard_ids=worker_shard_ids,
+                         shard_count=shard_count,
+                         node_id=f"{node_name}-{index}",
+                         router_host=router_host,
+                         router_port=router_port + index)
+            for index, worker_shard_ids in enumerate(assign_shards(shard_ids, num_workers))]
+
+
+def run_workers(target: Callable[[WorkerConfig], None], configs: List[WorkerConfig]) -> None:
+    """
+    Run `target` in a process per worker, until they've all exited. A
+    worker that crashes is restarted (up to `RESTART_LIMIT` times), so its
+    guilds aren't left without a bot.
+    """
+    context = multiprocessing.get_context("spawn")
+    restarts = {config.index: 0 for config in configs}
+    processes = {}
+
+    def start(config: WorkerConfig) -> None:
+        process = context.Process(target=target,
+                                  args=(config,),
+                                  name=f"clipped-worker-{config.index}")
+        process.start()
+        processes[process.sentinel] = (process, config)
+        _log.info(f"Started worker {config.node_id} (pid {process.pid}) "
+                  f"on shards {config.shard_ids} of {config.shard_count}")
+
+    for config in configs:
+        start(config)
+
+    try:
+        while len(processes) > 0:
+            for sentinel in wait(list(processes.keys())):
+                process, config = processes.pop(sentinel)
+                process.join()
+                if process.exitcode == 0:
+                    continue
+
+                if restarts[config.index] >= RESTART_LIMIT:
+                    _log.error(f"Worker {config.node_id} keeps crashing, giving up on "
+                               f"shards {config.shard_ids}")
+                    continue
+
+                restarts[config.index] += 1
+                _log.warning(f"Worker {config.node_id} exited with code "
+                             f"{process.exitcode}, restarting it")
+                start(config)
+    finally:
+        for process, _ in processes.values():
+            process.terminate()
+        for process, _ in processes.values():
+            process.join()
@@ -0,0 +1,62 @@
+# Other modules
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache with least-recently-used eviction once
+    it's full, where each entry also expires a fixed time after it was
+    last written.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        """Maximum number of entries held before the least recently used is evicted"""
+        self.ttl = ttl
+        """Seconds an entry stays valid after it was last written"""
+
+        self._entries: OrderedDict[Hashable, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get the value cached for `key`, or `default` if it's missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key, TTLCache._MISSING)
+            if entry is TTLCache._MISSING:
+                return default
+
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Cache `value` for `key`, evicting the least recently used entry if full"""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Remove `key` from the cache, if it's there"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove every entry from the cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
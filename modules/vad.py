@@ -0,0 +1,62 @@
+"""Energy-based voice activity detection on raw 16-bit PCM audio"""
+# Other modules
+import numpy as np
+from typing import List, Tuple
+
+FRAME_DURATION = 0.02  # length of each analysis frame (in seconds)
+ENERGY_THRESHOLD_DBFS = -45  # frames louder than this count as speech
+PADDING = 0.25  # audio kept on either side of speech (in seconds)
+MAX_GAP = 1.0  # speech separated by less silence than this is one span (in seconds)
+MIN_SPEECH = 0.2  # spans with less speech than this are dropped (in seconds)
+
+
+def detect_voiced_spans(pcm: bytes,
+                        channels: int,
+                        sampling_rate: int) -> List[Tuple[int, int]]:
+    """
+    Find the spans of speech in a PCM track. Returns a list of
+    (start, end) frame offsets, with leading/trailing silence trimmed
+    and short pauses merged into the surrounding span. An empty list
+    means there's no speech in the track at all.
+    """
+    frame_len = int(FRAME_DURATION * sampling_rate)
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    num_frames = len(samples) // (frame_len * channels)
+    if num_frames == 0:
+        return []
+
+    # Mean power of each analysis frame, across all channels
+    frames = (samples[:num_frames * frame_len * channels]
+              .reshape(num_frames, frame_len * channels)
+              .astype(np.float32))
+    power = np.mean(frames * frames, axis=1)
+    threshold = (32768 * 10 ** (ENERGY_THRESHOLD_DBFS / 20)) ** 2
+    voiced = power > threshold
+
+    # Extend speech by the padding on either side, so word onsets and
+    # tails aren't clipped off
+    padding = int(PADDING / FRAME_DURATION)
+    kernel = np.ones(2 * padding + 1, dtype=np.int32)
+    padded = np.convolve(voiced.astype(np.int32), kernel, mode="same") > 0
+
+    # Find where each run of speech starts and ends
+    edges = np.diff(padded.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    # Merge runs separated by short pauses, then drop spans without
+    # enough actual speech in them (e.g. a single click)
+    max_gap = int(MAX_GAP / FRAME_DURATION)
+    min_speech = int(MIN_SPEECH / FRAME_DURATION)
+    voiced_count = np.concatenate(([0], np.cumsum(voiced)))
+
+    spans: List[Tuple[int, int]] = []
+    for start, end in zip(starts, ends):
+        if spans and start - spans[-1][1] < max_gap:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+
+    return [(int(start) * frame_len, int(end) * frame_len)
+            for start, end in spans
+            if voiced_count[end] - voiced_count[start] >= min_speech]
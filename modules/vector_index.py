@@ -0,0 +1,258 @@
+"""
+In-process vector index over each guild's clip summary embeddings, so
+`/searchfor` doesn't need a full collection scan in Atlas (or Atlas at all).
+
+Small guilds are searched exactly, with a single NumPy matrix product.
+Once a guild has `HNSW_THRESHOLD` clips, an HNSW graph is built on top
+(if `hnswlib` is installed) for approximate search.
+
+Each guild's index is persisted as an append-only pair of files (raw
+float32 embeddings after an int64 dimension header, and int64 clip
+timestamps), so adding a clip only writes that clip's row to disk.
+"""
+# Other modules
+from datetime import datetime, timedelta
+import logging
+import numpy as np
+import os
+import threading
+from typing import Dict, List, Tuple
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+_log = logging.getLogger(__name__)
+
+INDEX_DIR = os.getenv("CLIPPED_INDEX_DIR", "vector_indexes")
+HNSW_THRESHOLD = 20_000  # clips in a guild before switching to approximate search
+HNSW_M = 16  # graph degree; higher is more accurate, but uses more memory
+HNSW_EF_CONSTRUCTION = 200  # build-time beam width
+HNSW_EF_SEARCH = 128  # query-time beam width
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class GuildVectorIndex:
+    """Cosine-similarity index over one guild's clip summary embeddings"""
+
+    def __init__(self, guild_id: int, index_dir: str = INDEX_DIR):
+        self.guild_id = guild_id
+        """Guild whose clips are indexed"""
+        self.loaded = False
+        """Whether the index has been loaded from disk (or rebuilt) yet"""
+
+        self._embeddings_path = os.path.join(index_dir, f"{guild_id}.f32")
+        self._timestamps_path = os.path.join(index_dir, f"{guild_id}.ts")
+        self._hnsw_path = os.path.join(index_dir, f"{guild_id}.hnsw")
+
+        self._embeddings: np.ndarray | None = None  # unit-length rows, over-allocated
+        self._timestamps = np.empty(0, dtype=np.int64)  # ms since epoch, per row
+        self._count = 0
+        self._hnsw = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def exists_on_disk(self) -> bool:
+        return os.path.exists(self._timestamps_path)
+
+    def load(self) -> None:
+        """Load the guild's index from disk"""
+        with self._lock:
+            timestamps = np.fromfile(self._timestamps_path, dtype=np.int64)
+            with open(self._embeddings_path, "rb") as f:
+                dim = int(np.fromfile(f, dtype=np.int64, count=1)[0])
+                embeddings = np.fromfile(f, dtype=np.float32)
+
+            # Ignore a partially written trailing row, e.g. after a crash
+            count = min(len(timestamps), len(embeddings) // dim if dim > 0 else 0)
+            self._set_rows(timestamps[:count],
+                           embeddings[:count * dim].reshape(count, dim))
+
+            if count >= HNSW_THRESHOLD:
+                self._load_or_build_hnsw()
+
+            self.loaded = True
+
+    def rebuild(self, clips: List[Tuple[datetime, List[float]]]) -> None:
+        """Replace the guild's index (in memory and on disk) with the given clips"""
+        with self._lock:
+            timestamps = np.array([GuildVectorIndex._to_ms(timestamp)
+                                   for timestamp, _ in clips], dtype=np.int64)
+            embeddings = np.array([embedding for _, embedding in clips], dtype=np.float32)
+            if len(clips) == 0:
+                embeddings = embeddings.reshape(0, 0)
+            embeddings = GuildVectorIndex._normalize(embeddings)
+            self._set_rows(timestamps, embeddings)
+
+            # Written to temporary files first and swapped in, so a process
+            # appending to the old files (e.g. the bot, while `reindex.py`
+            # rebuilds them) can only ever leave a row missing, not misaligned
+            os.makedirs(os.path.dirname(self._timestamps_path) or ".", exist_ok=True)
+            with open(f"{self._embeddings_path}.tmp", "wb") as f:
+                np.array([embeddings.shape[1]], dtype=np.int64).tofile(f)
+                embeddings.tofile(f)
+            timestamps.tofile(f"{self._timestamps_path}.tmp")
+            os.replace(f"{self._embeddings_path}.tmp", self._embeddings_path)
+            os.replace(f"{self._timestamps_path}.tmp", self._timestamps_path)
+
+            self._hnsw = None
+            if os.path.exists(self._hnsw_path):
+                os.remove(self._hnsw_path)
+            if self._count >= HNSW_THRESHOLD:
+                self._load_or_build_hnsw()
+
+            self.loaded = True
+
+    def add(self, timestamp: datetime, embedding: List[float]) -> None:
+        """
+        Add a single clip to the index, and append it to the files on disk.
+        Does nothing if the clip is already in the index.
+        """
+        with self._lock:
+            timestamp_ms = GuildVectorIndex._to_ms(timestamp)
+            if np.any(self._timestamps[:self._count] == timestamp_ms):
+                return  # already indexed, e.g. by a retried ingestion stage
+
+            vector = GuildVectorIndex._normalize(np.asarray(embedding, dtype=np.float32))
+
+            if self._embeddings is None or self._count == len(self._embeddings):
+                self._grow(dim=len(vector))
+
+            row = self._count
+            self._embeddings[row] = vector
+            self._timestamps[row] = timestamp_ms
+            self._count += 1
+
+            os.makedirs(os.path.dirname(self._timestamps_path) or ".", exist_ok=True)
+            with open(self._embeddings_path, "ab") as f:
+                if f.tell() <= 8:
+                    # new (or empty) file, so (re)write the dimension header
+                    f.truncate(0)
+                    np.array([len(vector)], dtype=np.int64).tofile(f)
+                vector.tofile(f)
+            with open(self._timestamps_path, "ab") as f:
+                self._timestamps[row:row + 1].tofile(f)
+
+            if self._hnsw is not None:
+                if self._hnsw.get_current_count() == self._hnsw.get_max_elements():
+                    self._hnsw.resize_index(2 * self._hnsw.get_max_elements())
+                self._hnsw.add_items(vector[np.newaxis], [row])
+            elif self._count >= HNSW_THRESHOLD:
+                self._load_or_build_hnsw()
+
+    def search(self, embedding: List[float], top_k: int) -> List[Tuple[datetime, float]]:
+        """
+        Find the `top_k` clips most similar to the given embedding. Returns
+        (clip timestamp, score) pairs, best first, where the score is the
+        cosine similarity rescaled to [0, 1] the same way Atlas Vector
+        Search scores it.
+        """
+        with self._lock:
+            if self._count == 0:
+                return []
+
+            query = GuildVectorIndex._normalize(np.asarray(embedding, dtype=np.float32))
+            top_k = min(top_k, self._count)
+
+            if self._hnsw is not None:
+                labels, distances = self._hnsw.knn_query(query, k=top_k)
+                rows = labels[0].astype(np.int64)
+                similarities = 1 - distances[0]
+            else:
+                all_similarities = self._embeddings[:self._count] @ query
+                rows = np.argpartition(-all_similarities, top_k - 1)[:top_k]
+                rows = rows[np.argsort(-all_similarities[rows])]
+                similarities = all_similarities[rows]
+
+            return [(GuildVectorIndex._from_ms(self._timestamps[row]),
+                     float((1 + similarity) / 2))
+                    for row, similarity in zip(rows, similarities)]
+
+    def save(self) -> None:
+        """
+        Save the HNSW graph, if there is one, so it doesn't need to be
+        rebuilt the next time the index is loaded. Embeddings are already
+        persisted as they're added.
+        """
+        with self._lock:
+            if self._hnsw is not None:
+                self._hnsw.save_index(self._hnsw_path)
+
+    def _set_rows(self, timestamps: np.ndarray, embeddings: np.ndarray) -> None:
+        self._count = len(timestamps)
+        self._embeddings = embeddings.copy() if self._count > 0 else None
+        self._timestamps = timestamps.copy()
+        self._hnsw = None
+
+    def _grow(self, dim: int) -> None:
+        """Double the capacity of the in-memory matrix (amortized O(1) adds)"""
+        capacity = max(1024, 2 * self._count)
+        embeddings = np.empty((capacity, dim), dtype=np.float32)
+        timestamps = np.empty(capacity, dtype=np.int64)
+        if self._count > 0:
+            embeddings[:self._count] = self._embeddings[:self._count]
+            timestamps[:self._count] = self._timestamps[:self._count]
+        self._embeddings = embeddings
+        self._timestamps = timestamps
+
+    def _load_or_build_hnsw(self) -> None:
+        if hnswlib is None:
+            return  # approximate search isn't available, stay exact
+
+        dim = self._embeddings.shape[1]
+        index = hnswlib.Index(space="cosine", dim=dim)
+
+        if os.path.exists(self._hnsw_path):
+            index.load_index(self._hnsw_path, max_elements=2 * self._count)
+            if index.get_current_count() != self._count:
+                # saved graph is stale, so rebuild it below
+                index = hnswlib.Index(space="cosine", dim=dim)
+            else:
+                index.set_ef(HNSW_EF_SEARCH)
+                self._hnsw = index
+                return
+
+        _log.info(f"Building HNSW index (guild_id={self.guild_id}, clips={self._count})")
+        index.init_index(max_elements=2 * self._count,
+                         M=HNSW_M,
+                         ef_construction=HNSW_EF_CONSTRUCTION)
+        index.add_items(self._embeddings[:self._count], np.arange(self._count))
+        index.set_ef(HNSW_EF_SEARCH)
+        self._hnsw = index
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    @staticmethod
+    def _to_ms(timestamp: datetime) -> int:
+        # naive datetimes are treated as UTC, the same way pymongo does
+        return (timestamp.replace(tzinfo=None) - EPOCH) // timedelta(milliseconds=1)
+
+    @staticmethod
+    def _from_ms(ms: int) -> datetime:
+        return EPOCH + timedelta(milliseconds=int(ms))
+
+
+_indexes: Dict[int, GuildVectorIndex] = {}
+
+
+def get_index(guild_id: int) -> GuildVectorIndex:
+    """Get the guild's index, creating an empty (not yet loaded) one if needed"""
+    index = _indexes.get(guild_id)
+    if index is None:
+        index = GuildVectorIndex(guild_id)
+        _indexes[guild_id] = index
+
+    return index
+
+
+def save_all() -> None:
+    """Save every guild's index (i.e. on shutdown)"""
+    for index in _indexes.values():
+        index.save()
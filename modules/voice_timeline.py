@@ -0,0 +1,158 @@
+"""
+Placement of members' decoded voice frames on a timeline shared by the
+whole session, so every member's track lines up to the sample, however
+unevenly their packets arrived.
+
+Each frame's position comes from its RTP timestamp: every SSRC's RTP
+clock is anchored to when its first packet arrived, and each later frame
+is placed exactly that many samples after it. Gaps between frames (the
+member paused, or a packet was lost) are left as silence. Frames are
+staged per member until the stream loop takes their chunk, so a frame
+arriving late (but not too late) still lands where it belongs.
+"""
+# Pycord modules
+import discord.opus as op
+
+# Other modules
+import time
+from typing import Dict, List
+
+RESYNC_THRESHOLD = 0.5  # seconds an SSRC's RTP clock can drift from arrival times before it's re-anchored
+MAX_AHEAD = 5  # seconds ahead of the next chunk a frame can be staged, before it's dropped
+RTP_TIMESTAMP_MOD = 2 ** 32  # RTP timestamps are 32-bit and wrap around
+
+
+class RtpClock:
+    """Maps one SSRC's RTP timestamps onto the session's timeline"""
+
+    def __init__(self):
+        self._rtp_base: int | None = None
+        self._position_base = 0
+
+    def position(self, rtp_timestamp: int, arrival: int) -> int:
+        """
+        Timeline position (in frames) of the audio with the given RTP
+        timestamp. `arrival` is where it would be placed going by when it
+        arrived, which anchors the clock on its first frame, and re-anchors
+        it if the RTP clock jumps (e.g. the sender restarted).
+        """
+        if self._rtp_base is not None:
+            delta = (rtp_timestamp - self._rtp_base) % RTP_TIMESTAMP_MOD
+            if delta >= RTP_TIMESTAMP_MOD // 2:
+                delta -= RTP_TIMESTAMP_MOD  # from before the anchor (i.e. reordered)
+
+            position = self._position_base + delta
+            if abs(position - arrival) <= RESYNC_THRESHOLD * op.Decoder.SAMPLING_RATE:
+                return position
+
+        self._rtp_base = rtp_timestamp
+        self._position_base = arrival
+        return arrival
+
+
+class VoiceTimeline:
+    """
+    Members' frames staged on the shared timeline, waiting to be taken
+    one chunk at a time. Not thread-safe; see `ClipSink`.
+    """
+
+    def __init__(self, chunk_bytes: int, start_time: float | None = None):
+        self.frame_size = op.Decoder.SAMPLE_SIZE
+        """Size of a single PCM frame (all channels), in bytes"""
+        self.chunk_bytes = chunk_bytes
+        """Size of each chunk taken off the timeline, in bytes"""
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        """`time.perf_counter()` time that the timeline starts at"""
+        self.position = 0
+        """Timeline position (in frames) that the next chunk starts at"""
+        self.late_frames = 0
+        """Frames that arrived after their chunk was taken, and were dropped"""
+        self.dropped_frames = 0
+        """Frames too far ahead of the next chunk to be staged, and were dropped"""
+
+        self._staged: Dict[int, bytearray] = {}
+        self._clocks: Dict[int, RtpClock] = {}
+
+    def arrival_position(self, receive_time: float) -> int:
+        """Timeline position (in frames) of the given `time.perf_counter()` time"""
+        return int((receive_time - self.start_time) * op.Decoder.SAMPLING_RATE)
+
+    def place(self,
+              member_id: int,
+              pcm: bytes,
+              receive_time: float,
+              ssrc: int | None = None,
+              rtp_timestamp: int | None = None) -> None:
+        """
+        Stage a member's decoded frame at its place on the timeline. It's
+        placed by its RTP timestamp if it has one, or else by when it was
+        received.
+        """
+        num_frames = len(pcm) // self.frame_size
+
+        # A frame has just finished being spoken when it arrives
+        position = self.arrival_position(receive_time) - num_frames
+        if ssrc is not None and rtp_timestamp is not None:
+            clock = self._clocks.get(ssrc)
+            if clock is None:
+                clock = RtpClock()
+                self._clocks[ssrc] = clock
+            position = clock.position(rtp_timestamp, position)
+
+        pcm = memoryview(pcm)[:num_frames * self.frame_size]
+        offset = (position - self.position) * self.frame_size
+        if offset < 0:
+            # Part (or all) of it belonged in a chunk that's already been taken
+            self.late_frames += min(num_frames, -offset // self.frame_size)
+            pcm = pcm[-offset:]
+            offset = 0
+        if len(pcm) == 0:
+            return
+
+        end = offset + len(pcm)
+        if end > self.chunk_bytes + MAX_AHEAD * op.Decoder.SAMPLING_RATE * self.frame_size:
+            self.dropped_frames += len(pcm) // self.frame_size
+            return
+
+        staged = self._staged.get(member_id)
+        if staged is None:
+            staged = bytearray()
+            self._staged[member_id] = staged
+        if len(staged) < end:
+            staged.extend(bytes(end - len(staged)))  # silence up to the frame
+        staged[offset:end] = pcm
+
+    def chunk_ready(self, latency: float, now: float | None = None) -> bool:
+        """
+        Whether the next chunk's audio should all have arrived by now,
+        allowing `latency` seconds for packets that are running late
+        """
+        now = time.perf_counter() if now is None else now
+        chunk_end = self.position + self.chunk_bytes // self.frame_size
+        return chunk_end + int(latency * op.Decoder.SAMPLING_RATE) <= self.arrival_position(now)
+
+    def member_ids(self) -> List[int]:
+        """IDs of members with audio staged"""
+        return list(self._staged.keys())
+
+    def staged_bytes(self) -> int:
+        """Total size of every member's staged audio"""
+        return sum(len(staged) for staged in self._staged.values())
+
+    def take_chunk(self, member_id: int, out: memoryview) -> int:
+        """
+        Move the member's audio for the next chunk into `out`, returning
+        how many bytes of it there were (the rest of the chunk is silence)
+        """
+        staged = self._staged[member_id]
+        num_bytes = min(len(staged), self.chunk_bytes)
+        out[:num_bytes] = staged[:num_bytes]
+        del staged[:num_bytes]
+        return num_bytes
+
+    def advance(self) -> None:
+        """Move on to the next chunk, once every member's has been taken"""
+        self.position += self.chunk_bytes // self.frame_size
+        for member_id in [member_id for member_id, staged in self._staged.items()
+                          if len(staged) == 0]:
+            del self._staged[member_id]
@@ -0,0 +1,234 @@
+"""
+Re-embed (and optionally re-summarize) every stored clip, i.e. after
+`EMBEDDING_MODEL` or `SUMMARY_SYSTEM_PROMPT` changes.
+
+Clips are streamed from the database in `_id` order, and their summaries
+are embedded hundreds at a time per request. Progress is checkpointed
+after every batch, so an interrupted run picks up where it left off.
+
+Once every clip is written back, the vector index of each guild whose
+clips were reindexed is rebuilt on disk from the new embeddings.
+
+Run it while the bot is stopped (or restart the bot after), since the
+bot only reads the models from its secrets (and loads vector indexes
+from disk) on startup:
+    python reindex.py [--resummarize] [--guild GUILD_ID] [--restart]
+"""
+# Clipped modules
+from bw_secrets import (CLIPS_METADATA_COLLECTION,
+                        EMBEDDING_MODEL,
+                        SUMMARY_MODEL,
+                        SUMMARY_SYSTEM_PROMPT)
+import modules.async_database as adb
+import modules.vector_index as vector_index
+
+# Other modules
+import argparse
+import asyncio
+from datetime import datetime
+import json
+import logging
+import openai
+import os
+import time
+from typing import Dict, List
+
+_log = logging.getLogger(__name__)
+
+BATCH_SIZE = 256  # summaries embedded per request
+REQUESTS_PER_MINUTE = 60  # max OpenAI requests started per minute
+SUMMARY_CONCURRENCY = 8  # max in-flight summary requests, when re-summarizing
+MAX_RETRIES = 6  # retries of a rate-limited (or failed) OpenAI request, with backoff
+CHECKPOINT_PATH = "reindex_checkpoint.json"
+
+
+class RateLimiter:
+    """Spaces requests out evenly, so at most `per_minute` are started each minute"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60 / per_minute
+        """Seconds between the start of each request"""
+
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        """Wait until the next request is allowed to start"""
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Reindexer:
+    def __init__(self,
+                 resummarize: bool,
+                 guild_id: int | None,
+                 batch_size: int,
+                 requests_per_minute: float,
+                 checkpoint_path: str):
+        self.resummarize = resummarize
+        """Whether summaries are regenerated from transcriptions before being embedded"""
+        self.guild_id = guild_id
+        """Only reindex this guild's clips (None for every guild)"""
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+
+        self.ai_client = openai.AsyncOpenAI(max_retries=MAX_RETRIES)
+        self.rate_limiter = RateLimiter(requests_per_minute)
+
+        self.last_id: Dict | None = None
+        """`_id` of the last clip written back"""
+        self.processed = 0
+        """Number of clips written back so far"""
+        self.guild_ids = set()
+        """Guilds whose clips were written back (so their vector indexes are stale)"""
+
+    async def run(self) -> None:
+        filter = {
+            "summary": {"$exists": True},
+            # clips still being ingested get the current models anyway
+            "$or": [{"stage": {"$exists": False}}, {"stage": "indexed"}]
+        }
+        if self.last_id is not None:
+            filter["_id"] = {"$gt": self.last_id}
+        if self.guild_id is not None:
+            filter["_id.guild_id"] = self.guild_id
+
+        start = time.perf_counter()
+        batch: List[Dict] = []
+        async for doc in adb.stream_documents(collection_name=CLIPS_METADATA_COLLECTION,
+                                              filter=filter,
+                                              projection={"_id": 1, "transcription": 1, "summary": 1},
+                                              sort=[("_id", 1)],
+                                              batch_size=self.batch_size):
+            batch.append(doc)
+            if len(batch) == self.batch_size:
+                await self._reindex_batch(batch)
+                batch = []
+                _log.info(f"Reindexed {self.processed} clips "
+                          f"({self.processed / (time.perf_counter() - start):.1f}/s)")
+
+        if len(batch) > 0:
+            await self._reindex_batch(batch)
+
+        # Vector indexes are rebuilt from the new embeddings right away, rather
+        # than deleted, so a running bot never recreates them with only the
+        # clips it adds (see `Clip._get_vector_index()`)
+        for guild_id in sorted(self.guild_ids):
+            await self._rebuild_index(guild_id)
+
+        _log.info(f"Done, reindexed {self.processed} clips in "
+                  f"{time.perf_counter() - start:.1f}s")
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def load_checkpoint(self) -> None:
+        if not os.path.exists(self.checkpoint_path):
+            return
+
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+
+        self.last_id = {"guild_id": checkpoint["last_id"]["guild_id"],
+                        "timestamp": datetime.fromisoformat(checkpoint["last_id"]["timestamp"])}
+        self.processed = checkpoint["processed"]
+        self.guild_ids = set(checkpoint["guild_ids"])
+        _log.info(f"Resuming from checkpoint, after {self.processed} clips (last_id={self.last_id})")
+
+    def _save_checkpoint(self) -> None:
+        checkpoint = {
+            "last_id": {"guild_id": self.last_id["guild_id"],
+                        "timestamp": self.last_id["timestamp"].isoformat()},
+            "processed": self.processed,
+            "guild_ids": sorted(self.guild_ids)
+        }
+
+        # Write to a temporary file first, so a crash never leaves a corrupt checkpoint
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(temp_path, self.checkpoint_path)
+
+    async def _reindex_batch(self, docs: List[Dict]) -> None:
+        if self.resummarize:
+            semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+            summaries = await asyncio.gather(*[self._summarize(doc.get("transcription", ""), semaphore)
+                                               for doc in docs])
+        else:
+            summaries = [doc["summary"] for doc in docs]
+
+        embeddings = await self._embed(summaries)
+
+        updates = []
+        for doc, summary, embedding in zip(docs, summaries, embeddings):
+            update = {"_id": doc["_id"], "summary_embedding": embedding}
+            if self.resummarize:
+                update["summary"] = summary
+            updates.append(update)
+
+        await adb.bulk_upsert(collection_name=CLIPS_METADATA_COLLECTION, objs=updates)
+
+        self.last_id = docs[-1]["_id"]
+        self.processed += len(docs)
+        self.guild_ids.update(doc["_id"]["guild_id"] for doc in docs)
+        self._save_checkpoint()
+
+    async def _rebuild_index(self, guild_id: int) -> None:
+        docs = await adb.read_document(collection_name=CLIPS_METADATA_COLLECTION,
+                                       filter={"_id.guild_id": guild_id,
+                                               "summary_embedding": {"$exists": True}},
+                                       projection={"_id": 1, "summary_embedding": 1})
+        clips = [(doc["_id"]["timestamp"], doc["summary_embedding"]) for doc in docs]
+        await asyncio.to_thread(vector_index.get_index(guild_id).rebuild, clips)
+        _log.info(f"Rebuilt vector index (guild_id={guild_id}, clips={len(clips)})")
+
+    async def _summarize(self, transcription: str, semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            await self.rate_limiter.wait()
+            summary_response = await self.ai_client.responses.create(model=SUMMARY_MODEL,
+                                                                     input=SUMMARY_SYSTEM_PROMPT + transcription)
+        return summary_response.output[0].content[0].text
+
+    async def _embed(self, summaries: List[str]) -> List[List[float]]:
+        """Embed every summary with one request"""
+        await self.rate_limiter.wait()
+        embedding_response = await self.ai_client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=[summary or " " for summary in summaries])  # empty input isn't allowed
+
+        return [data.embedding
+                for data in sorted(embedding_response.data, key=lambda data: data.index)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed (and optionally re-summarize) stored clips")
+    parser.add_argument("--resummarize", action="store_true",
+                        help="regenerate summaries from transcriptions before embedding them")
+    parser.add_argument("--guild", type=int, default=None,
+                        help="only reindex this guild's clips")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--requests-per-minute", type=float, default=REQUESTS_PER_MINUTE)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore the checkpoint, and reindex from the start")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    reindexer = Reindexer(resummarize=args.resummarize,
+                          guild_id=args.guild,
+                          batch_size=args.batch_size,
+                          requests_per_minute=args.requests_per_minute,
+                          checkpoint_path=args.checkpoint)
+    if not args.restart:
+        reindexer.load_checkpoint()
+
+    asyncio.run(reindexer.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Shared setup for the tests. Run from the repo root:
+    python -m pytest tests
+"""
+# Other modules
+import os
+import pytest
+import sys
+import types
+from typing import Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# `bw_secrets` logs in to Bitwarden when it's imported, so the modules
+# under test get placeholder secrets instead (nothing here talks to
+# Discord, GCP or OpenAI)
+_secrets = types.ModuleType("bw_secrets")
+_secrets.BOT_TOKEN = "test"
+_secrets.BOT_USER_ID = 0
+_secrets.DEV_GUILD_ID = 0
+_secrets.DISCORD_API_URL = "http://localhost"
+_secrets.GCS_BUCKET_NAME = "test"
+_secrets.CLIPPED_SESSIONS_COLLECTION = "clipped_sessions"
+_secrets.CLIPS_METADATA_COLLECTION = "clips_metadata"
+_secrets.MEMBERS_COLLECTION = "members"
+_secrets.MONGO_CONN_STRING = "mongodb://localhost:27017"
+_secrets.MONGO_DB_NAME = "clipped_test"
+_secrets.EMBEDDING_MODEL = "test"
+_secrets.SUMMARY_MODEL = "test"
+_secrets.SUMMARY_SYSTEM_PROMPT = "test"
+_secrets.TRANSCRIPTION_MODEL = "test"
+_secrets.ROUTER_SECRET = "test"
+sys.modules.setdefault("bw_secrets", _secrets)
+
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._cursor:
+            yield doc
+
+
+class AsyncCollection:
+    """Just enough of pymongo's `AsyncCollection` over a mongomock collection"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs) -> AsyncCursor:
+        return AsyncCursor(self._collection.find(*args, **kwargs))
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class AsyncDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, collection_name: str) -> AsyncCollection:
+        return AsyncCollection(self._database[collection_name])
+
+    async def list_collection_names(self):
+        return self._database.list_collection_names()
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """
+    An in-memory MongoDB (mongomock) in place of the database, with every
+    collection the bot uses. Tests using it are skipped without mongomock.
+    """
+    mongomock = pytest.importorskip("mongomock")
+    import modules.async_database as adb
+    from models.member import ClippedMember
+
+    # pymongo (4.11+) passes a `sort` to bulk updates, which mongomock doesn't
+    # take yet. Only matters for updates that match more than one document
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+    monkeypatch.setattr(mongomock.collection.BulkOperationBuilder, "add_update",
+                        lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs))
+
+    database = mongomock.MongoClient()["clipped_test"]
+    for collection_name in (_secrets.CLIPPED_SESSIONS_COLLECTION,
+                            _secrets.CLIPS_METADATA_COLLECTION,
+                            _secrets.MEMBERS_COLLECTION):
+        database.create_collection(collection_name)
+
+    monkeypatch.setattr(adb, "db", AsyncDatabase(database))
+    monkeypatch.setattr(adb, "known_collections", None)
+    ClippedMember.opt_in_cache.clear()
+
+    return database
@@ -0,0 +1,93 @@
+# Clipped modules
+from modules.audio_buffer import AudioRingBuffer
+
+# Other modules
+import logging
+import numpy as np
+
+HISTORY_SIZE = 10  # seconds
+CHUNK_SIZE = 1  # seconds
+
+
+def make_buffer(max_tracks: int) -> AudioRingBuffer:
+    capacity = HISTORY_SIZE * AudioRingBuffer.SAMPLING_RATE * AudioRingBuffer.CHANNELS * AudioRingBuffer.SAMPLE_WIDTH
+    return AudioRingBuffer(history_size=HISTORY_SIZE,
+                           chunk_size=CHUNK_SIZE,
+                           max_bytes=max_tracks * capacity)
+
+
+def decoded_chunk(audio_buffer: AudioRingBuffer, value: int) -> memoryview:
+    """A chunk of decoded (48 kHz stereo) PCM, every sample `value`"""
+    samples = np.full(audio_buffer.chunk_bytes // 2, value, dtype=np.int16)
+    return memoryview(samples.tobytes())
+
+
+def track(audio_buffer: AudioRingBuffer, member_id: int) -> np.ndarray:
+    return np.frombuffer(b"".join(audio_buffer.read(member_id, audio_buffer.bytes_written)),
+                         dtype=np.int16)
+
+
+def test_stores_decoded_pcm_losslessly():
+    audio_buffer = make_buffer(max_tracks=1)
+    stereo = np.random.default_rng(0).integers(-2 ** 15, 2 ** 15, audio_buffer.chunk_bytes // 2, dtype=np.int16)
+    assert audio_buffer.write_chunk(1, memoryview(stereo.tobytes()))
+    audio_buffer.advance()
+
+    stored = track(audio_buffer, 1)
+    assert audio_buffer.sampling_rate == 48000 and audio_buffer.channels == 2
+    assert np.array_equal(stored, stereo)
+
+
+def test_partial_chunk_is_padded_with_silence():
+    audio_buffer = make_buffer(max_tracks=1)
+    assert audio_buffer.write_chunk(1, decoded_chunk(audio_buffer, 100)[:audio_buffer.chunk_bytes // 2])
+    audio_buffer.advance()
+
+    stored = track(audio_buffer, 1)
+    half = len(stored) // 2
+    assert np.all(stored[:half] == 100)
+    assert np.all(stored[half:] == 0)
+
+
+def test_full_buffer_never_evicts_members_who_are_speaking(caplog):
+    # Room for 2 tracks, with 3 members talking every tick
+    audio_buffer = make_buffer(max_tracks=2)
+    with caplog.at_level(logging.WARNING):
+        for tick in range(4):
+            for member_id in (1, 2, 3):
+                audio_buffer.write_chunk(member_id, decoded_chunk(audio_buffer, member_id))
+            audio_buffer.advance()
+
+    # The first two keep their whole history, and the third isn't buffered
+    assert sorted(audio_buffer.member_ids()) == [1, 2]
+    for member_id in (1, 2):
+        assert np.all(track(audio_buffer, member_id) == member_id)
+        assert len(track(audio_buffer, member_id)) == 4 * AudioRingBuffer.SAMPLING_RATE * AudioRingBuffer.CHANNELS
+    assert 3 not in audio_buffer
+
+    # ...which is only warned about once
+    assert len(caplog.records) == 1
+
+
+def test_full_buffer_reuses_track_of_member_silent_for_whole_history():
+    audio_buffer = make_buffer(max_tracks=2)
+
+    def tick(*member_ids):
+        for member_id in member_ids:
+            audio_buffer.write_chunk(member_id, decoded_chunk(audio_buffer, member_id))
+        audio_buffer.advance()
+
+    tick(1, 2)
+    for _ in range(HISTORY_SIZE - 1):
+        tick(2)
+
+    # Member 1's first chunk is still in the history, so there's no room yet
+    assert not audio_buffer.write_chunk(3, decoded_chunk(audio_buffer, 3))
+    tick(2)
+
+    # It's all silence now, so member 3 takes their track
+    tick(2, 3)
+    assert sorted(audio_buffer.member_ids()) == [2, 3]
+    assert np.all(track(audio_buffer, 3)[:-AudioRingBuffer.SAMPLING_RATE * AudioRingBuffer.CHANNELS] == 0)
+    assert np.all(track(audio_buffer, 3)[-AudioRingBuffer.SAMPLING_RATE * AudioRingBuffer.CHANNELS:] == 3)
+    assert np.all(track(audio_buffer, 2) == 2)
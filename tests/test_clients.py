@@ -0,0 +1,19 @@
+# Clipped modules
+import modules.blob_storage as blob_storage
+import modules.clients as clients
+
+# Other modules
+import asyncio
+import openai
+
+
+def test_closing_clients_forgets_the_storage_backend(monkeypatch, tmp_path):
+    monkeypatch.setattr(blob_storage, "BACKEND", "local")
+    monkeypatch.setattr(blob_storage, "_storage", blob_storage.LocalBlobStorage(str(tmp_path)))
+    monkeypatch.setattr(clients, "_openai_client", openai.AsyncOpenAI(api_key="test"))
+
+    asyncio.run(clients.close())
+
+    assert clients._openai_client is None
+    assert blob_storage._storage is None
+    assert isinstance(blob_storage.get_storage(), blob_storage.LocalBlobStorage)
@@ -0,0 +1,49 @@
+# Clipped modules
+from modules.clip_executor import ClipExecutor
+
+# Other modules
+import asyncio
+
+
+def test_closing_a_guild_cancels_its_worker_and_queue():
+    executor = ClipExecutor(io_workers=1, cpu_workers=1, queue_size=2)
+    started = asyncio.Event()
+    cancelled = []
+    ran = []
+
+    async def hang():
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def wait():
+        await asyncio.sleep(60)
+
+    async def run():
+        assert executor.submit(1, hang)
+        assert executor.submit(2, wait)
+        await started.wait()
+        worker = executor._workers[1]
+
+        executor.close_guild(1)
+        await asyncio.sleep(0)
+        assert worker.done()
+        assert set(executor._queues) == {2} and set(executor._workers) == {2}
+
+        # A job after the guild's closed gets a new worker
+        async def job():
+            ran.append(1)
+        assert executor.submit(1, job)
+        await executor._queues[1].join()
+        executor.close_guild(2)
+
+    try:
+        asyncio.run(run())
+    finally:
+        executor.shutdown()
+
+    assert cancelled == [1] and ran == [1]
+    assert executor.metrics()["queue_depth"] == {}
@@ -0,0 +1,37 @@
+# Clipped modules
+from models.clip import Clip
+import modules.async_database as adb
+import modules.vector_index as vector_index
+
+# Other modules
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+
+
+class Guild:
+    id = 1
+    name = "guild"
+
+
+def test_vector_index_is_only_built_once_when_searched_at_once(monkeypatch, tmp_path):
+    monkeypatch.setattr(vector_index, "_indexes", {Guild.id: vector_index.GuildVectorIndex(Guild.id, str(tmp_path))})
+    monkeypatch.setattr(Clip, "index_load_locks", defaultdict(asyncio.Lock))
+    reads = []
+
+    async def read_document(collection_name, filter, projection):
+        reads.append(filter)
+        await asyncio.sleep(0.05)  # lets the other searches catch up
+        return [{"_id": {"guild_id": Guild.id, "timestamp": datetime(2024, 1, 1, 0, 0, i)},
+                 "summary_embedding": [1.0, float(i)]}
+                for i in range(3)]
+
+    monkeypatch.setattr(adb, "read_document", read_document)
+
+    async def run():
+        return await asyncio.gather(*(Clip._get_vector_index(Guild()) for _ in range(5)))
+
+    indexes = asyncio.run(run())
+
+    assert len(reads) == 1
+    assert all(index is indexes[0] and len(index) == 3 for index in indexes)
@@ -0,0 +1,133 @@
+# Clipped modules
+from models.clip import Clip
+import modules.clients as clients
+
+# Other modules
+from aiohttp import web
+import asyncio
+import io
+import logging
+import openai
+import pytest
+from typing import Dict, List, Tuple
+
+LATENCY = 0.1  # seconds the stub takes to transcribe a span
+
+
+class Guild:
+    id = 1
+    name = "guild"
+
+
+class StubTranscriptionServer:
+    """
+    Local stand-in for OpenAI's transcription endpoint. Every span takes
+    `LATENCY` seconds, except that a span whose file name starts with
+    "slow" never finishes in time, and one starting with "error" fails.
+    Each span is transcribed into a single segment of its file name.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+
+        self._runner: web.AppRunner | None = None
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/v1/audio/transcriptions", self._transcribe)
+        self._runner = web.AppRunner(app, handler_cancellation=True)  # timed out requests stop
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host="127.0.0.1", port=0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"http://127.0.0.1:{port}/v1"
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+    async def _transcribe(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            filename = (await request.post())["file"].filename
+            await asyncio.sleep(10 if filename.startswith("slow") else LATENCY)
+            if filename.startswith("error"):
+                return web.json_response({"error": {"message": "stub failure"}}, status=500)
+
+            return web.json_response({"text": filename,
+                                      "segments": [{"start": 0.5, "end": 1.0, "text": f" {filename}"}]})
+        finally:
+            self.in_flight -= 1
+
+
+def span(member_id: int, offset: float, name: str) -> Tuple[int, str, float, io.BytesIO]:
+    audio_bytes = io.BytesIO(b"\0" * 1024)
+    audio_bytes.name = name
+    return member_id, f"member{member_id}", offset, audio_bytes
+
+
+def transcribe(spans: List[Tuple[int, str, float, io.BytesIO]],
+               monkeypatch,
+               live_segments: List[Dict] | None = None) -> Tuple[str, StubTranscriptionServer]:
+    """Transcribe the spans against the stub, returning the transcript (or raising)"""
+    monkeypatch.setattr(Clip, "TRANSCRIPTION_CONCURRENCY", 2)
+    monkeypatch.setattr(Clip, "TRANSCRIPTION_TIMEOUT", 1)
+    server = StubTranscriptionServer()
+
+    async def run() -> str:
+        base_url = await server.start()
+        ai_client = openai.AsyncOpenAI(base_url=base_url, api_key="test", max_retries=0)
+        monkeypatch.setattr(clients, "_openai_client", ai_client)
+        clip = Clip(Guild())
+        clip.live_segments = live_segments or []
+        try:
+            return await clip._generate_transcription(spans)
+        finally:
+            await ai_client.close()
+            await server.stop()
+
+    return asyncio.run(run()), server
+
+
+def test_spans_transcribed_concurrently_up_to_limit(monkeypatch):
+    spans = [span(member_id=i % 3, offset=float(i), name=f"span{i}.ogg") for i in range(6)]
+
+    transcript, server = transcribe(spans, monkeypatch)
+
+    assert server.requests == 6
+    assert server.max_in_flight == Clip.TRANSCRIPTION_CONCURRENCY
+    assert transcript.splitlines() == [f"[member{i % 3}]: span{i}.ogg" for i in range(6)]
+
+
+def test_partial_transcript_when_spans_fail_or_time_out(monkeypatch, caplog):
+    spans = [span(member_id=1, offset=0.0, name="span0.ogg"),
+             span(member_id=2, offset=1.0, name="slow1.ogg"),
+             span(member_id=3, offset=2.0, name="error2.ogg"),
+             span(member_id=1, offset=3.0, name="span3.ogg")]
+
+    with caplog.at_level(logging.WARNING, logger="models.clip"):
+        transcript, _ = transcribe(spans, monkeypatch)
+
+    assert transcript.splitlines() == ["[member1]: span0.ogg", "[member1]: span3.ogg"]
+    assert "member2@1.0s" in caplog.text and "member3@2.0s" in caplog.text
+
+
+def test_live_segments_merged_in_order(monkeypatch):
+    spans = [span(member_id=1, offset=4.0, name="span4.ogg")]
+    live_segments = [{"member_name": "member2", "start": 1.0, "text": "live"},
+                     {"member_name": "member2", "start": 9.0, "text": "later"}]
+
+    transcript, _ = transcribe(spans, monkeypatch, live_segments)
+
+    assert transcript.splitlines() == ["[member2]: live", "[member1]: span4.ogg", "[member2]: later"]
+
+
+def test_every_span_failing_fails_the_clip(monkeypatch):
+    spans = [span(member_id=1, offset=0.0, name="error0.ogg"),
+             span(member_id=2, offset=1.0, name="slow1.ogg")]
+
+    with pytest.raises(Exception, match="every member"):
+        transcribe(spans, monkeypatch)
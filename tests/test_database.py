@@ -0,0 +1,175 @@
+"""
+Batch operations of `modules.async_database`, members' opt-in statuses
+and session cleanup, against an in-memory MongoDB. Needs mongomock (pip
+install mongomock).
+"""
+# Clipped modules
+from bw_secrets import CLIPPED_SESSIONS_COLLECTION, MEMBERS_COLLECTION
+from models.member import ClippedMember
+from models.session import ClippedSession
+import modules.async_database as adb
+from modules.ttl_cache import TTLCache
+
+# Other modules
+import asyncio
+import pytest
+
+
+class Guild:
+    def __init__(self, id: int):
+        self.id = id
+        self.name = f"guild{id}"
+
+
+class Member:
+    def __init__(self, id: int, guild: Guild):
+        self.id = id
+        self.name = f"member{id}"
+        self.guild = guild
+
+
+def member_doc(member_id: int, opted_in: bool, name: str = "member") -> dict:
+    return {"_id": {"member_id": member_id, "guild_id": 1}, "name": name, "opted_in": opted_in}
+
+
+def test_insert_many_then_read_many(mongo):
+    docs = [member_doc(member_id, opted_in=True) for member_id in range(1, 4)]
+
+    async def run():
+        inserted_ids = await adb.insert_many(MEMBERS_COLLECTION, docs)
+        results = await adb.read_many(MEMBERS_COLLECTION,
+                                      ids=[inserted_ids[0], inserted_ids[2], {"member_id": 9, "guild_id": 1}],
+                                      projection={"_id": 1, "opted_in": 1})
+        return inserted_ids, results
+
+    inserted_ids, results = asyncio.run(run())
+
+    assert inserted_ids == [doc["_id"] for doc in docs]
+    assert sorted(results, key=lambda doc: doc["_id"]["member_id"]) == [
+        {"_id": {"member_id": 1, "guild_id": 1}, "opted_in": True},
+        {"_id": {"member_id": 3, "guild_id": 1}, "opted_in": True}
+    ]
+
+
+def test_batch_operations_on_nothing(mongo):
+    async def run():
+        assert await adb.insert_many(MEMBERS_COLLECTION, []) == []
+        assert await adb.read_many(MEMBERS_COLLECTION, ids=[]) == []
+        await adb.bulk_upsert(MEMBERS_COLLECTION, objs=[])
+
+    asyncio.run(run())
+
+    assert mongo[MEMBERS_COLLECTION].count_documents({}) == 0
+
+
+def test_unknown_collection_is_rejected(mongo):
+    with pytest.raises(Exception, match="doesn't exist"):
+        asyncio.run(adb.read_many("not_a_collection", ids=[1]))
+
+
+def test_bulk_upsert_overwrites_and_creates(mongo):
+    mongo[MEMBERS_COLLECTION].insert_one(member_doc(1, opted_in=True, name="old"))
+
+    asyncio.run(adb.bulk_upsert(MEMBERS_COLLECTION, objs=[member_doc(1, opted_in=False, name="new"),
+                                                          member_doc(2, opted_in=True)]))
+
+    assert mongo[MEMBERS_COLLECTION].find_one({"_id.member_id": 1}) == member_doc(1, opted_in=False, name="new")
+    assert mongo[MEMBERS_COLLECTION].find_one({"_id.member_id": 2}) == member_doc(2, opted_in=True)
+
+
+def test_bulk_upsert_without_overwrite_keeps_existing(mongo):
+    mongo[MEMBERS_COLLECTION].insert_one(member_doc(1, opted_in=False, name="old"))
+
+    asyncio.run(adb.bulk_upsert(MEMBERS_COLLECTION,
+                                objs=[member_doc(1, opted_in=True, name="new"), member_doc(2, opted_in=True)],
+                                overwrite=False))
+
+    assert mongo[MEMBERS_COLLECTION].find_one({"_id.member_id": 1}) == member_doc(1, opted_in=False, name="old")
+    assert mongo[MEMBERS_COLLECTION].find_one({"_id.member_id": 2}) == member_doc(2, opted_in=True)
+
+
+def test_async_batch_operations(mongo):
+    async def run():
+        await adb.insert_many(MEMBERS_COLLECTION, [member_doc(1, opted_in=True),
+                                                   member_doc(2, opted_in=False)])
+        await adb.bulk_upsert(MEMBERS_COLLECTION, objs=[member_doc(1, opted_in=False),
+                                                        member_doc(3, opted_in=True)])
+        await adb.bulk_upsert(MEMBERS_COLLECTION, objs=[member_doc(2, opted_in=True)], overwrite=False)
+        return await adb.read_many(MEMBERS_COLLECTION,
+                                   ids=[{"member_id": member_id, "guild_id": 1} for member_id in (1, 2, 3)],
+                                   projection={"opted_in": 1})
+
+    results = asyncio.run(run())
+
+    assert {doc["_id"]["member_id"]: doc["opted_in"] for doc in results} == {1: False, 2: False, 3: True}
+
+
+def test_new_member_default_never_overwrites_opt_out(mongo):
+    guild = Guild(1)
+    member = Member(5, guild)
+
+    async def run():
+        # The member is seen as new (e.g. by two events at once), but
+        # opts out before their default opt-in document is written
+        await ClippedMember.set_opted_in_status(guild, member, opted_in=False)
+        await ClippedMember.set_opted_in_statuses(members=[member], opted_in=True, overwrite=False)
+        return await ClippedMember.get_opted_in_statuses([member])
+
+    statuses = asyncio.run(run())
+
+    assert statuses == {member: False}
+    assert mongo[MEMBERS_COLLECTION].find_one({"_id": {"member_id": 5, "guild_id": 1}})["opted_in"] is False
+
+
+def test_opt_out_evicted_from_cache_stays_excluded(mongo, monkeypatch):
+    # Only room for one member's status, so reading two evicts the first
+    monkeypatch.setattr(ClippedMember, "opt_in_cache", TTLCache(maxsize=1, ttl=60))
+    guild = Guild(1)
+    opted_out, opted_in = Member(5, guild), Member(6, guild)
+
+    async def run():
+        await ClippedMember.set_opted_in_statuses([opted_out], opted_in=False)
+        await ClippedMember.set_opted_in_statuses([opted_in], opted_in=True)
+        ClippedMember.opt_in_cache.clear()
+        return (await ClippedMember.get_opted_in_statuses([opted_out, opted_in]),
+                await ClippedMember.get_opted_in_members([opted_out, opted_in]))
+
+    statuses, members = asyncio.run(run())
+
+    assert statuses == {opted_out: False, opted_in: True}
+    assert members == [opted_in]
+
+
+def test_vector_search_leaves_the_projection_alone(monkeypatch):
+    pipelines = []
+
+    async def no_results():
+        return
+        yield
+
+    class Collection:
+        async def aggregate(self, pipeline):
+            pipelines.append(pipeline)
+            return no_results()
+
+    monkeypatch.setattr(adb, "db", {"clips": Collection()})
+    projection = {"_id": 1, "transcript": 1}
+
+    asyncio.run(adb.vector_search([0.0], "clips", projection=projection))
+    asyncio.run(adb.vector_search([0.0], "clips", projection=projection))
+
+    assert projection == {"_id": 1, "transcript": 1}
+    assert pipelines[1][1]["$project"] == {"_id": 1, "transcript": 1, "score": {"$meta": "vectorSearchScore"}}
+
+
+def test_clearing_a_nodes_sessions_leaves_other_nodes_alone(mongo):
+    sessions = mongo[CLIPPED_SESSIONS_COLLECTION]
+    sessions.insert_many([{"_id": 1, "node": {"id": "a-0"}},
+                          {"_id": 2, "node": {"id": "b-0"}},
+                          {"_id": 3, "node": {"id": "a-0"}}])
+
+    asyncio.run(ClippedSession.db_clear_node_clipped_sessions("a-0"))
+    assert [doc["_id"] for doc in sessions.find()] == [2]
+
+    asyncio.run(ClippedSession.db_clear_all_clipped_sessions())
+    assert sessions.count_documents({}) == 0
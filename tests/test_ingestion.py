@@ -0,0 +1,44 @@
+# Clipped modules
+from models.clip import Clip
+from modules.clip_executor import ClipExecutor
+from modules.ingestion import IngestionPipeline
+
+# Other modules
+import asyncio
+import os
+from types import SimpleNamespace
+
+
+def test_resume_sweeps_audio_of_clips_that_were_never_stored(monkeypatch, tmp_path):
+    def span_dir(name: str, age: float) -> str:
+        path = tmp_path / name
+        path.mkdir()
+        (path / "span.ogg").write_bytes(b"\0")
+        mtime = pipeline._created_at - age
+        os.utime(path, (mtime, mtime))
+        return str(path)
+
+    executor = ClipExecutor(io_workers=1, cpu_workers=1)
+    pipeline = IngestionPipeline(executor, ingest_dir=str(tmp_path))
+    orphaned = span_dir("1-20240101000000000000", age=60)
+    pending = span_dir("1-20240101000001000000", age=60)
+    being_ingested = span_dir("1-20240101000002000000", age=-1)  # saved since the pipeline started
+    other = span_dir("not-a-clip", age=60)
+
+    docs = [{"_id": {"guild_id": 1, "timestamp": None},
+             "stage": "uploaded",
+             "pending_spans": [{"path": os.path.join(pending, "span.ogg")}]}]
+
+    async def get_unfinished_documents(final_stage):
+        return docs
+
+    monkeypatch.setattr(Clip, "get_unfinished_documents", get_unfinished_documents)
+    bot = SimpleNamespace(get_guild=lambda guild_id: None)  # so nothing's actually resumed
+
+    try:
+        asyncio.run(pipeline.resume_pending(bot))
+    finally:
+        executor.shutdown()
+
+    assert not os.path.exists(orphaned)
+    assert all(os.path.exists(path) for path in (pending, being_ingested, other))
@@ -0,0 +1,129 @@
+# Clipped modules
+from modules.audio_buffer import AudioRingBuffer
+from modules.audio_encoder import WAV
+import modules.live_transcriber as live_transcriber
+from modules.live_transcriber import LiveTranscriber
+
+# Other modules
+import asyncio
+import io
+import numpy as np
+import random
+from typing import Awaitable, Callable, Dict, List, Tuple
+import wave
+
+HISTORY_SIZE = 300  # seconds
+STEP = live_transcriber.WINDOW - live_transcriber.OVERLAP
+
+Utterance = Tuple[float, float, str]  # (start, end, text), on the buffer's clock
+
+
+class Member:
+    def __init__(self, id: int):
+        self.id = id
+        self.name = f"member{id}"
+
+
+class InlineExecutor:
+    """Runs every stage right on the event loop"""
+
+    async def run_cpu(self, stage: str, func: Callable, *args):
+        return func(*args)
+
+    async def timed(self, stage: str, awaitable: Awaitable):
+        return await awaitable
+
+
+def stub_transcriber(audio_buffer: AudioRingBuffer,
+                     utterances: Dict[int, List[Utterance]],
+                     rng: random.Random):
+    """
+    Transcribes a window into whichever of the member's utterances it
+    hears, with slightly noisy timestamps. An utterance the window only
+    hears part of is marked "(partial)".
+    """
+    async def transcribe(audio_bytes: io.BytesIO) -> List[Dict]:
+        with wave.open(audio_bytes) as wav:
+            duration = wav.getnframes() / wav.getframerate()
+        window_end = audio_buffer.seconds_recorded
+        window_start = window_end - duration
+        member_id = int(audio_bytes.name.split("-")[0])
+
+        segments = []
+        for start, end, text in utterances[member_id]:
+            if end <= window_start or start >= window_end:
+                continue
+            if start < window_start or end > window_end:
+                text += "(partial)"
+            segments.append({"start": max(start, window_start) - window_start + rng.uniform(-0.05, 0.05),
+                             "end": min(end, window_end) - window_start + rng.uniform(-0.05, 0.05),
+                             "text": f" {text}"})
+        return segments
+
+    return transcribe
+
+
+def replay(utterances: Dict[int, List[Utterance]], seconds: int, monkeypatch) -> LiveTranscriber:
+    """Buffer the members' utterances (as noise) for `seconds`, transcribing live as it goes"""
+    monkeypatch.setattr(live_transcriber, "WINDOW_FORMAT", WAV)  # no ffmpeg needed
+    audio_buffer = AudioRingBuffer(history_size=HISTORY_SIZE, chunk_size=1, max_bytes=2 ** 30)
+    transcriber = LiveTranscriber(voice=None,
+                                  audio_buffer=audio_buffer,
+                                  history_size=HISTORY_SIZE,
+                                  executor=InlineExecutor(),
+                                  transcribe=stub_transcriber(audio_buffer, utterances, random.Random(0)))
+    members = [Member(member_id) for member_id in utterances]
+    speech = np.random.default_rng(0).normal(0, 6000, audio_buffer.chunk_bytes // 2).astype(np.int16)
+
+    async def run():
+        for second in range(seconds):
+            for member_id, member_utterances in utterances.items():
+                if any(start <= second + 0.5 < end for start, end, _ in member_utterances):
+                    audio_buffer.write_chunk(member_id, memoryview(speech.tobytes()))
+            audio_buffer.advance()
+            if (second + 1) % STEP == 0:
+                await transcriber.transcribe_window(members)
+
+    asyncio.run(run())
+    return transcriber
+
+
+def test_segment_cut_off_by_window_is_committed_whole(monkeypatch):
+    # The 30-60s window cuts off the long utterance, and the 50-80s window
+    # would cut off its start
+    utterances = {1: [(5, 8, "first"), (45, 62, "long"), (70, 73, "last")]}
+    transcriber = replay(utterances, 120, monkeypatch)
+
+    transcript = transcriber.transcripts[1]
+    assert [seg["text"] for seg in transcript.segments] == ["first", "long", "last"]
+    long = transcript.segments[1]
+    assert abs(long["start"] - 45) < 0.1 and abs(long["end"] - 62) < 0.1
+
+
+def test_replay_commits_every_utterance_once_and_whole(monkeypatch):
+    rng = random.Random(1)
+    utterances: Dict[int, List[Utterance]] = {1: [], 2: []}
+    for member_id, member_utterances in utterances.items():
+        t = 0.5
+        while t < 600:
+            duration = rng.uniform(0.5, 15)
+            member_utterances.append((t, t + duration, f"m{member_id}u{len(member_utterances)}"))
+            t += duration + rng.uniform(0.5, 20)
+
+    transcriber = replay(utterances, 600, monkeypatch)
+
+    for member_id, member_utterances in utterances.items():
+        transcript = transcriber.transcripts[member_id]
+        texts = [seg["text"] for seg in transcript.segments]
+        assert not any("(partial)" in text for text in texts)
+        assert len(texts) == len(set(texts))
+        assert texts == [text for start, end, text in member_utterances
+                         if end >= 600 - HISTORY_SIZE and end <= transcript.covered_until]
+
+    # A clip's slice has exactly what's transcribed of its window
+    segments, transcribed_until = transcriber.slice([1, 2], 540, 600)
+    assert sorted(seg["text"] for seg in segments) == sorted(
+        text
+        for member_id, member_utterances in utterances.items()
+        for start, end, text in member_utterances
+        if 540 <= (start + end) / 2 < 540 + transcribed_until[member_id])
@@ -0,0 +1,166 @@
+"""
+Clip requests routed between two nodes: one running the guild's shard
+(which gets the interaction), and one holding the guild's session but
+without the guild in its cache.
+"""
+# Clipped modules
+from models.member import ClippedMember
+from models.session import ClippedSession
+from modules.audio_encoder import WAV
+import modules.clients as clients
+from modules.cmd_gateway import GatewayCog
+from modules.session_router import SessionRouter
+
+# Other modules
+import asyncio
+import numpy as np
+import openai
+import socket
+from types import SimpleNamespace
+from typing import List
+
+APPLICATION_ID = 42
+GUILD_ID = 1
+
+
+class Member:
+    def __init__(self, id: int, guild, voice=None):
+        self.id = id
+        self.name = f"member{id}"
+        self.display_name = self.name
+        self.guild = guild
+        self.voice = voice
+
+
+class Guild:
+    """A guild as the node holding its session sees it: not in its cache"""
+
+    def __init__(self):
+        self.id = GUILD_ID
+        self.name = "guild"
+        self.fetched: List[int] = []
+
+    def get_member(self, member_id: int) -> None:
+        return None
+
+    async def fetch_member(self, member_id: int) -> Member:
+        self.fetched.append(member_id)
+        return Member(member_id, self)
+
+
+class VoiceClient:
+    """The session's voice client (nothing's received through it here)"""
+
+    def __init__(self, guild: Guild):
+        self.guild = guild
+        self.channel = SimpleNamespace(id=10, name="voice", members=[])  # stale
+        self.recording = False
+
+    def start_recording(self, sink, callback) -> None:
+        pass
+
+
+class Followup:
+    """Stands in for the interaction's followup webhook"""
+
+    def __init__(self):
+        self.replies = []
+        self.replied = asyncio.Event()
+
+    async def send(self, content=None, file=None):
+        self.replies.append(content if file is None else file)
+        self.replied.set()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def gateway(router: SessionRouter) -> GatewayCog:
+    cog = GatewayCog(SimpleNamespace(application_id=APPLICATION_ID))
+    cog.router = router
+    return cog
+
+
+def test_forwarded_clip_is_made_by_the_node_holding_the_session(mongo, monkeypatch):
+    monkeypatch.setattr(GatewayCog, "DISCORD_FORMAT", WAV)  # no ffmpeg needed
+    monkeypatch.setattr(GatewayCog, "ARCHIVE_FORMAT", WAV)
+    monkeypatch.setattr(GatewayCog, "TRANSCRIPTION_FORMAT", WAV)
+    monkeypatch.setattr(GatewayCog, "clipped_sessions", {})
+    monkeypatch.setattr(clients, "_openai_client", openai.AsyncOpenAI(api_key="test"))
+
+    shard_node = gateway(SessionRouter("shard-node", "127.0.0.1", free_port(), "test"))
+    session_node = gateway(SessionRouter("session-node", "127.0.0.1", free_port(), "test"))
+    followup = Followup()
+    monkeypatch.setattr(session_node.router, "followup", lambda application_id, token: followup)
+    ingested = []
+    monkeypatch.setattr(session_node.ingestion, "submit",
+                        lambda clip, clip_bytes, clip_format, clip_by_member: ingested.append(clip_by_member))
+
+    async def run():
+        # The session's on the other node
+        guild = Guild()
+        session = ClippedSession(voice=VoiceClient(guild),
+                                 started_by=Member(1, guild),
+                                 history_size=30,
+                                 node=session_node.router.node())
+        await shard_node.router.start(shard_node.routed_clip_that_handler)
+        await session_node.router.start(session_node.routed_clip_that_handler)
+        try:
+            await session.create_session_document_in_db()
+            GatewayCog.clipped_sessions[GUILD_ID] = session
+
+            speech = np.random.default_rng(0).normal(0, 3000, session.streamer.audio_buffer.chunk_bytes // 2)
+            for _ in range(3):
+                for member_id in (1, 2):
+                    session.streamer.audio_buffer.write_chunk(member_id, memoryview(speech.astype(np.int16)))
+                session.streamer.audio_buffer.advance()
+            await ClippedMember.set_opted_in_statuses([Member(2, guild)], opted_in=False)
+
+            # The shard's node gets the interaction, and sees who's in voice
+            shard_guild = SimpleNamespace(id=GUILD_ID, name="guild")
+            channel = SimpleNamespace(members=[Member(1, shard_guild), Member(2, shard_guild)])
+            shard_guild.me = SimpleNamespace(voice=SimpleNamespace(channel=channel))
+            user = Member(1, shard_guild, voice=SimpleNamespace(channel=channel))
+            interaction = SimpleNamespace(application_id=APPLICATION_ID,
+                                          token="token",
+                                          response=SimpleNamespace(is_done=lambda: True))
+
+            routed = await shard_node._route_clip_that(followup.send, interaction, shard_guild, user,
+                                                       member=None, duration=2, offset=0)
+            await asyncio.wait_for(followup.replied.wait(), timeout=30)
+            return routed, guild, session
+        finally:
+            session.streamer.stream_loop_task.cancel()
+            await shard_node.router.stop()
+            await session_node.router.stop()
+            shard_node.clip_executor.shutdown()
+            session_node.clip_executor.shutdown()
+
+    routed, guild, session = asyncio.run(run())
+
+    assert routed
+    assert len(followup.replies) == 1 and followup.replies[0].filename == "clip.wav"
+    clip_bytes = followup.replies[0].fp.getvalue()
+    assert len(clip_bytes) > 2 * session.streamer.audio_buffer.bytes_per_second
+    # Only the member who's opted in is clipped, though the node's own view of the channel is empty
+    assert [member.id for member in ingested[0]] == [1]
+    assert sorted(guild.fetched) == [1, 2]
+
+
+def test_session_node_refuses_requests_for_sessions_it_doesnt_hold(monkeypatch):
+    monkeypatch.setattr(GatewayCog, "clipped_sessions", {})
+    node = gateway(SessionRouter("session-node", "127.0.0.1", free_port(), "test"))
+
+    async def run():
+        request = {"guild_id": GUILD_ID, "member_id": None, "member_ids": [1], "duration": 2,
+                   "offset": 0, "application_id": APPLICATION_ID, "token": "token"}
+        try:
+            return (await node.routed_clip_that_handler(request),
+                    await node.routed_clip_that_handler({**request, "application_id": 7}))
+        finally:
+            node.clip_executor.shutdown()
+
+    assert asyncio.run(run()) == (False, False)
@@ -0,0 +1,58 @@
+"""
+Short soak of DataStreamer's memory use: a few simulated minutes of voice
+frames, past the point the ring buffer has wrapped around. The long soak
+is `benchmarks/bench_streamer_memory.py`.
+"""
+# Clipped modules
+from modules.data_streamer import ClipSink, DataStreamer
+
+# Other modules
+import os
+import tracemalloc
+
+HISTORY_SIZE = 30  # seconds
+SIMULATED = 5 * 60  # seconds of voice
+MEMBERS = 3
+PACKET_DURATION = 0.02  # seconds of audio per voice packet
+PACKET_SAMPLES = 960  # RTP timestamp increment per packet
+MAX_GROWTH = 256 * 1024  # bytes allocated (and still held) after warm-up that are tolerated
+
+
+def test_memory_stays_flat_once_the_buffer_is_full():
+    streamer = DataStreamer(voice=None, history_size=HISTORY_SIZE, max_buffer_bytes=2 ** 30)
+    sink = ClipSink(streamer.audio_buffer.chunk_bytes)
+    sink.timeline.start_time = 0.0
+    packet = os.urandom(PACKET_SAMPLES * 4)
+    packets_per_tick = round(streamer.chunk_size / PACKET_DURATION)
+
+    tracemalloc.start()
+    try:
+        baseline = None
+        max_staged = 0
+        for tick in range(SIMULATED // streamer.chunk_size):
+            for member_id in range(MEMBERS):
+                # Members take turns going quiet, so tracks fill with silence too
+                if (tick // 10) % MEMBERS == member_id:
+                    continue
+                for i in range(packets_per_tick):
+                    packet_index = tick * packets_per_tick + i
+                    sink.write_frame(member_id,
+                                     bytes(bytearray(packet)),  # a new frame, like the decoder's
+                                     receive_time=(packet_index + 1) * PACKET_DURATION,
+                                     ssrc=member_id,
+                                     rtp_timestamp=(packet_index * PACKET_SAMPLES) % 2 ** 32)
+            streamer._buffer_chunk(sink)
+            max_staged = max(max_staged, sink.timeline.staged_bytes())
+
+            # Warmed up once the ring buffer has wrapped around
+            if tick == 2 * HISTORY_SIZE // streamer.chunk_size:
+                baseline, _ = tracemalloc.get_traced_memory()
+
+        growth = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+
+    assert streamer.audio_buffer.seconds_recorded == SIMULATED
+    assert sorted(streamer.audio_buffer.member_ids()) == list(range(MEMBERS))
+    assert max_staged <= MEMBERS * streamer.audio_buffer.chunk_bytes
+    assert growth < MAX_GROWTH
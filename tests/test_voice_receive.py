@@ -0,0 +1,177 @@
+"""
+The voice receive path, from encrypted RTP packets through
+`ClippedVoiceClient.unpack_audio` into the sink. Needs libopus (the
+tests are skipped if Pycord can't find it) and PyNaCl.
+"""
+# Clipped modules
+from models.voice_client import ClippedVoiceClient
+from modules.data_streamer import ClipSink, DataStreamer
+from modules.jitter_buffer import JitterStats
+
+# Pycord modules
+import discord.opus as op
+
+# Other modules
+import nacl.secret
+import numpy as np
+import pytest
+import random
+import struct
+import time
+from types import SimpleNamespace
+from typing import List, Tuple
+
+if not op.is_loaded() and not op._load_default():
+    pytest.skip("libopus isn't available", allow_module_level=True)
+
+FRAME_SAMPLES = 960  # samples per 20 ms packet
+FRAME_BYTES = FRAME_SAMPLES * op.Decoder.SAMPLE_SIZE
+SECRET_KEY = bytes(range(32))
+
+Packet = Tuple[int, int, bytes]  # sequence, RTP timestamp, Opus payload
+
+
+class Clock:
+    """Stands in for `time.perf_counter()`, so packets arrive exactly when they're sent"""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_voice(seconds: float) -> np.ndarray:
+    """Voice-like stereo PCM: a harmonic tone, in syllable-length bursts"""
+    t = np.arange(int(seconds * op.Decoder.SAMPLING_RATE)) / op.Decoder.SAMPLING_RATE
+    tone = sum(np.sin(2 * np.pi * 150 * harmonic * t) / harmonic for harmonic in range(1, 6))
+    syllables = 0.2 + np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    return np.repeat((5000 * tone * syllables).astype(np.int16), 2)
+
+
+def encode(pcm: np.ndarray, sequence: int, timestamp: int) -> List[Packet]:
+    encoder = op.Encoder()  # with FEC on, like Discord clients
+    return [((sequence + i) % 2 ** 16,
+             (timestamp + i * FRAME_SAMPLES) % 2 ** 32,
+             encoder.encode(pcm[i * FRAME_SAMPLES * 2:(i + 1) * FRAME_SAMPLES * 2].tobytes(), FRAME_SAMPLES))
+            for i in range(len(pcm) // (FRAME_SAMPLES * 2))]
+
+
+def rtp_packet(ssrc: int, sequence: int, timestamp: int, payload: bytes) -> bytes:
+    """An RTP packet as Discord sends it (xsalsa20_poly1305, nonce from the header)"""
+    header = struct.pack(">BBHII", 0x80, 0x78, sequence, timestamp, ssrc)
+    nonce = header + bytes(12)
+    return header + nacl.secret.SecretBox(SECRET_KEY).encrypt(payload, nonce).ciphertext
+
+
+def voice_client(sink: ClipSink, users: dict) -> ClippedVoiceClient:
+    """A voice client that's connected as far as receiving goes (without connecting to Discord)"""
+    voice = ClippedVoiceClient.__new__(ClippedVoiceClient)
+    voice.mode = "xsalsa20_poly1305"
+    voice.secret_key = list(SECRET_KEY)
+    voice.paused = False
+    voice.ws = SimpleNamespace(ssrc_map={ssrc: {"user_id": user_id, "speaking": True}
+                                         for ssrc, user_id in users.items()})
+    voice.sink = sink
+    voice.jitter_buffers = {}
+    voice.jitter_stats = JitterStats()
+    return voice
+
+
+def test_lost_and_reordered_packets_are_concealed_in_place(monkeypatch):
+    clock = Clock(1.0)
+    monkeypatch.setattr(time, "perf_counter", clock)
+    packets = encode(make_voice(1.2), sequence=65_530, timestamp=2 ** 32 - 5 * FRAME_SAMPLES)  # both wrap
+    decoder = op.Decoder()
+    expected = b"".join(decoder.decode(payload, fec=False) for _, _, payload in packets)
+
+    sink = ClipSink(len(expected))
+    voice = voice_client(sink, {1234: 1})
+    arrivals = [i for i in range(len(packets)) if i != 20]  # lost
+    arrivals[30], arrivals[31] = arrivals[31], arrivals[30]  # reordered
+    for i in arrivals:
+        clock.now = 1.0 + (i + 1) * 0.02
+        voice.unpack_audio(rtp_packet(1234, *packets[i]))
+    # RTCP is passed over
+    voice.unpack_audio(struct.pack(">BBH", 0x81, 200, 6) + bytes(24))
+
+    received = bytearray(len(expected))
+    num_bytes = sink.timeline.take_chunk(1, memoryview(received))
+
+    assert voice.jitter_stats.as_dict() == {"received": len(packets) - 1, "late": 0,
+                                            "lost": 1, "concealed": 1, "recovered": 1}
+    assert num_bytes == len(expected)
+    assert sink.timeline.late_frames == 0 and sink.timeline.dropped_frames == 0
+
+    # The lost frame is rebuilt from the next packet's FEC data, right where it was
+    received = np.frombuffer(received, dtype=np.int16).astype(np.float64)
+    reference = np.frombuffer(expected, dtype=np.int16).astype(np.float64)
+    lost = slice(20 * FRAME_SAMPLES * 2, 21 * FRAME_SAMPLES * 2)
+    assert np.abs(received[lost]).mean() > 0.25 * np.abs(reference[lost]).mean()
+    before = slice(0, 20 * FRAME_SAMPLES * 2)
+    assert np.array_equal(received[before], reference[before])
+
+
+def test_frames_from_before_the_speaker_is_known_are_dropped(monkeypatch):
+    clock = Clock(1.0)
+    monkeypatch.setattr(time, "perf_counter", clock)
+    packets = encode(make_voice(0.2), sequence=0, timestamp=0)
+
+    sink = ClipSink(len(packets) * FRAME_BYTES)
+    voice = voice_client(sink, {})
+    for i, packet in enumerate(packets):
+        clock.now = 1.0 + (i + 1) * 0.02
+        voice.unpack_audio(rtp_packet(1234, *packet))
+        if i == 4:
+            voice.ws.ssrc_map[1234] = {"user_id": 1, "speaking": True}
+
+    received = bytearray(len(packets) * FRAME_BYTES)
+    num_bytes = sink.timeline.take_chunk(1, memoryview(received))
+
+    # Decoding went on all along, so the frames after are placed by RTP timestamp
+    assert num_bytes == len(packets) * FRAME_BYTES
+    assert not any(received[:5 * FRAME_BYTES])
+    assert voice.jitter_stats.received == len(packets)
+
+
+def test_jittered_members_line_up_in_the_buffer(monkeypatch):
+    clock = Clock(1.0)
+    monkeypatch.setattr(time, "perf_counter", clock)
+    rng = random.Random(0)
+    voice_pcm = make_voice(3)
+
+    # Both members say the same thing, the second starting half a second
+    # later, with their packets (all but the first) arriving up to 50 ms late
+    arrivals = []
+    for ssrc, start, jitter, sequence, timestamp in [(1, 0.0, 0.0, 100, 5_000),
+                                                     (2, 0.5, 0.05, 40_000, 3_000_000_000)]:
+        for i, packet in enumerate(encode(voice_pcm, sequence, timestamp)):
+            sent = 1.0 + start + (i + 1) * 0.02
+            arrivals.append((sent + (rng.uniform(0, jitter) if i > 0 else 0), ssrc, packet))
+    arrivals.sort()
+
+    streamer = DataStreamer(voice=None, history_size=10, chunk_size=1)
+    sink = ClipSink(streamer.audio_buffer.chunk_bytes)
+    voice = voice_client(sink, {1: 1, 2: 2})
+
+    def stream(until: float):
+        # What the stream loop does, as time goes by
+        while sink.timeline.chunk_ready(DataStreamer.JITTER_LATENCY, now=until):
+            streamer._buffer_chunk(sink)
+
+    for arrival, ssrc, packet in arrivals:
+        stream(arrival)
+        clock.now = arrival
+        voice.unpack_audio(rtp_packet(ssrc, *packet))
+    stream(clock.now + 2)
+
+    audio_buffer = streamer.audio_buffer
+    tracks = {member_id: b"".join(audio_buffer.read(member_id, audio_buffer.bytes_written))
+              for member_id in (1, 2)}
+    delay = audio_buffer.bytes_per_second // 2
+    length = 3 * audio_buffer.bytes_per_second
+
+    assert voice.jitter_stats.lost == 0 and voice.jitter_stats.late == 0
+    assert sink.timeline.late_frames == 0
+    assert not any(tracks[2][:delay])
+    assert tracks[2][delay:delay + length] == tracks[1][:length]
@@ -12,9 +12,11 @@ class ControlsView(View):
     @button(label="Clip That",
             style=ButtonStyle.primary)
     async def btn_clip_that(self, button: Button, interaction: Interaction):
+        await interaction.response.defer()  # clipping may take longer than the interaction timeout
         await self.clip_that_func(respond_func=interaction.respond,
                                   guild=interaction.guild,
-                                  user=interaction.user)
+                                  user=interaction.user,
+                                  interaction=interaction)
 
     @button(label="Leave",
             style=ButtonStyle.danger)
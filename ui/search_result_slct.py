@@ -1,5 +1,4 @@
 # Clipped modules
-from bw_secrets import GCS_BUCKET_NAME
 from models.clip import Clip
 
 # Pycord modules
@@ -7,8 +6,8 @@ from discord import File, Interaction, SelectOption
 from discord.ui import Select
 
 # Other modules
-from google.cloud import storage
-import io
+import asyncio
+import os
 from typing import List
 
 
@@ -37,21 +36,22 @@ class SearchResultSelect(Select):
         index = int(self.values[0])
         selected_clip = self.clips[index]
 
-        # Fetch the actual clip file from blob storage
-        client = storage.Client()
-        bucket = client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(selected_clip.blob_filename)
+        # Fetch the actual clip file (from the local cache, if it's there)
+        clip_file = await asyncio.to_thread(selected_clip.fetch_clip_from_blob)
 
-        clip_bytes = io.BytesIO()
-        blob.download_to_file(clip_bytes)
-        clip_bytes.seek(0)
+        # Clips are stored in different formats, so send it with the
+        # same extension it was stored with
+        extension = os.path.splitext(selected_clip.blob_filename)[1]
 
         # Escapes the Discord markdown when there are underscores in the
         # transcription (primarily coming from Discord usernames)
         summary = selected_clip.transcription_summary.replace("_", "\\_")
 
-        await interaction.response.send_message(
-            f"**{selected_clip.timestamp_str}**\n"
-            f"{summary}",
-            file=File(clip_bytes, filename="clip.wav")
-        )
+        try:
+            await interaction.response.send_message(
+                f"**{selected_clip.timestamp_str}**\n"
+                f"{summary}",
+                file=File(clip_file, filename=f"clip{extension}")
+            )
+        finally:
+            clip_file.close()